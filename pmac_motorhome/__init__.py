@@ -1,5 +1,13 @@
-from pmac_motorhome._version_git import __version__
-
 # __all__ is a list of strings defining what symbols in a module will be
 # exported when from <module> import * is used on the module.
 __all__ = ["__version__"]
+
+
+def __getattr__(name):
+    # the version is looked up with git on first use, not at import time,
+    # because every PLC definition file imports this package
+    if name == "__version__":
+        from pmac_motorhome._version_git import __version__
+
+        return __version__
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
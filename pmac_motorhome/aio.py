@@ -0,0 +1,207 @@
+"""
+Generate PLCs from asyncio code without blocking the event loop.
+
+Declaring and rendering PLCs is ordinary blocking code, so each job runs in a
+worker thread. The in-scope Plc, Group and OnlyAxes are context variables and
+every job runs in a fresh context, so jobs in different threads never see
+each other's state.
+
+A job is either a definition, a function that declares PLCs using
+`pmac_motorhome.commands`, or a `pmac_motorhome.plc.Plc` model that has already
+been declared, for example one loaded with `pmac_motorhome.ir.load`::
+
+    def bl99i_step_01():
+        with plc(plc_num=11, controller="GeoBrick", filepath="PLC11_HM.pmc"):
+            with group(group_num=2):
+                motor(axis=1)
+                home_hsw()
+
+    async def main():
+        async with AsyncGenerator(concurrency=4) as generator:
+            async for output in generator.generate([bl99i_step_01, model]):
+                print(output.plc_num, output.text)
+"""
+
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Iterable, List, Optional, Set, Union
+
+from .plc import Plc, PlcOutput, capture
+
+#: A function that declares PLCs, or a Plc model to render
+Job = Union[Callable[[], Any], Plc]
+
+
+@dataclass
+class RenderedPlc(PlcOutput):
+    """
+    A record of one PLC generated by `AsyncGenerator`
+
+    Args:
+        text (Optional[str]): The PLC code, None if it was written to filepath
+            instead or if generation failed
+    """
+
+    text: Optional[str] = None
+
+
+def _declare(definition: Callable[[], Any]) -> List[Plc]:
+    with capture() as plcs:
+        definition()
+    return plcs
+
+
+class AsyncGenerator:
+    """
+    Declares and renders PLCs in a pool of worker threads, as awaitable jobs
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 4,
+        write: bool = False,
+        write_if_changed: bool = False,
+    ) -> None:
+        """
+        Args:
+            concurrency (int): the greatest number of jobs to run at once,
+                the rest wait for a free worker
+            write (bool): write each PLC to its filepath, otherwise return
+                its text
+            write_if_changed (bool): when writing, leave output files whose
+                content would not change untouched
+
+        Raises:
+            ValueError: concurrency is less than 1
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency should be at least 1")
+        self.write = write
+        self.write_if_changed = write_if_changed
+        self.executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="pmac_motorhome"
+        )
+        # the jobs submitted to the executor that have not finished, so that
+        # close can cancel them (shutdown(cancel_futures=True) needs python 3.9)
+        self.pending: "Set[Future]" = set()
+        self.pending_lock = threading.Lock()
+
+    async def __aenter__(self) -> "AsyncGenerator":
+        return self
+
+    async def __aexit__(self, exception_type, exception_value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Stop the worker threads. Jobs that have not started are abandoned.
+        """
+        with self.pending_lock:
+            pending = list(self.pending)
+        for future in pending:
+            future.cancel()
+        self.executor.shutdown(wait=False)
+
+    def _finished(self, future: Future) -> None:
+        with self.pending_lock:
+            self.pending.discard(future)
+
+    async def _run(self, function: Callable, *args) -> Any:
+        # a job that is cancelled before a worker picks it up never runs
+        context = contextvars.Context()
+        future = self.executor.submit(context.run, function, *args)
+        with self.pending_lock:
+            self.pending.add(future)
+        future.add_done_callback(self._finished)
+        return await asyncio.wrap_future(future)
+
+    async def declare(self, definition: Callable[[], Any]) -> List[Plc]:
+        """
+        Call a function that declares PLCs, without writing them
+
+        Args:
+            definition (Callable[[], Any]): the function
+
+        Returns:
+            List[Plc]: the Plc models it declared, ready for `render`
+        """
+        return await self._run(_declare, definition)
+
+    async def render(self, plc: Plc) -> RenderedPlc:
+        """
+        Render a Plc model
+
+        Args:
+            plc (Plc): the Plc model
+
+        Returns:
+            RenderedPlc: the PLC's text or whether it was written, or the
+                reason for failure
+        """
+        return await self._run(self._render, plc)
+
+    def _render(self, plc: Plc) -> RenderedPlc:
+        start = time.perf_counter()
+        error, changed, text = None, False, None
+        try:
+            if self.write:
+                changed = plc.write(only_if_changed=self.write_if_changed)
+            else:
+                text = plc.render()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        seconds = time.perf_counter() - start
+        return RenderedPlc(
+            plc.plc_num, plc.filepath, seconds, error, changed=changed, text=text
+        )
+
+    async def _declare_job(self, definition: Callable[[], Any]) -> Any:
+        start = time.perf_counter()
+        try:
+            return await self.declare(definition)
+        except Exception as e:
+            seconds = time.perf_counter() - start
+            return RenderedPlc(0, Path(), seconds, f"{type(e).__name__}: {e}")
+
+    async def generate(self, jobs: Iterable[Job]) -> AsyncIterator[RenderedPlc]:
+        """
+        Run many jobs and yield each PLC as soon as it has been generated, so
+        PLCs arrive in order of completion rather than in the order of jobs.
+
+        A definition that raises an exception gives a single RenderedPlc with
+        plc_num 0 and the error. Cancelling the task that iterates, or leaving
+        the iteration early, cancels all of the jobs that have not started.
+
+        Args:
+            jobs (Iterable[Job]): definition functions and Plc models
+
+        Yields:
+            RenderedPlc: each PLC generated
+        """
+        pending: Set["asyncio.Future[Any]"] = set()
+        for job in jobs:
+            if isinstance(job, Plc):
+                pending.add(asyncio.ensure_future(self.render(job)))
+            else:
+                pending.add(asyncio.ensure_future(self._declare_job(job)))
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in done:
+                    result = future.result()
+                    if isinstance(result, RenderedPlc):
+                        yield result
+                    else:
+                        # the PLCs declared by a definition are rendered next
+                        for plc in result:
+                            pending.add(asyncio.ensure_future(self.render(plc)))
+        finally:
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,85 @@
+"""
+A cache of the per-axis code fragments generated by the Group and Plc
+callback functions.
+
+The callback functions build PLC code by formatting a string once for each
+motor and joining the results. The same callbacks are made many times while
+rendering a PLC (e.g. every wait_for_done checks in_pos, following_err and
+limits) so an `AxisTable` keeps the formatted fragments and joined results
+for a fixed list of motors. The owner of the table discards it whenever its
+list of motors changes.
+"""
+
+from typing import Dict, Hashable, Sequence, Tuple
+
+from .motor import Motor
+
+
+class AxisTable:
+    """
+    The formatting values for a fixed list of motors, plus the code fragments
+    already generated from them
+    """
+
+    def __init__(self, motors: Sequence[Motor]) -> None:
+        """
+        Args:
+            motors (Sequence[Motor]): the motors in the order that their
+                fragments should appear in the generated code
+        """
+        self.axes: Tuple[int, ...] = tuple(motor.axis for motor in motors)
+        # the formatting values of each motor, see Motor.dict
+        self._rows = [motor.dict for motor in motors]
+        self._fragments: Dict[Hashable, Tuple[str, ...]] = {}
+        self._joined: Dict[Hashable, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.axes)
+
+    def fragments(self, format: str, *arg) -> Tuple[str, ...]:
+        """
+        Apply each motor to a format string
+
+        Args:
+            format (str): The format string. Each motor's values may be addressed
+                by name e.g. {axis}
+            arg ([Any]): additional positional arguments to the format string
+
+        Returns:
+            Tuple[str, ...]: one formatted string per motor
+        """
+        key = (format, arg)
+        try:
+            return self._fragments[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # unhashable extra arguments cannot be cached
+            return tuple(format.format(*arg, **row) for row in self._rows)
+        result = tuple(format.format(*arg, **row) for row in self._rows)
+        self._fragments[key] = result
+        return result
+
+    def join(self, format: str, separator: str, *arg) -> str:
+        """
+        Apply each motor to a format string and join the results
+
+        Args:
+            format (str): The format string, see `AxisTable.fragments`
+            separator (str): Separator that goes between the formatted string for
+                each axis
+            arg ([Any]): additional positional arguments to the format string
+
+        Returns:
+            str: The resulting command string
+        """
+        key = (format, separator, arg)
+        try:
+            return self._joined[key]
+        except KeyError:
+            pass
+        except TypeError:
+            return separator.join(self.fragments(format, *arg))
+        result = separator.join(self.fragments(format, *arg))
+        self._joined[key] = result
+        return result
@@ -0,0 +1,297 @@
+"""
+Functions for generating many homing PLCs in one go.
+
+Each PLC definition file is executed exactly as if it had been run from
+the command line in its own folder, and the PLCs that it declares are
+collected into a `BuildResult`. Independent definition files can be run in
+parallel across a pool of worker processes.
+"""
+
+import logging
+import os
+import re
+import runpy
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence, Set
+
+from . import ir
+from .group import Group
+from .onlyaxes import OnlyAxes
+from .plc import Plc, PlcOutput
+
+log = logging.getLogger(__name__)
+
+# a python file that imports pmac_motorhome.commands is a PLC definition file
+definition_import = re.compile(r"^\s*(from|import)\s+pmac_motorhome\.commands\b", re.M)
+# folders that never contain PLC definition files
+ignored_folders = {"__pycache__", "node_modules", "venv"}
+# packages whose modules stay imported between definition files, including
+# those that pmac_motorhome imports lazily
+KEEP_PACKAGES = {"pmac_motorhome", "jinja2", "markupsafe", "click"}
+
+
+@dataclass
+class BuildResult:
+    """
+    The outcome of executing one PLC definition file
+
+    Args:
+        script (Path): The definition file
+        plcs (List[PlcOutput]): The PLCs declared by the definition file
+        seconds (float): Time taken to execute the definition file
+        error (Optional[str]): Traceback if the definition file failed
+    """
+
+    script: Path
+    plcs: List[PlcOutput] = field(default_factory=list)
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and all(plc.ok for plc in self.plcs)
+
+
+def _reset_contexts() -> None:
+    """
+    Clear the in-scope Plc, Group and OnlyAxes left behind by a failed
+    definition file
+    """
+    Plc.current.set(None)
+    Group.current.set(None)
+    OnlyAxes.current.set(None)
+
+
+def is_definition(path: Path) -> bool:
+    """
+    Determine if a python file is a PLC definition file
+    """
+    try:
+        text = path.read_text(errors="replace")
+    except OSError:
+        return False
+    return definition_import.search(text) is not None
+
+
+def discover(paths: Iterable[Path]) -> List[Path]:
+    """
+    Find the PLC definition files in some folders.
+
+    Folders are searched recursively, skipping hidden folders and virtual
+    environments. Files are always included, whatever their content.
+
+    Args:
+        paths (Iterable[Path]): Definition files and folders to search
+
+    Returns:
+        List[Path]: The definition files found, in a stable order
+    """
+    scripts: List[Path] = []
+    for path in map(Path, paths):
+        if not path.is_dir():
+            scripts.append(path)
+            continue
+        found = []
+        for folder, folders, files in os.walk(path):
+            # prune the folders that os.walk will visit next
+            folders[:] = [
+                name
+                for name in folders
+                if not name.startswith(".") and name not in ignored_folders
+            ]
+            for name in files:
+                file = Path(folder) / name
+                if name.endswith(".py") and is_definition(file):
+                    found.append(file)
+        scripts += sorted(found)
+    return scripts
+
+
+def build_script(
+    script: Path,
+    args: Sequence[str] = (),
+    incremental: bool = False,
+    write_if_changed: bool = False,
+    ir_dir: Optional[Path] = None,
+) -> BuildResult:
+    """
+    Execute a PLC definition file in this process and record the PLCs
+    that it generates.
+
+    Args:
+        script (Path): The definition file to execute
+        args (Sequence[str]): Command line arguments to pass to the definition
+            file in sys.argv
+        incremental (bool): skip rendering PLCs that are unchanged since they
+            were last generated, see `pmac_motorhome.manifest`
+        write_if_changed (bool): only replace output files whose content has
+            changed
+        ir_dir (Optional[Path]): save the IR of each PLC into this directory,
+            see `pmac_motorhome.ir`
+
+    Returns:
+        BuildResult: The PLCs generated with their timings, or the reason for
+            failure
+    """
+    script = Path(script)
+    result = BuildResult(script)
+    saved_argv = sys.argv
+    saved_cwd = os.getcwd()
+    saved_path = list(sys.path)
+    saved_modules = set(sys.modules)
+    sys.argv = [str(script), *args]
+    # context variables, so that other threads can build at the same time
+    outputs_token = Plc.outputs.set(result.plcs)
+    incremental_token = Plc.incremental.set(incremental)
+    write_if_changed_token = Plc.write_if_changed.set(write_if_changed)
+    ir_dir_token = Plc.ir_dir.set(Path(ir_dir).absolute() if ir_dir else None)
+    start = time.perf_counter()
+    # definition files give output paths relative to their own folder and
+    # may import modules that sit alongside them
+    folder = script.parent.absolute()
+    try:
+        os.chdir(folder)
+        sys.path.insert(0, str(folder))
+        runpy.run_path(str(script.absolute()), run_name="__main__")
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            result.error = f"{script} exited with {e.code}"
+    except Exception:
+        result.error = traceback.format_exc()
+        log.error(f"failed to build {script}\n{result.error}")
+        _reset_contexts()
+    finally:
+        result.seconds = time.perf_counter() - start
+        Plc.outputs.reset(outputs_token)
+        Plc.incremental.reset(incremental_token)
+        Plc.write_if_changed.reset(write_if_changed_token)
+        Plc.ir_dir.reset(ir_dir_token)
+        sys.argv = saved_argv
+        sys.path[:] = saved_path
+        os.chdir(saved_cwd)
+        _forget_modules(saved_modules, saved_path, saved_cwd, folder)
+
+    return result
+
+
+def _forget_modules(
+    saved: Set[str], saved_path: List[str], saved_cwd: str, folder: Path
+) -> None:
+    """
+    Forget the modules that a definition file imported from its own folder, or
+    from any other folder that is not on the saved sys.path. Otherwise the
+    next definition file to import a module of the same name, such as a
+    helper.py in its own folder, would silently get this one instead.
+
+    pmac_motorhome and its dependencies are never forgotten, even when they
+    are in the folder, for example a source tree that holds definition files.
+    """
+    # relative entries such as '' are relative to the original current folder
+    roots = {Path(saved_cwd, entry).absolute() for entry in saved_path}
+    roots.add(folder)
+    for name in set(sys.modules) - saved:
+        if name.partition(".")[0] in KEEP_PACKAGES:
+            continue
+        filename = getattr(sys.modules[name], "__file__", None)
+        if filename is None:
+            continue
+        path = Path(filename).absolute()
+        # the module was imported from the innermost folder that contains it
+        found = [root for root in roots if root in path.parents]
+        if not found or max(found, key=lambda root: len(root.parts)) == folder:
+            del sys.modules[name]
+
+
+def build(
+    scripts: Sequence[Path],
+    jobs: int = 1,
+    args: Sequence[str] = (),
+    incremental: bool = False,
+    write_if_changed: bool = False,
+    ir_dir: Optional[Path] = None,
+) -> List[BuildResult]:
+    """
+    Execute many PLC definition files, optionally in parallel.
+
+    Args:
+        scripts (Sequence[Path]): The definition files to execute
+        jobs (int): The number of worker processes to use. With 1 the
+            definition files are executed one at a time in this process
+        args (Sequence[str]): Command line arguments to pass to every
+            definition file
+        incremental (bool): skip rendering PLCs that are unchanged since they
+            were last generated
+        write_if_changed (bool): only replace output files whose content has
+            changed
+        ir_dir (Optional[Path]): save the IR of each PLC into this directory
+
+    Returns:
+        List[BuildResult]: One result per definition file in the same order
+            as scripts
+    """
+    if jobs < 1:
+        raise ValueError("jobs should be at least 1")
+
+    options = (args, incremental, write_if_changed, ir_dir)
+    if jobs == 1 or len(scripts) < 2:
+        return [build_script(script, *options) for script in scripts]
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(scripts))) as pool:
+        futures = [pool.submit(build_script, script, *options) for script in scripts]
+        return [future.result() for future in futures]
+
+
+def render_ir(path: Path, write_if_changed: bool = False) -> PlcOutput:
+    """
+    Render a PLC from its saved IR without executing its definition file
+
+    Args:
+        path (Path): A file written by `pmac_motorhome.ir.dump`
+        write_if_changed (bool): only replace the output file if its content has
+            changed
+
+    Returns:
+        PlcOutput: The PLC generated with its timing, or the reason for failure
+    """
+    start = time.perf_counter()
+    plc_num, filepath, error, changed = 0, Path(path), None, False
+    try:
+        plc = ir.load(path)
+        plc_num, filepath = plc.plc_num, plc.filepath
+        changed = plc.write(only_if_changed=write_if_changed)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        log.error(f"failed to render {path}: {error}")
+    seconds = time.perf_counter() - start
+    return PlcOutput(plc_num, filepath, seconds, error, changed=changed)
+
+
+def render_all_ir(
+    paths: Sequence[Path], jobs: int = 1, write_if_changed: bool = False
+) -> List[PlcOutput]:
+    """
+    Render many PLCs from their saved IR, optionally in parallel.
+
+    Args:
+        paths (Sequence[Path]): Files written by `pmac_motorhome.ir.dump`
+        jobs (int): The number of worker processes to use
+        write_if_changed (bool): only replace output files whose content has
+            changed
+
+    Returns:
+        List[PlcOutput]: One result per IR file in the same order as paths
+    """
+    if jobs < 1:
+        raise ValueError("jobs should be at least 1")
+
+    if jobs == 1 or len(paths) < 2:
+        return [render_ir(path, write_if_changed) for path in paths]
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(paths))) as pool:
+        futures = [pool.submit(render_ir, path, write_if_changed) for path in paths]
+        return [future.result() for future in futures]
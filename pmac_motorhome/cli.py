@@ -0,0 +1,204 @@
+"""
+The pmac_motorhome command line interface
+"""
+
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import click
+
+from .build import BuildResult, build, discover, render_all_ir
+from .plc import PlcOutput
+
+log = logging.getLogger(__name__)
+
+
+def print_plc(plc: PlcOutput, indent: int = 0) -> None:
+    """
+    Print the outcome of generating one PLC
+    """
+    if not plc.ok:
+        status = f"FAILED {plc.error}"
+    elif plc.skipped:
+        status = "up to date"
+    else:
+        status = "changed" if plc.changed else "unchanged"
+    timing = f"({plc.seconds:.3f}s)"
+    click.echo(f"{' ' * indent}PLC{plc.plc_num} {plc.filepath} {status} {timing}")
+
+
+def print_results(results: List[BuildResult]) -> None:
+    """
+    Print the PLCs generated by each definition file with their timings
+    """
+    for result in results:
+        status = "ok" if result.ok else "FAILED"
+        click.echo(f"{result.script}: {status} ({result.seconds:.3f}s)")
+        for plc in result.plcs:
+            print_plc(plc, indent=4)
+        if result.error:
+            click.echo(result.error, err=True)
+
+
+def print_summary(plcs: List[PlcOutput], seconds: float) -> None:
+    """
+    Print the number of PLCs with each outcome and the total time taken
+    """
+    counts = {
+        "changed": sum(plc.ok and plc.changed for plc in plcs),
+        "unchanged": sum(plc.ok and not (plc.changed or plc.skipped) for plc in plcs),
+        "up to date": sum(plc.ok and plc.skipped for plc in plcs),
+        "failed": sum(not plc.ok for plc in plcs),
+    }
+    detail = ", ".join(f"{count} {name}" for name, count in counts.items() if count)
+    click.echo(f"{len(plcs)} PLC(s) in {seconds:.3f}s: {detail or 'none'}")
+
+
+@click.group()
+@click.option("--debug/--no-debug", default=False)
+@click.version_option()
+def pmac_motorhome(debug: bool):
+    """Generate homing PLCs for Delta Tau motion controllers"""
+    logging.basicConfig(level=logging.DEBUG if debug else logging.WARNING)
+
+
+@pmac_motorhome.command("build")
+@click.argument("paths", type=click.Path(exists=True), nargs=-1, required=True)
+@click.option(
+    "-j", "--jobs", default=1, help="number of worker processes, 0 for one per CPU"
+)
+@click.option(
+    "-i", "--incremental", is_flag=True, help="skip PLCs that have not changed"
+)
+@click.option(
+    "--write-if-changed",
+    is_flag=True,
+    help="leave output files with unchanged content untouched",
+)
+@click.option(
+    "--ir-dir",
+    type=click.Path(file_okay=False, exists=True),
+    help="save the intermediate representation of each PLC in this directory",
+)
+def build_command(
+    paths: Sequence[str],
+    jobs: int,
+    incremental: bool,
+    write_if_changed: bool,
+    ir_dir: Optional[str],
+):
+    """
+    Generate the PLCs declared by PLC definition files.
+
+    PATHS are definition files, or folders such as a motion area that are
+    searched for python files importing pmac_motorhome.commands. Each
+    definition file is executed in its own folder.
+    """
+    start = time.perf_counter()
+    scripts = discover(Path(path) for path in paths)
+    if not scripts:
+        click.echo("no PLC definition files found", err=True)
+        sys.exit(1)
+    results = build(
+        scripts,
+        jobs=jobs or os.cpu_count() or 1,
+        incremental=incremental,
+        write_if_changed=write_if_changed,
+        ir_dir=Path(ir_dir) if ir_dir else None,
+    )
+    print_results(results)
+    plcs = [plc for result in results for plc in result.plcs]
+    print_summary(plcs, time.perf_counter() - start)
+    if not all(result.ok for result in results):
+        sys.exit(1)
+
+
+@pmac_motorhome.command("render")
+@click.argument(
+    "models", type=click.Path(dir_okay=False, exists=True), nargs=-1, required=True
+)
+@click.option(
+    "-j", "--jobs", default=1, help="number of worker processes, 0 for one per CPU"
+)
+@click.option(
+    "--write-if-changed",
+    is_flag=True,
+    help="leave output files with unchanged content untouched",
+)
+def render_command(models: Sequence[str], jobs: int, write_if_changed: bool):
+    """
+    Generate PLCs from intermediate representation files saved by
+    'build --ir-dir' without executing their definition files
+    """
+    paths = [Path(model) for model in models]
+    start = time.perf_counter()
+    outputs = render_all_ir(
+        paths, jobs=jobs or os.cpu_count() or 1, write_if_changed=write_if_changed
+    )
+    for output in outputs:
+        print_plc(output)
+    print_summary(outputs, time.perf_counter() - start)
+    if not all(output.ok for output in outputs):
+        sys.exit(1)
+
+
+@pmac_motorhome.command("watch")
+@click.argument("paths", type=click.Path(exists=True), nargs=-1, required=True)
+@click.option(
+    "--poll", is_flag=True, help="poll for changes even if inotify is available"
+)
+def watch_command(paths: Sequence[str], poll: bool):
+    """
+    Generate the PLCs declared by PLC definition files, then regenerate them
+    whenever a definition file or snippet template that they use changes.
+
+    PATHS are as for the build command. Stop with Ctrl-C.
+    """
+    from .watch import Watcher
+
+    scripts = discover(Path(path) for path in paths)
+    if not scripts:
+        click.echo("no PLC definition files found", err=True)
+        sys.exit(1)
+    watcher = Watcher(scripts, poll=poll)
+    start = time.perf_counter()
+    outputs = watcher.build()
+    print_summary(outputs, time.perf_counter() - start)
+    click.echo("watching for changes...")
+
+    def report(outputs: List[PlcOutput]):
+        for output in outputs:
+            print_plc(output)
+
+    try:
+        watcher.watch(report)
+    except KeyboardInterrupt:
+        pass
+
+
+@pmac_motorhome.command("serve")
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(dir_okay=False),
+    help="the Unix socket to listen on, by default $PMAC_MOTORHOME_SOCKET or "
+    "pmac_motorhome-<uid>.sock in $XDG_RUNTIME_DIR",
+)
+def serve_command(socket_path: Optional[str]):
+    """
+    Run a daemon that keeps pmac_motorhome and its templates loaded, and
+    generates PLCs on request from pmac_motorhome_client. Stop with Ctrl-C
+    or 'pmac_motorhome_client stop'.
+    """
+    from .daemon import Daemon
+
+    daemon = Daemon(Path(socket_path) if socket_path else None)
+    click.echo(f"listening on {daemon.socket_path}")
+    try:
+        daemon.serve()
+    except KeyboardInterrupt:
+        pass
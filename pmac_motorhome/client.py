@@ -0,0 +1,280 @@
+"""
+A thin client for the PLC generation daemon, see `pmac_motorhome.daemon`.
+
+This module only imports the standard library so that it starts quickly.
+Use it from python with `Client`, or from the command line::
+
+    pmac_motorhome_client build BL99I_Motion
+    pmac_motorhome_client render --print PLC11.pmc.ir
+
+Requests and replies are JSON objects, one per line, sent over a Unix socket.
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+# environment variable that overrides the default socket path
+SOCKET_ENV = "PMAC_MOTORHOME_SOCKET"
+
+
+def default_socket_path() -> Path:
+    """
+    The Unix socket that the daemon listens on by default. This is
+    $PMAC_MOTORHOME_SOCKET if set, otherwise a socket in the user's runtime
+    directory, or in a private folder of the temporary directory.
+    """
+    if os.environ.get(SOCKET_ENV):
+        return Path(os.environ[SOCKET_ENV])
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return (
+            Path(os.environ["XDG_RUNTIME_DIR"]) / f"pmac_motorhome-{os.getuid()}.sock"
+        )
+    folder = Path(os.environ.get("TMPDIR") or "/tmp") / f"pmac_motorhome-{os.getuid()}"
+    return folder / "daemon.sock"
+
+
+def check_private(path: Path) -> None:
+    """
+    Check that only the current user can use a path. Anyone who can connect
+    to the daemon can make it run definition files as its owner, and anyone
+    who can replace its socket can pretend to be the daemon.
+
+    Args:
+        path (Path): a folder or socket
+
+    Raises:
+        OSError: the path belongs to another user or others can write to it
+    """
+    status = path.stat()
+    if status.st_uid != os.getuid() or status.st_mode & 0o022:
+        raise OSError(f"{path} is not private to the current user")
+
+
+class DaemonError(Exception):
+    """
+    The daemon could not be reached or rejected a request
+    """
+
+
+class Client:
+    """
+    A connection to the daemon. Many requests may be sent over one connection.
+    """
+
+    def __init__(
+        self, socket_path: Optional[Path] = None, timeout: Optional[float] = None
+    ) -> None:
+        """
+        Args:
+            socket_path (Optional[Path]): The daemon's socket, None for
+                `default_socket_path`
+            timeout (Optional[float]): seconds to wait for each reply, None to
+                wait indefinitely
+
+        Raises:
+            DaemonError: the daemon is not running
+        """
+        self.socket_path = Path(socket_path or default_socket_path())
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        try:
+            check_private(self.socket_path)
+            self.socket.connect(str(self.socket_path))
+        except OSError as e:
+            self.socket.close()
+            raise DaemonError(f"cannot connect to {self.socket_path}: {e}")
+        self.stream = self.socket.makefile("rwb")
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.stream.close()
+        self.socket.close()
+
+    def request(self, command: str, **args) -> Dict[str, Any]:
+        """
+        Send a request and wait for the reply
+
+        Args:
+            command (str): the name of the request, see `pmac_motorhome.daemon`
+            args: the parameters of the request
+
+        Returns:
+            Dict[str, Any]: the reply
+
+        Raises:
+            DaemonError: the daemon could not handle the request
+        """
+        self.stream.write(json.dumps(dict(args, command=command)).encode() + b"\n")
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line:
+            raise DaemonError("the daemon closed the connection")
+        reply = json.loads(line)
+        if "error" in reply and "plcs" not in reply:
+            raise DaemonError(reply["error"])
+        return reply
+
+    def ping(self) -> Dict[str, Any]:
+        """
+        Check that the daemon is running
+
+        Returns:
+            Dict[str, Any]: the daemon's process id and version
+        """
+        return self.request("ping")
+
+    def stop(self) -> None:
+        """
+        Ask the daemon to exit
+        """
+        self.request("stop")
+
+    def build(
+        self,
+        paths: Sequence[Union[str, Path]],
+        args: Sequence[str] = (),
+        incremental: bool = False,
+        write_if_changed: bool = False,
+        write: bool = True,
+    ) -> Dict[str, Any]:
+        """
+        Execute PLC definition files in the daemon
+
+        Args:
+            paths (Sequence[Union[str, Path]]): Definition files, or folders to
+                search for definition files
+            args (Sequence[str]): Command line arguments for the definition files
+            incremental (bool): skip PLCs that have not changed
+            write_if_changed (bool): only replace output files whose content
+                has changed
+            write (bool): write the output files, otherwise return the text of
+                each PLC
+
+        Returns:
+            Dict[str, Any]: 'ok', and 'plcs': a description of each PLC
+        """
+        return self.request(
+            "build",
+            paths=[str(Path(path).absolute()) for path in paths],
+            args=list(args),
+            incremental=incremental,
+            write_if_changed=write_if_changed,
+            write=write,
+        )
+
+    def render(
+        self,
+        models: Sequence[Union[str, Path, Dict[str, Any]]],
+        write: bool = True,
+        write_if_changed: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Render PLCs from their intermediate representation, see
+        `pmac_motorhome.ir`
+
+        Args:
+            models (Sequence[Union[str, Path, Dict[str, Any]]]): IR files, or
+                the IR as returned by `pmac_motorhome.ir.to_dict`
+            write (bool): write the output files, otherwise return the text of
+                each PLC
+            write_if_changed (bool): only replace output files whose content
+                has changed
+
+        Returns:
+            Dict[str, Any]: 'ok', and 'plcs': a description of each PLC
+        """
+        return self.request(
+            "render",
+            models=[
+                model if isinstance(model, dict) else str(Path(model).absolute())
+                for model in models
+            ],
+            write=write,
+            write_if_changed=write_if_changed,
+        )
+
+
+def format_plc(plc: Dict[str, Any]) -> str:
+    """
+    Describe the outcome of generating one PLC in the same way as the
+    pmac_motorhome command
+    """
+    if plc["error"]:
+        status = f"FAILED {plc['error']}"
+    elif plc["skipped"]:
+        status = "up to date"
+    else:
+        status = "changed" if plc["changed"] else "unchanged"
+    return f"PLC{plc['plc_num']} {plc['filepath']} {status} ({plc['seconds']:.3f}s)"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="pmac_motorhome_client",
+        description="Generate homing PLCs using a running 'pmac_motorhome serve'",
+    )
+    parser.add_argument("--socket", type=Path, help="the daemon's Unix socket")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="execute PLC definition files")
+    build.add_argument("paths", nargs="+", help="definition files or folders")
+    build.add_argument("-i", "--incremental", action="store_true")
+    build.add_argument("--write-if-changed", action="store_true")
+    build.add_argument(
+        "--print", action="store_true", help="print each PLC instead of writing it"
+    )
+    render = commands.add_parser("render", help="render PLCs from IR files")
+    render.add_argument("models", nargs="+", help="IR files")
+    render.add_argument("--write-if-changed", action="store_true")
+    render.add_argument(
+        "--print", action="store_true", help="print each PLC instead of writing it"
+    )
+    commands.add_parser("ping", help="check that the daemon is running")
+    commands.add_parser("stop", help="stop the daemon")
+    options = parser.parse_args(argv)
+
+    try:
+        with Client(options.socket) as client:
+            if options.command == "ping":
+                print(client.ping())
+                return 0
+            if options.command == "stop":
+                client.stop()
+                return 0
+            if options.command == "build":
+                reply = client.build(
+                    options.paths,
+                    incremental=options.incremental,
+                    write_if_changed=options.write_if_changed,
+                    write=not options.print,
+                )
+            else:
+                reply = client.render(
+                    options.models,
+                    write=not options.print,
+                    write_if_changed=options.write_if_changed,
+                )
+    except DaemonError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    for plc in reply["plcs"]:
+        print(format_plc(plc), file=sys.stderr if options.print else sys.stdout)
+        if options.print and plc.get("text") is not None:
+            sys.stdout.write(plc["text"])
+    for error in reply.get("errors", []):
+        print(error, file=sys.stderr)
+    return 0 if reply["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,6 +9,7 @@ from pathlib import Path
 
 from pmac_motorhome.onlyaxes import OnlyAxes
 
+from .concurrent import Concurrent
 from .constants import ControllerType, PostHomeMove
 from .group import Group
 from .plc import Plc
@@ -20,7 +21,16 @@ from .snippets import (
 )
 
 
-def plc(plc_num, controller, filepath, timeout=600000, post=None):
+def plc(
+    plc_num,
+    controller,
+    filepath,
+    timeout=600000,
+    post=None,
+    skip_homed=False,
+    resumable=False,
+    extra_pvars_base=Plc.EXTRA_PVARS_BASE,
+):
     """
     Define a new PLC. Use this to create a new Plc context using the 'with'
     keyword.
@@ -34,12 +44,62 @@ def plc(plc_num, controller, filepath, timeout=600000, post=None):
         filepath (pathlib.Path): The output file where the PLC will be written
         pre (str): some raw PLC code to insert at the start of a group
         post(str): some raw PLC code to insert at the end of a group
+        skip_homed (bool): when all groups are homed, skip each group whose
+            axes are all already homed. Groups can override this, see `group`
+        resumable (bool): record each group that finishes homing in a bitmask,
+            HomingDone. When HomingResume is set to 1, homing all groups skips
+            the groups that are done, to resume after a failure
+
+            The two P variables are outside P{plc_num}00..99, see
+            `Plc.extra_pvar`
+        extra_pvars_base (int): concurrent and pipelined groups and resumable
+            PLCs use P variables outside P{plc_num}00..99, 100 for each PLC
+            from P(extra_pvars_base + plc_num * 100). Choose a base that does
+            not clash with other P variables on the controller. The generated
+            header lists the P variables used
 
     Returns:
         Plc: the Plc object for use in the context
     """
 
-    return Plc(plc_num, ControllerType(controller), Path(filepath), timeout, post)
+    return Plc(
+        plc_num,
+        ControllerType(controller),
+        Path(filepath),
+        timeout,
+        post,
+        skip_homed,
+        resumable,
+        extra_pvars_base,
+    )
+
+
+def coordinator(plc_num, controller, filepath, plcs):
+    """
+    Define and generate a coordinator PLC. When it runs, it starts the homing
+    PLCs plcs at the same time, each homing all of its groups, and aborts the
+    rest if one of them fails. Its own P{plc_num}00 and P{plc_num}01 show the
+    combined state and status, and P{plc_num}02 the PLC that failed first.
+
+    Unlike `plc`, this is not a context. Must be called in the global context.
+
+    Args:
+        plc_num (int): Number of the generated coordinator PLC
+        controller (ControllerType): Determines the class of controller Pmac or
+            Geobrick
+        filepath (pathlib.Path): The output file where the PLC will be written
+        plcs (List[int]): The numbers of the homing PLCs to run in parallel,
+            which must be on the same controller
+
+    Returns:
+        Plc: the coordinator Plc object
+    """
+    the_plc = Plc(plc_num, ControllerType(controller), Path(filepath), 0, None)
+    the_plc.coordinate(plcs)
+    # leaving the context generates the PLC, just like a homing PLC
+    with the_plc:
+        pass
+    return the_plc
 
 
 def group(
@@ -49,6 +109,8 @@ def group(
     comment=None,
     pre="",
     post="",
+    pipelined=False,
+    skip_homed=None,
 ):
     """
     Define a new group of axes within a PLC that should be homed simultaneously.
@@ -63,12 +125,26 @@ def group(
         axes (List[int]): a list of axis numbers to include in the group
         post_home (PostHomeMove): action to perform on all axes after the
             home sequence completes
+        pipelined (bool): move each axis on to the next stage of the sequence
+            as soon as it has finished the last one, instead of waiting for
+            all of the axes at every stage. Only suitable for axes that are
+            not coupled, see `pmac_motorhome.concurrent`
+        skip_homed (bool): when all groups are homed, skip this group if all of
+            its axes are already homed. In a pipelined group, skip each axis
+            that is already homed. None uses the setting of the PLC
 
     Returns:
         Group: The Group object for use in the context
     """
     return Plc.add_group(
-        group_num, PostHomeMove(post_home), post_distance, comment, pre, post
+        group_num,
+        PostHomeMove(post_home),
+        post_distance,
+        comment,
+        pre,
+        post,
+        pipelined,
+        skip_homed,
     )
 
 
@@ -90,8 +166,7 @@ def motor(axis, jdist=0, index=-1):
             the index of this motor to a different value than the order of
             declaration. -1 means use the order that motors were added.
     """
-    motor = Group.add_motor(axis, jdist, index)
-    Plc.add_motor(axis, motor)
+    Group.add_motor(Plc.get_motor(axis, jdist, index))
 
 
 def only_axes(*axes):
@@ -111,6 +186,20 @@ def only_axes(*axes):
     return OnlyAxes(*axes)
 
 
+def concurrent():
+    """
+    Creates a context in which the groups declared are mechanically independent,
+    so that they home at the same time when all groups are homed. Each group
+    still homes on its own when it is selected by itself.
+
+    Must be called in a Plc context, outside of any group.
+
+    Returns:
+        Concurrent: a Concurrent object for use in the context
+    """
+    return Concurrent()
+
+
 ###############################################################################
 # post_home actions to recreate post= from the original motorhome.py
 ###############################################################################
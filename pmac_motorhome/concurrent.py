@@ -0,0 +1,541 @@
+"""
+Home mechanically independent groups of a PLC at the same time.
+
+The code for a group waits for each move with a blocking ``while`` loop, so the
+groups of a PLC normally home one after another. Groups declared in a
+`Concurrent` context instead home together when all groups (group 1) are
+homed::
+
+    with plc(plc_num=11, controller="GeoBrick", filepath="PLC11_HM.pmc"):
+        with concurrent():
+            with group(group_num=2):
+                motor(axis=1)
+                home_hsw()
+            with group(group_num=3):
+                motor(axis=2)
+                home_rlim()
+
+The code for each group is rendered as normal and then converted into a state
+machine, with a step number that records where the group is waiting. On each
+PLC scan a single loop advances every group until it has to wait, just as the
+original while loops do. Each group has its own
+status and timer in place of HomingStatus and timer. The PLC timer is left
+running and measures the time between scans to count down the group timers.
+
+HomingStatus reports a paused group, or the first group to fail, and a
+failure or an abort stops all of the groups.
+
+The same state machines home the axes of a pipelined group, declared with
+``group(group_num=2, pipelined=True)``. Each stage of a sequence normally waits
+for every axis of the group, so one slow axis holds up all of the others. In a
+pipelined group each axis instead goes through the sequence with its own step,
+status and timer, as if it were a group of its own, and the group is done when
+all of its axes are. Snippets in an `only_axes` context only apply to the axes
+it names. Axes that must move together, for example to maintain an offset
+between them, should not be pipelined.
+"""
+
+import re
+from functools import partial
+from typing import TYPE_CHECKING, List, Optional, Sequence, Tuple, Union
+
+from .dialect import defer, deferring
+from .group import Group
+from .motor import Motor
+from .plc import Plc
+
+if TYPE_CHECKING:
+    from .groupcache import Renderer
+
+# where each lane's variables start in the extra P variables of its PLC,
+# see `Plc.extra_pvar`
+CLOCK_PVAR = 0
+ELAPSED_PVAR = 1
+GROUP_PVARS = 10
+PVARS_PER_GROUP = 3
+MAX_GROUPS = (Plc.EXTRA_PVARS_PER_PLC - GROUP_PVARS) // PVARS_PER_GROUP
+
+# the PLC timer counts down from its largest value and is reset before it
+# gets near zero
+TIMER_MAX = 8388607
+TIMER_RESET = 4194304
+
+INDENT = "    "
+
+
+class Concurrent:
+    """
+    Declares that the groups in this context are mechanically independent, so
+    that they can home at the same time
+
+    Should always be instantiated using `pmac_motorhome.commands.concurrent`
+    """
+
+    def __enter__(self):
+        assert not Group.current.get(), "cannot use concurrent within a group"
+        plc = Plc.instance()
+        assert plc.concurrent_set is None, "cannot use concurrent within concurrent"
+        plc.concurrent_set = []
+        plc.concurrent.append(plc.concurrent_set)
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        Plc.instance().concurrent_set = None
+
+
+class Statement:
+    """
+    A line of PLC code that is not part of a control structure
+    """
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+
+
+class If:
+    """
+    An if statement, whose condition may continue over several lines
+    """
+
+    def __init__(self, condition: List[str]) -> None:
+        self.condition = condition
+        self.then: List["Node"] = []
+        self.orelse: Optional[List["Node"]] = None
+
+
+class While:
+    """
+    A while loop, which waits until the next PLC scan after each iteration
+    """
+
+    def __init__(self, condition: List[str]) -> None:
+        self.condition = condition
+        self.body: List["Node"] = []
+
+
+Node = Union[Statement, If, While]
+
+
+def _keyword(line: str) -> str:
+    match = re.match(r"[a-z]+", line.lower())
+    return match.group() if match else ""
+
+
+def parse(code: str) -> List[Node]:
+    """
+    Parse the code for a group into a tree of control structures
+
+    Args:
+        code (str): PLC code
+
+    Returns:
+        List[Node]: the top level statements
+
+    Raises:
+        ValueError: The control structures are not balanced
+    """
+    lines = [line.strip() for line in code.splitlines() if line.strip()]
+    # the statement lists being filled, innermost last
+    stack: List[Tuple[Union[If, While, None], List[Node]]] = [(None, [])]
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        keyword = _keyword(line)
+        i += 1
+        if keyword in ("if", "while"):
+            condition = [line]
+            while i < len(lines) and _keyword(lines[i]) in ("and", "or"):
+                condition.append(lines[i])
+                i += 1
+            if keyword == "if":
+                branch = If(condition)
+                stack[-1][1].append(branch)
+                stack.append((branch, branch.then))
+            else:
+                loop = While(condition)
+                stack[-1][1].append(loop)
+                stack.append((loop, loop.body))
+        elif keyword == "else":
+            structure = stack[-1][0]
+            if not isinstance(structure, If) or structure.orelse is not None:
+                raise ValueError(f"unexpected '{line}'")
+            structure.orelse = []
+            stack[-1] = (structure, structure.orelse)
+        elif keyword in ("endif", "endi", "endw", "endwhile"):
+            expected = If if keyword.startswith("endi") else While
+            if not isinstance(stack[-1][0], expected):
+                raise ValueError(f"unexpected '{line}'")
+            stack.pop()
+        else:
+            stack[-1][1].append(Statement(line))
+    if len(stack) > 1:
+        raise ValueError("unterminated if or while")
+    return stack[0][1]
+
+
+def _waits(node: Node) -> bool:
+    """
+    Determine if a statement contains a while loop
+    """
+    if isinstance(node, While):
+        return True
+    if isinstance(node, If):
+        return any(map(_waits, node.then + (node.orelse or [])))
+    return False
+
+
+class StateMachine:
+    """
+    Converts the code for a group into steps that never wait. Each step is an
+    if statement on the step variable that ends by choosing the next step.
+    """
+
+    def __init__(self, step: str) -> None:
+        """
+        Args:
+            step (str): the name of the variable holding the current step
+        """
+        self.step = step
+        # the indented lines of code for each step, step 1 first, where a
+        # number in place of a line means go to that step
+        self.steps: List[List[Tuple[int, Union[str, int]]]] = []
+
+    def new_step(self) -> int:
+        self.steps.append([])
+        return len(self.steps)
+
+    def add(self, step: int, depth: int, text: str) -> None:
+        self.steps[step - 1].append((depth, text))
+
+    def goto(self, step: int, depth: int, target: int) -> None:
+        self.steps[step - 1].append((depth, target))
+
+    def copy(self, step: int, depth: int, nodes: List[Node]) -> None:
+        """
+        Add statements that do not wait to a step without changing them
+        """
+        for node in nodes:
+            if isinstance(node, Statement):
+                self.add(step, depth, node.text)
+            elif isinstance(node, If):
+                for line in node.condition:
+                    self.add(step, depth, line)
+                self.copy(step, depth + 1, node.then)
+                if node.orelse is not None:
+                    self.add(step, depth, "else")
+                    self.copy(step, depth + 1, node.orelse)
+                self.add(step, depth, "endif")
+            else:
+                raise ValueError("a while loop cannot be copied")
+
+    def convert(self, nodes: List[Node], step: int) -> int:
+        """
+        Add statements starting at a step
+
+        Returns:
+            int: the step that the code after the statements belongs to
+        """
+        for node in nodes:
+            if not _waits(node):
+                self.copy(step, 0, [node])
+            elif isinstance(node, If):
+                then = self.new_step()
+                orelse = self.new_step() if node.orelse is not None else None
+                join = self.new_step()
+                for line in node.condition:
+                    self.add(step, 0, line)
+                self.goto(step, 1, then)
+                self.add(step, 0, "else")
+                self.goto(step, 1, orelse or join)
+                self.add(step, 0, "endif")
+                self.goto(self.convert(node.then, then), 0, join)
+                if orelse is not None:
+                    self.goto(self.convert(node.orelse or [], orelse), 0, join)
+                step = join
+            else:
+                assert isinstance(node, While)
+                loop = self.new_step()
+                after = self.new_step()
+                self.goto(step, 0, loop)
+                # the loop is left unless its condition is still true
+                self.goto(loop, 0, after)
+                self.add(loop, 0, "if" + node.condition[0][len("while") :])
+                for line in node.condition[1:]:
+                    self.add(loop, 0, line)
+                if any(map(_waits, node.body)):
+                    body = self.new_step()
+                    self.goto(loop, 1, body)
+                    self.goto(self.convert(node.body, body), 0, loop)
+                else:
+                    self.copy(loop, 1, node.body)
+                    self.goto(loop, 1, loop)
+                self.add(loop, 0, "endif")
+                step = after
+        return step
+
+    def target(self, step: int) -> int:
+        """
+        Follow steps that do nothing but go to another step
+        """
+        while step > 1 and len(self.steps[step - 1]) == 1:
+            indent, line = self.steps[step - 1][0]
+            if not isinstance(line, int):
+                break
+            step = line
+        return step
+
+    def code(self, depth: int) -> List[str]:
+        """
+        Get the code for all of the steps, leaving out the steps that do
+        nothing but go to another step
+
+        Args:
+            depth (int): the indentation of the code
+        """
+        kept = [n for n in range(1, len(self.steps) + 1) if self.target(n) == n]
+        numbers = {old: new for new, old in enumerate(kept, start=1)}
+        numbers[0] = 0
+        lines = []
+        for old in kept:
+            lines.append(INDENT * depth + f"if ({self.step} = {numbers[old]})")
+            for indent, line in self.steps[old - 1]:
+                if isinstance(line, int):
+                    line = f"{self.step}={numbers[self.target(line)]}"
+                lines.append(INDENT * (depth + 1 + indent) + line)
+            lines.append(INDENT * depth + "endif")
+        return lines
+
+
+def group_machine(group: Group, code: str, name: Optional[str] = None) -> StateMachine:
+    """
+    Convert the code for a group into a state machine that uses the group's
+    own status and timer
+
+    Args:
+        group (Group): the group
+        code (str): the code rendered for the group
+        name (Optional[str]): the prefix of the names of the variables for the
+            group, Group{group_num} by default
+
+    Returns:
+        StateMachine: the steps for the group
+
+    Raises:
+        ValueError: the code cannot be converted
+    """
+    num = group.group_num
+    name = name or f"Group{num}"
+    code = re.sub(r"\bHomingStatus\b", f"{name}Status", code)
+    code = re.sub(r"\btimer\b", f"{name}Timer", code)
+    try:
+        nodes = parse(code)
+    except ValueError as e:
+        raise ValueError(f"cannot home group {num} concurrently: {e}")
+    machine = StateMachine(f"{name}Step")
+    machine.goto(machine.convert(nodes, machine.new_step()), 0, 0)
+    return machine
+
+
+def axis_lane(group: Group, motor: Motor) -> Group:
+    """
+    Make a copy of a pipelined group that homes just one of its axes
+
+    Args:
+        group (Group): the pipelined group
+        motor (Motor): the axis to home
+
+    Returns:
+        Group: a group with the one axis, without the snippets of any
+        `only_axes` context that does not include the axis
+    """
+    lane = Group(
+        group.group_num,
+        group.plc_num,
+        group.controller,
+        group.post_home,
+        group.post_distance,
+        group.comment,
+        group.pre,
+        group.post,
+        # a pipelined group is only done when all of its axes are, so the
+        # lanes leave recording that to render_concurrent
+        pipelined=True,
+        skip_homed=group.skip_homed,
+    )
+    lane.htype = group.htype
+    lane.all_motors = [motor]
+    lane.motors = lane.all_motors
+    included = True
+    for template in group.templates:
+        if template.function is Group.set_axis_filter:
+            # the lane only has the one axis, so it needs no axis filter
+            axes = template.args["axes"]
+            included = not axes or motor.axis in axes
+        elif included:
+            lane.templates.append(template)
+    return lane
+
+
+def lanes(groups: List[Group]) -> List[Tuple[str, Group]]:
+    """
+    Get the state machines to run for a set of groups, one for each group or
+    for each axis of a pipelined group
+
+    Args:
+        groups (List[Group]): the groups
+
+    Returns:
+        List[Tuple[str, Group]]: the prefix of the names of the variables of
+        each state machine, and the group that it homes
+    """
+    result = []
+    for group in groups:
+        num = group.group_num
+        if group.pipelined:
+            for motor in group.all_motors:
+                lane = axis_lane(group, motor)
+                result.append((f"Group{num}Axis{motor.axis}", lane))
+        else:
+            result.append((f"Group{num}", group))
+    return result
+
+
+def _define(name: str, pvar: int) -> str:
+    return f"#define {name:<17} P{pvar}"
+
+
+def render_concurrent(
+    plc: Plc, groups: List[Group], renderer: Optional["Renderer"] = None
+) -> str:
+    """
+    Render the code that homes a set of independent groups at the same time,
+    or the axes of a pipelined group
+
+    Args:
+        plc (Plc): the Plc that the groups belong to
+        groups (List[Group]): the groups, or a single pipelined group
+        renderer (Optional[Renderer]): renders the code for each group, see
+            `PlcGenerator.render_group`
+
+    Returns:
+        str: the code for the groups
+
+    Raises:
+        ValueError: a group cannot be homed concurrently
+    """
+    if deferring():
+        # the conversion needs the code for one controller type at a time
+        return defer(partial(render_concurrent, plc, groups, renderer))
+
+    nums = " ".join(str(group.group_num) for group in groups)
+    names, members = zip(*lanes(groups))
+    if len(names) > MAX_GROUPS:
+        raise ValueError(
+            f"at most {MAX_GROUPS} groups or axes may be homed concurrently"
+        )
+    machines = [
+        group_machine(lane, plc.generator.render_group(plc, lane, renderer), name)
+        for name, lane in zip(names, members)
+    ]
+
+    if len(groups) > 1:
+        code = [f";---- Concurrent Groups {nums} ----"]
+    else:
+        code = [f";---- Pipelined Group {nums} ----"]
+    # the clock is shared by every state machine loop in the PLC, and each
+    # loop reuses the same variables for its state machines
+    first = next(s for s in plc.group_sections() if len(s) > 1 or s[0].pipelined)
+    if groups[0] is first[0]:
+        code.append(_define("HomingClock", plc.extra_pvar(CLOCK_PVAR)))
+        code.append(_define("HomingElapsed", plc.extra_pvar(ELAPSED_PVAR)))
+    for index, name in enumerate(names):
+        pvar = plc.extra_pvar(GROUP_PVARS + index * PVARS_PER_GROUP)
+        code.append(_define(f"{name}Step", pvar))
+        code.append(_define(f"{name}Status", pvar + 1))
+        code.append(_define(f"{name}Timer", pvar + 2))
+    for name in names:
+        code += [f"{name}Step=1", f"{name}Status=HomingStatus", f"{name}Timer=0"]
+    code += [f"timer={TIMER_MAX}", "HomingClock=timer"]
+
+    code.append(f"while ({names[0]}Step != 0)")
+    code += [f"or ({name}Step != 0)" for name in names[1:]]
+    code += [
+        "    ;Count down the timer of each group",
+        "    HomingElapsed=HomingClock-timer",
+        f"    if (timer<{TIMER_RESET})",
+        f"        timer={TIMER_MAX}",
+        "    endif",
+        "    HomingClock=timer",
+    ]
+    code += [f"    {name}Timer={name}Timer-HomingElapsed" for name in names]
+    code += [
+        "    ;Continue paused groups when the operator continues",
+        "    if (HomingStatus = StatusDebugHoming)",
+    ]
+    for name in names:
+        code += [
+            f"        if ({name}Status = StatusPaused)",
+            f"            {name}Status=StatusDebugHoming",
+            "        endif",
+        ]
+    code.append("    endif")
+    for name, machine in zip(names, machines):
+        title = re.sub(r"([A-Za-z]+)([0-9]+)", r"\1 \2 ", name).strip()
+        code.append(f"    ;---- {title} ----")
+        code += machine.code(1)
+    code.append("    ;Report a paused group, or the first group to fail")
+    for name in names:
+        code += [
+            f"    if ({name}Status = StatusPaused)",
+            "        HomingStatus=StatusPaused",
+            "    endif",
+            "    if (HomingStatus = StatusHoming or HomingStatus = StatusDebugHoming"
+            " or HomingStatus = StatusPaused)",
+            f"    and ({name}Status != StatusHoming"
+            f" and {name}Status != StatusDebugHoming)",
+            f"    and ({name}Status != StatusPaused)",
+            f"        HomingStatus={name}Status",
+            "    endif",
+        ]
+    code += [
+        "    ;Stop all of the groups if one failed or homing was aborted",
+        "    if (HomingStatus != StatusHoming and HomingStatus != StatusDebugHoming)",
+        "    and (HomingStatus != StatusPaused)",
+    ]
+    for name in names:
+        code += [
+            f"        if ({name}Step != 0)",
+            f"            {name}Status=StatusAborted",
+            "        endif",
+        ]
+    code += ["    endif", "endw"]
+    for group in groups:
+        if plc.resumable and group.pipelined:
+            code += _record_done(group, names, members)
+    code += ["", ""]
+    return "\n".join(code)
+
+
+def _record_done(
+    group: Group, names: Sequence[str], members: Sequence[Group]
+) -> List[str]:
+    """
+    Generate the code that records that a pipelined group of a resumable PLC
+    is done, once all of its axes are
+    """
+    num = group.group_num
+    if num == 1:
+        code = [f";Record that group {num} is done", "if (HomingBackupGroup = 1)"]
+    else:
+        code = [
+            f";Record that group {num} is done",
+            f"if (HomingBackupGroup = 1 or HomingBackupGroup = {num})",
+        ]
+    for name, lane in zip(names, members):
+        if lane.group_num == num:
+            code.append(
+                f"and ({name}Status = StatusHoming"
+                f" or {name}Status = StatusDebugHoming)"
+            )
+    code += [f"    HomingDone=HomingDone|{group.done_bit}", "endif"]
+    return code
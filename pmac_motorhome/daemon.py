@@ -0,0 +1,236 @@
+"""
+A long running process that generates PLCs on request.
+
+Starting python, importing pmac_motorhome and compiling the snippet templates
+takes far longer than generating a typical PLC. The daemon does all of this
+once and then serves requests from `pmac_motorhome.client` over a Unix
+socket, so that each request only pays for the generation itself.
+
+Each request is a JSON object on a single line, and each reply is a JSON
+object on a single line. The requests are:
+
+- ``{"command": "build", "paths": [...], "args": [...], "incremental": false,
+  "write_if_changed": false, "write": true}`` executes the PLC definition
+  files found in paths, which must be absolute. Without write the content of
+  each PLC is returned instead of written.
+- ``{"command": "render", "models": [...], "write": true,
+  "write_if_changed": false}`` renders PLCs from their IR, given either as
+  IR file paths or as the data from `pmac_motorhome.ir.to_dict`. Without
+  write the content of each PLC is returned instead of written.
+- ``{"command": "ping"}`` returns the daemon's process id and version
+- ``{"command": "stop"}`` makes the daemon exit
+
+build and render reply with 'ok', 'plcs', a list of the fields of
+`pmac_motorhome.plc.PlcOutput` for each PLC, and 'errors', the tracebacks of
+any definition files that failed. A request that cannot be handled at all
+gets a reply with 'ok' false and an 'error'.
+"""
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+from contextlib import nullcontext
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from . import ir
+from .build import build_script, discover
+from .client import check_private, default_socket_path
+from .plc import Plc, PlcOutput, capture
+from .plcgenerator import PlcGenerator
+
+log = logging.getLogger(__name__)
+
+
+def warm_up() -> None:
+    """
+    Import everything that a PLC definition file uses and compile all of the
+    snippet templates
+    """
+    from . import commands, sequences, snippets  # noqa: F401
+
+    environment = PlcGenerator.get_environment()
+    for folder in PlcGenerator.snippet_folders():
+        for path in sorted(folder.glob("*.jinja")):
+            environment.get_template(path.name)
+
+
+def _describe(output: PlcOutput, text: Optional[str] = None) -> Dict[str, Any]:
+    description = asdict(output)
+    description["filepath"] = str(output.filepath)
+    if text is not None:
+        description["text"] = text
+    return description
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """
+    Serves the requests sent over one connection, one line at a time
+    """
+
+    server: "Daemon"
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                reply = self.server.dispatch(json.loads(line))
+            except Exception as e:
+                log.exception("request failed")
+                reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+            self.wfile.flush()
+
+
+class Daemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves requests to generate PLCs over a Unix socket, using one thread per
+    connection
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: Optional[Path] = None) -> None:
+        """
+        Args:
+            socket_path (Optional[Path]): the Unix socket to listen on, None for
+                `pmac_motorhome.client.default_socket_path`
+
+        Raises:
+            OSError: another daemon is already listening on the socket, or
+                other users can write to its folder
+        """
+        self.socket_path = Path(socket_path or default_socket_path())
+        self.socket_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        check_private(self.socket_path.parent)
+        self._remove_stale_socket()
+        # definition files change the working directory and sys.argv, so only
+        # one of them can run at a time
+        self.build_lock = threading.Lock()
+        super().__init__(str(self.socket_path), _Handler)
+
+    def server_bind(self) -> None:
+        # only the owner may connect, since requests run definition files
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+        os.chmod(self.socket_path, 0o600)
+
+    def _remove_stale_socket(self) -> None:
+        if not self.socket_path.exists():
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(str(self.socket_path))
+        except OSError:
+            # left behind by a daemon that did not exit cleanly
+            self.socket_path.unlink()
+        else:
+            raise OSError(f"a daemon is already listening on {self.socket_path}")
+        finally:
+            probe.close()
+
+    def serve(self) -> None:
+        """
+        Prepare to generate PLCs then serve requests until a stop request
+        """
+        warm_up()
+        log.info(f"listening on {self.socket_path}")
+        try:
+            self.serve_forever()
+        finally:
+            self.server_close()
+
+    def server_close(self) -> None:
+        super().server_close()
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+
+    def dispatch(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Handle one request
+
+        Args:
+            request (Dict[str, Any]): the request, see `pmac_motorhome.daemon`
+
+        Returns:
+            Dict[str, Any]: the reply
+        """
+        command = request.pop("command", None)
+        handlers: Dict[str, Callable[..., Dict[str, Any]]] = {
+            "build": self.build,
+            "render": self.render,
+            "ping": self.ping,
+            "stop": self.stop,
+        }
+        if command not in handlers:
+            return {"ok": False, "error": f"unknown command {command!r}"}
+        return handlers[command](**request)
+
+    def ping(self) -> Dict[str, Any]:
+        from . import __version__
+
+        return {"ok": True, "pid": os.getpid(), "version": __version__}
+
+    def stop(self) -> Dict[str, Any]:
+        # shutdown waits for serve_forever to return so cannot be called here
+        threading.Thread(target=self.shutdown).start()
+        return {"ok": True}
+
+    def build(
+        self,
+        paths: List[str],
+        args: Sequence[str] = (),
+        incremental: bool = False,
+        write_if_changed: bool = False,
+        write: bool = True,
+    ) -> Dict[str, Any]:
+        plcs, errors = [], []
+        scripts = discover(Path(path) for path in paths)
+        with self.build_lock:
+            for script in scripts:
+                captured: List[Plc] = []
+                with capture() if not write else nullcontext(captured) as captured:
+                    result = build_script(script, args, incremental, write_if_changed)
+                if result.error:
+                    errors.append(f"{script}:\n{result.error}")
+                texts = {plc.filepath: plc.render() for plc in captured}
+                for output in result.plcs:
+                    plcs.append(_describe(output, texts.get(output.filepath)))
+        ok = not errors and all(plc["error"] is None for plc in plcs)
+        return {"ok": ok, "plcs": plcs, "errors": errors}
+
+    def render(
+        self, models: List[Any], write: bool = True, write_if_changed: bool = False
+    ) -> Dict[str, Any]:
+        plcs = []
+        for model in models:
+            start = time.perf_counter()
+            plc_num, filepath, error, changed, text = 0, Path(), None, False, None
+            try:
+                # the output folder need not exist unless the PLC is written
+                with capture() if not write else nullcontext():
+                    if isinstance(model, str):
+                        filepath = Path(model)
+                        plc = ir.load(filepath)
+                    else:
+                        plc = ir.from_dict(model)
+                plc_num, filepath = plc.plc_num, plc.filepath
+                if write:
+                    changed = plc.write(only_if_changed=write_if_changed)
+                else:
+                    text = plc.render()
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                log.error(f"failed to render {filepath}: {error}")
+            seconds = time.perf_counter() - start
+            output = PlcOutput(plc_num, filepath, seconds, error, changed=changed)
+            plcs.append(_describe(output, text))
+        ok = all(plc["error"] is None for plc in plcs)
+        return {"ok": ok, "plcs": plcs, "errors": []}
@@ -0,0 +1,143 @@
+"""
+Render one Plc model for several controller dialects in a single pass.
+
+Almost all of a homing PLC is the same for every `ControllerType`. Only a few
+callbacks, such as `Plc.save_homed` and `Group.restore_home_flags`, emit
+different code, and these are marked with `dialect_specific`.
+
+`render_dialects` renders the model once. While it does, each dialect
+specific callback returns a placeholder and records how to call it. The
+placeholders are then replaced with the result of calling the callbacks
+again for each of the requested controllers.
+"""
+
+import re
+from contextvars import ContextVar
+from functools import partial, wraps
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, TypeVar
+
+from .constants import ControllerType
+
+if TYPE_CHECKING:
+    from .plc import Plc
+
+Callback = TypeVar("Callback", bound=Callable[..., str])
+
+# the callbacks deferred by the render in progress in this context, if any
+deferred: ContextVar[Optional[List[Callable[[], str]]]] = ContextVar(
+    "deferred", default=None
+)
+
+# placeholders contain a character that never appears in PLC code
+PLACEHOLDER = re.compile("\x00([0-9]+)\x00")
+
+
+def dialect_specific(callback: Callback) -> Callback:
+    """
+    A decorator for Plc and Group callbacks whose code depends on the
+    controller type, so that `render_dialects` evaluates them once for each
+    controller
+    """
+
+    @wraps(callback)
+    def wrapper(self, *args, **kwargs) -> str:
+        if deferred.get() is None:
+            return callback(self, *args, **kwargs)
+        if hasattr(self, "active_motors"):
+            # a Group, whose axis filter has changed by the time the callback
+            # is evaluated
+            return defer(
+                partial(_with_motors, callback, self, self.motors, *args, **kwargs)
+            )
+        return defer(partial(callback, self, *args, **kwargs))
+
+    return wrapper  # type: ignore
+
+
+def _with_motors(callback: Callable[..., str], group, motors, *args, **kwargs) -> str:
+    """
+    Call a Group callback with the motors that were active when it was deferred
+    """
+    with group.active_motors(motors):
+        return callback(group, *args, **kwargs)
+
+
+def defer(callback: Callable[[], str]) -> str:
+    """
+    Record a callback to evaluate for each controller type
+
+    Args:
+        callback (Callable[[], str]): generates code for the current controller
+
+    Returns:
+        str: the placeholder for the code
+    """
+    pending = deferred.get()
+    assert pending is not None, "not rendering for several dialects"
+    pending.append(callback)
+    return f"\x00{len(pending) - 1}\x00"
+
+
+def deferring() -> bool:
+    """
+    Determine if a render for several dialects is in progress, in which case
+    the rendered text contains placeholders
+    """
+    return deferred.get() is not None
+
+
+def render_dialects(
+    plc: "Plc", controllers: Iterable[ControllerType]
+) -> Dict[ControllerType, str]:
+    """
+    Render a Plc model for several controller types
+
+    Args:
+        plc (Plc): The Plc model, declared for any controller type
+        controllers (Iterable[ControllerType]): The controller types to render
+
+    Returns:
+        Dict[ControllerType, str]: the PLC code for each controller type
+    """
+    controllers = list(dict.fromkeys(controllers))
+    if plc.generator.backend == "conformance":
+        # conformance renders twice, which would number the placeholders twice
+        return {
+            controller: _with_controller(plc, controller, plc.render)
+            for controller in controllers
+        }
+
+    pending: List[Callable[[], str]] = []
+    token = deferred.set(pending)
+    try:
+        text = plc.render()
+    finally:
+        deferred.reset(token)
+
+    results = {}
+    for controller in controllers:
+
+        def evaluate() -> List[str]:
+            return [str(callback()) for callback in pending]
+
+        values = _with_controller(plc, controller, evaluate)
+        results[controller] = PLACEHOLDER.sub(
+            lambda match: values[int(match.group(1))], text
+        )
+    return results
+
+
+def _with_controller(plc: "Plc", controller: ControllerType, function: Callable):
+    """
+    Call a function while a Plc and its groups are set to a controller type
+    """
+    originals = [plc.controller] + [group.controller for group in plc.groups]
+    plc.controller = controller
+    for group in plc.groups:
+        group.controller = controller
+    try:
+        return function()
+    finally:
+        plc.controller = originals[0]
+        for group, original in zip(plc.groups, originals[1:]):
+            group.controller = original
@@ -0,0 +1,649 @@
+"""
+A native python backend for rendering homing PLCs.
+
+Each function in this module emits exactly the same text as one of the jinja
+templates in pmac_motorhome/snippets, but without going through the jinja
+runtime. Select it with `PlcGenerator.backend`. Any snippet template that
+does not have an emitter here is rendered with jinja, so custom snippets
+still work with this backend.
+
+The functions must be kept in step with the templates. The 'conformance'
+backend renders with both and raises `ConformanceError` if they differ.
+"""
+
+from typing import TYPE_CHECKING, Callable, Dict, Iterator
+
+from .template import Template
+
+if TYPE_CHECKING:
+    from .group import Group
+    from .plc import Plc
+
+# the root template that this backend can emit
+PLC_TEMPLATE = "plc.pmc.jinja"
+
+SnippetEmitter = Callable[["Plc", "Group", Template], str]
+
+# functions that emit the code for a snippet template, keyed on template name
+EMITTERS: Dict[str, SnippetEmitter] = {}
+
+ACTIVE = "(HomingStatus = StatusHoming or HomingStatus = StatusDebugHoming)"
+
+
+class ConformanceError(Exception):
+    """
+    The python backend rendered different text to the jinja backend
+    """
+
+
+def _emits(name: str) -> Callable[[SnippetEmitter], SnippetEmitter]:
+    """
+    A decorator to register a function that emits the snippet template 'name'
+    """
+
+    def wrap(function: SnippetEmitter) -> SnippetEmitter:
+        EMITTERS[name] = function
+        return function
+
+    return wrap
+
+
+def _indent(text: str, width: int) -> str:
+    """
+    Indent all lines except the first, as jinja's indent filter does
+    """
+    lines = (text + "\n").splitlines()
+    indent = " " * width
+    return lines[0] + "".join("\n" + (indent + ln if ln else ln) for ln in lines[1:])
+
+
+def _direction(template: Template) -> bool:
+    # snippets without a homing_direction argument jog against the homing direction
+    return bool(template.args.get("homing_direction"))
+
+
+def _pre(group: "Group", template: Template) -> str:
+    if template.args.get("state") == "PreHomeMove":
+        return str(group.pre)
+    return ""
+
+
+def can_emit(template_name: str) -> bool:
+    return template_name == PLC_TEMPLATE
+
+
+def generate(plc: "Plc") -> Iterator[str]:
+    """
+    Generate the code for a whole PLC in chunks
+
+    Args:
+        plc (Plc): The Plc to render
+
+    Yields:
+        str: successive chunks of PLC code
+    """
+    num = plc.plc_num
+    yield (
+        "CLOSE\n\n"
+        ";####################################################\n"
+        f"; Autogenerated Homing PLC for {plc.controller_name()}, DO NOT MODIFY\n"
+    )
+    for group in plc.groups:
+        yield f"; Group {group.group_num}:\n{group.comment}\n"
+    if plc.uses_extra_pvars():
+        last = plc.extra_pvar(plc.EXTRA_PVARS_PER_PLC - 1)
+        yield f"; Also uses P{plc.extra_pvar(0)}..P{last}, see extra_pvars_base\n"
+    yield (
+        ";####################################################\n"
+        "\n"
+        "; Use a different timer for each PLC\n"
+        f"#define timer             i(5111+({num}&30)*50+{num}%2)\n"
+        "; Make timer more readable\n"
+        "#define MilliSeconds      * 8388608/i10\n"
+        "\n"
+        "; Homing State P Variable\n"
+        f"#define HomingState       P{num}00\n"
+        "#define StateIdle         0\n"
+        "#define StateConfiguring  1\n"
+        "#define StateMoveNeg      2\n"
+        "#define StateMovePos      3\n"
+        "#define StateHoming       4\n"
+        "#define StatePostHomeMove 5\n"
+        "#define StateAligning     6\n"
+        "#define StateDone         7\n"
+        "#define StateFastSearch   8\n"
+        "#define StateFastRetrace  9\n"
+        "#define StatePreHomeMove  10\n"
+        "HomingState = StateIdle\n"
+        "\n"
+        "; Homing Status P Variable\n"
+        f"#define HomingStatus      P{num}01\n"
+        "#define StatusDone        0\n"
+        "#define StatusHoming      1\n"
+        "#define StatusAborted     2\n"
+        "#define StatusTimeout     3\n"
+        "#define StatusFFErr       4\n"
+        "#define StatusLimit       5\n"
+        "#define StatusIncomplete  6\n"
+        "#define StatusInvalid     7\n"
+        "#define StatusPaused      8\n"
+        "#define StatusDebugHoming 9\n"
+        "HomingStatus = StatusDone\n"
+        "\n"
+        "; Homing Group P Variable\n"
+        f"#define HomingGroup       P{num}02\n"
+        "HomingGroup = 0\n"
+        "\n"
+        "; Homing Group Backup P Variable\n"
+        f"#define HomingBackupGroup P{num}03\n"
+        "HomingBackupGroup = 0\n"
+        "\n"
+    )
+    if plc.resumable:
+        yield (
+            "; Homing Done P Variable, bit n is set when group n is done\n"
+            f"#define HomingDone        P{plc.extra_pvar(plc.DONE_PVAR)}\n"
+            "HomingDone = 0\n"
+            "\n"
+            "; Homing Resume P Variable, 1 to skip the groups that are done the"
+            " next time\n"
+            "; all groups are homed\n"
+            f"#define HomingResume      P{plc.extra_pvar(plc.RESUME_PVAR)}\n"
+            "HomingResume = 0\n"
+            "\n"
+        )
+    yield (
+        f"OPEN PLC{num} CLEAR\n"
+        "\n"
+        "if (HomingStatus != StatusHoming)\n"
+        "and (HomingStatus != StatusDebugHoming)\n"
+        "    HomingStatus = StatusHoming\n"
+        "endif\n"
+        "\n"
+        ";---- Configuring State ----\n"
+        "HomingState=StateConfiguring\n"
+        ";Save the Homing group to px03\n"
+        "HomingBackupGroup=HomingGroup\n"
+    )
+    if plc.resumable:
+        yield (
+            ";Forget the groups that are done, unless resuming, which only"
+            " applies once\n"
+            "if (HomingResume = 0)\n"
+            "    HomingDone=0\n"
+            "endif\n"
+            "HomingResume=0\n"
+        )
+    yield (
+        ";Save high soft limits to P variables px04..x19\n"
+        f"{plc.save_hi_limits()}\n"
+        ";Save the low soft limits to P variables px20..x35\n"
+        f"{plc.save_lo_limits()}\n"
+        ";Save the home capture flags to P variables px36..x51\n"
+        f"{plc.save_homed()}\n"
+        f"{plc.check_homed_flags()}"
+        ";Store 'not flag' to use in moving off a flag in P variables px52..x67\n"
+        f"{plc.save_not_homed()}\n"
+        ";Save the limit flags to P variables px68..x83\n"
+        f"{plc.save_limit_flags()}\n"
+        ";Save the current position to P variables px84..x99\n"
+        f"{plc.save_position()}\n"
+        ";Clear the soft limits\n"
+        f"{plc.clear_limits()}\n"
+        "\n"
+    )
+    for groups in plc.group_sections():
+        yield plc.render_groups(groups, emit_group)
+    yield (
+        ";---- Done ----\n"
+        f"if {ACTIVE}\n"
+        "    ;If we've got this far without failing, set status and state done\n"
+        "    HomingStatus=StatusDone\n"
+        "    HomingState=StateDone\n"
+        "    ;Restore the homing group from px03\n"
+        "    HomingGroup=HomingBackupGroup\n"
+    )
+    if plc.resumable:
+        yield (
+            "    ;All of the groups are done, so start from the first group next time\n"
+            "    if (HomingBackupGroup = 1)\n"
+            "        HomingDone=0\n"
+            "    endif\n"
+        )
+    yield (
+        "endif\n"
+        "\n"
+        ";---- Tidy Up ----\n"
+        ";Stop all motors if they don't have a following error\n"
+        f"{plc.stop_motors()}\n"
+        ";Restore the high soft limits from P variables px04..x19\n"
+        f"{plc.restore_hi_limits()}\n"
+        ";Restore the low soft limits from P variables px20..x35\n"
+        f"{plc.restore_lo_limits()}\n"
+        ";Restore the home capture flags from P variables px36..x51\n"
+        f"{plc.restore_homed()}\n"
+        ";Restore the limit flags to P variables px68..x83\n"
+        f"{plc.restore_limit_flags()}\n"
+        "\n"
+        f"DISABLE PLC{num}\n"
+        "CLOSE\n"
+    )
+
+
+def emit_group(plc: "Plc", group: "Group") -> str:
+    """
+    Emit the block of code that homes one group
+    """
+    if group.group_num == 1:
+        code = ["if (HomingBackupGroup = 1)\n"]
+    else:
+        num = group.group_num
+        code = [f"if (HomingBackupGroup = 1 or HomingBackupGroup = {num})\n"]
+    code.append(f"and {ACTIVE}\n")
+    if group.skip_homed:
+        code.append(
+            f"and (HomingBackupGroup != 1 or {group.homed()}=0)"
+            " ; Skip if all axes are homed\n"
+        )
+    if plc.resumable:
+        code.append(
+            f"and (HomingBackupGroup != 1 or (HomingDone & {group.done_bit})=0)"
+            " ; Skip if done\n"
+        )
+    code.append(f"    HomingGroup={group.group_num}\n\n    ;Clear home flags\n")
+    if group.htype != "NOTHING":
+        code.append(f"    {group.clear_home()}\n")
+    for template in group.templates:
+        if template.function:
+            code.append(str(group.callback(template.function, template.args)))
+        else:
+            code.append(emit_snippet(plc, group, template))
+    if plc.resumable and not group.pipelined:
+        code.append(
+            "    ;Record that the group is done\n"
+            f"    if {ACTIVE}\n"
+            f"        HomingDone=HomingDone|{group.done_bit}\n"
+            "    endif\n"
+        )
+    code.append("endif\n\n")
+    return "".join(code)
+
+
+def emit_snippet(plc: "Plc", group: "Group", template: Template) -> str:
+    """
+    Emit the code for one snippet template, using jinja for any template that
+    has no native emitter
+    """
+    assert template.jinja_file is not None
+    emitter = EMITTERS.get(template.jinja_file)
+    if emitter is not None:
+        return emitter(plc, group, template)
+
+    from .plcgenerator import PlcGenerator
+
+    jinja = PlcGenerator.get_environment().get_template(
+        template.jinja_file + ".pmc.jinja"
+    )
+    return jinja.render(plc=plc, group=group, template=template)
+
+
+@_emits("debug_pause")
+def debug_pause(plc: "Plc", group: "Group", template: Template) -> str:
+    return (
+        "    ; Wait for user to tell us to continue if in debug\n"
+        "    if (HomingStatus = StatusDebugHoming)\n"
+        "        HomingStatus = StatusPaused\n"
+        "        while (HomingStatus = StatusPaused)\n"
+        "        endw\n"
+        "    endif\n"
+    )
+
+
+@_emits("wait_for_done")
+def wait_for_done(plc: "Plc", group: "Group", template: Template) -> str:
+    args = template.args
+    code = [
+        "        ; Wait for the move to complete\n"
+        "        timer = 20 MilliSeconds ; Small delay to start moving\n"
+        "        while (timer > 0)\n"
+        "        endw\n"
+        f"        timer = {plc.timeout} MilliSeconds"
+        " ; Now start checking the conditions\n"
+    ]
+    if args.get("wait_for_one_motor"):
+        code.append(
+            f"        while ({group.in_pos(operator='|')}=0)"
+            " ; Wait until at least one motor is In Position\n"
+        )
+    else:
+        code.append(
+            f"        while ({group.in_pos()}=0)"
+            " ; At least one motor should not be In Position\n"
+        )
+    if not args.get("no_following_err"):
+        code.append(
+            f"        and ({group.following_err()} = 0) ; Following error check\n"
+        )
+    if args.get("with_limits"):
+        code.append(f"        and ({group.limits()} = 0) ; Limit check\n")
+    code.append(
+        "        and (timer > 0) ; Check for timeout\n"
+        f"        and {ACTIVE} ; Check that we didn't abort\n"
+        "        endw\n"
+        "        ; Check why we left the while loop\n"
+    )
+    if not args.get("no_following_err"):
+        code.append(
+            f"        if ({group.following_err()} != 0)"
+            " ; Following error check failed\n"
+            "            HomingStatus = StatusFFErr\n"
+            "        endif\n"
+        )
+    if args.get("with_limits"):
+        code.append(
+            f"        if ({group.limits()} != 0) ; Limit check failed\n"
+            "            HomingStatus = StatusLimit\n"
+            "        endif\n"
+        )
+    code.append(
+        "        if (timer<0 or timer=0) ; If we timed out\n"
+        "            HomingStatus = StatusTimeout\n"
+        "        endif\n"
+    )
+    return "".join(code)
+
+
+def _move(state: str, commands: str, plc: "Plc", group: "Group", t: Template) -> str:
+    """
+    The common form of snippets that issue a move and wait for it to complete.
+    'commands' are the lines that follow '; Execute the move commands'
+    """
+    return (
+        f"{debug_pause(plc, group, t)}"
+        "\n"
+        f"    ;---- {state} State ----\n"
+        f"    if {ACTIVE}\n"
+        f"        HomingState=State{state}\n"
+        f"        ; Execute the move commands{commands}"
+        f"{wait_for_done(plc, group, t)}"
+    )
+
+
+@_emits("drive_to_limit")
+def drive_to_limit(plc: "Plc", group: "Group", t: Template) -> str:
+    direction = _direction(t)
+    commands = (
+        f"\n        {_pre(group, t)}"
+        f"{group.set_large_jog_distance(homing_direction=direction)}\n"
+        f'        cmd "{group.jog_axes()}"\n'
+    )
+    return _move(t.args["state"], commands, plc, group, t) + "    endif\n\n"
+
+
+@_emits("drive_to_home")
+def drive_to_home(plc: "Plc", group: "Group", t: Template) -> str:
+    distance = group.set_large_jog_distance(homing_direction=_direction(t))
+    if t.args.get("restore_homed_flags"):
+        distance = f"{group.restore_home_flags()} {distance}"
+    commands = (
+        f"{_pre(group, t)}\n"
+        f"        {distance}\n"
+        f'        cmd "{group.jog_to_home_jdist()}"\n'
+    )
+    return _move(t.args["state"], commands, plc, group, t) + "    endif\n\n"
+
+
+@_emits("drive_off_home")
+def drive_off_home(plc: "Plc", group: "Group", t: Template) -> str:
+    distance = group.set_large_jog_distance(homing_direction=_direction(t))
+    commands = (
+        f"\n        {group.negate_home_flags()} {distance}\n"
+        f'        cmd "{group.jog_to_home_jdist()}"\n'
+    )
+    return _move(t.args["state"], commands, plc, group, t) + "    endif\n\n"
+
+
+@_emits("drive_to_hstop")
+def drive_to_hstop(plc: "Plc", group: "Group", t: Template) -> str:
+    distance = group.set_large_jog_distance(homing_direction=_direction(t))
+    commands = (
+        f"\n        {group.set_inpos_trigger(3)}; in-position trigger on following"
+        f" error{_pre(group, t)}\n"
+        f"        {distance}\n"
+        f'        cmd "{group.jog_to_home_jdist()}"\n'
+    )
+    return _move(t.args["state"], commands, plc, group, t) + (
+        f"        {group.set_inpos_trigger(0)}; in-position trigger on hardware"
+        " capture\n"
+        "\n"
+        "    endif\n"
+        "\n"
+    )
+
+
+@_emits("drive_to_hard_limit")
+def drive_to_hard_limit(plc: "Plc", group: "Group", t: Template) -> str:
+    jog = group.jog(homing_direction=_direction(t))
+    commands = f'\n        cmd "{jog}"\n'
+    return _move(t.args["state"], commands, plc, group, t) + "    endif\n\n"
+
+
+@_emits("drive_to_initial_pos")
+def drive_to_initial_pos(plc: "Plc", group: "Group", t: Template) -> str:
+    commands = (
+        f"\n        {group.stored_pos_to_jogdistance()}\n"
+        f'        cmd "{group.jog_distance()}"\n'
+    )
+    return _move("PostHomeMove", commands, plc, group, t) + "    endif\n\n"
+
+
+@_emits("drive_to_soft_limit")
+def drive_to_soft_limit(plc: "Plc", group: "Group", t: Template) -> str:
+    direction = _direction(t)
+    commands = (
+        f"\n        {group.stored_limit_to_jogdistance(homing_direction=direction)}\n"
+        f'        cmd "{group.jog_distance()}"\n'
+    )
+    return _move("PostHomeMove", commands, plc, group, t) + "    endif\n\n"
+
+
+@_emits("drive_relative")
+def drive_relative(plc: "Plc", group: "Group", t: Template) -> str:
+    jog = group.jog_distance(distance=t.args.get("distance"))
+    code = _move("PostHomeMove", f'\n        cmd "{jog}"\n', plc, group, t)
+    code += "    endif\n\n"
+    if t.args.get("set_home"):
+        code += (
+            "    ;---- Make current position zero ----\n"
+            f"    if {ACTIVE}\n"
+            f'        cmd "{group.set_home()}"\n'
+            "    endif\n"
+            "\n"
+        )
+    return code
+
+
+@_emits("home")
+def home(plc: "Plc", group: "Group", t: Template) -> str:
+    flags, home = group.restore_home_flags(), group.home()
+    commands = f'\n        {flags}\n        cmd "{home}"\n'
+
+    return _move("Homing", commands, plc, group, t) + "    endif\n\n"
+
+
+@_emits("store_position_diff")
+def store_position_diff(plc: "Plc", group: "Group", t: Template) -> str:
+    return (
+        "    ;---- Store the difference between current pos and start pos ----\n"
+        f"    if {ACTIVE}\n"
+        f"        {group.store_position_diff()}\n"
+        "    endif\n"
+        "\n"
+    )
+
+
+@_emits("check_homed")
+def check_homed(plc: "Plc", group: "Group", t: Template) -> str:
+    return (
+        "    ;---- Check if all motors have homed ----\n"
+        f"    if {ACTIVE}\n"
+        f"    and ({group.homed()}=0)\n"
+        "        HomingStatus=StatusIncomplete\n"
+        "    endif\n"
+        "\n"
+    )
+
+
+@_emits("disable_limits")
+def disable_limits(plc: "Plc", group: "Group", t: Template) -> str:
+    code = [
+        "    ;---- Check if any limits need disabling ----\n"
+        f"    if {ACTIVE}\n"
+        "        ;Save the user home flags to P variables px52..x67\n"
+        "        ;NOTE: this overwrites inverse flag (ran out of P vars),"
+        " so can't use inverse flag after this point\n"
+        f"            {group.overwrite_inverse_flags()}\n"
+    ]
+    for motor in group.motors:
+        homed, not_homed, axis = motor.homed, motor.not_homed, motor.axis
+        code.append(
+            "        ; if capture on flag, and flag high,"
+            " then we need to disable limits\n"
+            f"        if (P{homed}&2=2 and P{homed}&8=0)\n"
+            "            ; ix23 (h_vel) should be opposite to ix26 (h_off)"
+            " and in direction of home flag\n"
+            f"            if (P{not_homed}=1 and i{axis}23>0 and i{axis}26<1)\n"
+            f"            or (P{not_homed}=2 and i{axis}23<0 and i{axis}26>-1)\n"
+            f"                i{axis}24=i{axis}24 | $20000\n"
+            "            else\n"
+            "                ; if it isn't then set it into invalid error\n"
+            "                HomingStatus=StatusInvalid\n"
+            "            endif\n"
+            "        endif\n"
+        )
+    code.append("    endif\n\n")
+    return "".join(code)
+
+
+@_emits("restore_limits")
+def restore_limits(plc: "Plc", group: "Group", t: Template) -> str:
+    return (
+        "    ;---- Restore limits if needed ----\n"
+        "    ;Restore the limit flags to P variables px68..x83\n"
+        f"    {group.restore_limit_flags()}\n"
+        "\n"
+    )
+
+
+@_emits("jog_if_on_limit")
+def jog_if_on_limit(plc: "Plc", group: "Group", t: Template) -> str:
+    direction = _direction(t)
+    code = [
+        "    ;---- Check if HSW_HLIM missed home mark and hit a limit ----\n"
+        f"    if {ACTIVE}\n"
+        "        ; Execute the move commands if on a limit"
+    ]
+    for motor in list(group.motors):
+        group.set_axis_filter([motor.axis])
+        code.append(
+            f"\n        if ({group.limits()}=1)\n"
+            f"            {group.set_large_jog_distance(homing_direction=direction)}\n"
+            f'            cmd "{group.jog_to_home_jdist()}"\n'
+            "        endif"
+        )
+    group.set_axis_filter([])
+    code.append(
+        "\n"
+        "        ; Wait for the move to complete\n"
+        "        timer = 20 MilliSeconds ; Small delay to start moving\n"
+        "        while (timer > 0)\n"
+        "        endw\n"
+        f"        timer = {plc.timeout} MilliSeconds"
+        " ; Now start checking the conditions\n"
+        f"        while ({group.in_pos()}=0)"
+        " ; At least one motor should not be In Position\n"
+        f"        and ({group.following_err()} = 0) ; Following error check\n"
+        f"        and ({group.limits()}=0)"
+        " ; Should not stop on position limit for selected motors\n"
+        "        and (timer > 0) ; Check for timeout\n"
+        f"        and {ACTIVE} ; Check that we didn't abort\n"
+        "        endw\n"
+        "        ; Check why we left the while loop\n"
+        f"        if ({group.following_err()} != 0) ; Following error check failed\n"
+        "            HomingStatus = StatusFFErr\n"
+        "        endif\n"
+        f"        if ({group.limits()}=1) ; If a motor hit a limit\n"
+        "            HomingStatus = StatusLimit\n"
+        "        endif\n"
+        "        if (timer<0 or timer=0) ; If we timed out\n"
+        "            HomingStatus = StatusTimeout\n"
+        "        endif\n"
+        "    endif\n"
+        "\n"
+    )
+    return "".join(code)
+
+
+@_emits("continue_home_maintain_axes_offset")
+def continue_home_maintain_axes_offset(plc: "Plc", group: "Group", t: Template) -> str:
+    direction = _direction(t)
+    jog_stopped = _indent(f"            {group.jog_stopped()}\n", 12)
+    return (
+        "    ;--- Homing State 2 ----\n"
+        f"    if {ACTIVE}\n"
+        "        HomingState=StateHoming\n"
+        "        ; This block to be used after a home block with"
+        " wait_for_one_motor=True.\n"
+        "        ; It allows motors to continue to home but restarts those that"
+        " have already\n"
+        "        ; reached home. For use with axes that are sensitve to tilt but"
+        " do not have\n"
+        "        ; aligned home marks\n"
+        "\n"
+        "        ; make sure all jogs will be a long distance\n"
+        f"        {group.set_large_jog_distance(homing_direction=direction)}\n"
+        "\n"
+        "        ; continue processing until all motors are homed or something"
+        " goes wrong\n"
+        f"        timer = {plc.timeout} MilliSeconds\n"
+        f"        while ({group.homed()} = 0) ; at least one is not homed\n"
+        f"        and ({group.following_err()} = 0) ; there are no following errors\n"
+        f"        and ({group.in_pos()} = 0) ; at least one is not in postion\n"
+        "        and (timer > 0) ; Check for timeout\n"
+        "            ; jog any motors that have stopped on home\n"
+        f"{jog_stopped}"
+        "        endw\n"
+        "        ; Check why we left the while loop\n"
+        f"        if ({group.following_err()} != 0) ; Following error check failed\n"
+        "            HomingStatus = StatusFFErr\n"
+        "        endif\n"
+        "        if (timer<0 or timer=0) ; If we timed out\n"
+        "            HomingStatus = StatusTimeout\n"
+        "        endif\n"
+        "    endif\n"
+        "\n"
+    )
+
+
+@_emits("post_home_action")
+def post_home_action(plc: "Plc", group: "Group", t: Template) -> str:
+    if not (group.post and group.post != ""):
+        return ""
+    return (
+        f"{debug_pause(plc, group, t)}"
+        "\n"
+        "    ;---- PostHomeMove State ----\n"
+        f"\tif {ACTIVE}\n"
+        "\t\tHomingState=StatePostHomeMove\n"
+        "\t\t; Execute the move commands\n"
+        f"\t\tif {ACTIVE}\n"
+        f"            {group.post}\n"
+        "\t\tendif\n"
+        "\tendif\n"
+        "\n"
+    )
+
+
+@_emits("drive_to_home_if_on_limit")
+def drive_to_home_if_on_limit(plc: "Plc", group: "Group", t: Template) -> str:
+    return ""
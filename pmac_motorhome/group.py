@@ -1,7 +1,11 @@
-from typing import Any, Callable, Dict, List  # , Optional
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 from pmac_motorhome.constants import ControllerType  # , PostHomeMove
 
+from .axistable import AxisTable
+from .dialect import dialect_specific
 from .motor import Motor
 from .template import Template
 
@@ -13,8 +17,9 @@ class Group:
     Should always be instantiated using `pmac_motorhome.commands.group`
     """
 
-    # this class variable holds the instance in the current context
-    the_group = None
+    # holds the instance in the current context, separately for each thread
+    # and asyncio task
+    current: ContextVar[Optional["Group"]] = ContextVar("the_group", default=None)
 
     def __init__(
         self,
@@ -26,6 +31,8 @@ class Group:
         comment=None,
         pre="",
         post="",
+        pipelined=False,
+        skip_homed=False,
     ):
         """
         Args:
@@ -39,6 +46,10 @@ class Group:
             post_distance (int): a distance to use in post_home if required
             comment (str): [description]. A comment to place in the output Plc code
                 at the beginning of this group's definition
+            pipelined (bool): home each axis through the sequence on its own,
+                see `pmac_motorhome.concurrent`
+            skip_homed (bool): skip the group when all groups are homed and
+                all of its axes are already homed
         """
         self.motors = []
         self.all_motors = []
@@ -52,41 +63,53 @@ class Group:
         self.controller = controller
         self.pre = pre
         self.post = post
+        self.pipelined = pipelined
+        self.skip_homed = skip_homed
+        # cached code fragments for each set of active motors, see axis_table
+        self._axis_tables: Dict[Tuple[int, ...], AxisTable] = {}
+        self._axis_table: Optional[AxisTable] = None
 
     def __enter__(self):
         """
         Entering a context. Store the Group object for use in the scope of
         this context.
         """
-        assert not Group.the_group, "cannot create a new Group within a Group context"
-        Group.the_group = self
+        assert (
+            not Group.current.get()
+        ), "cannot create a new Group within a Group context"
+        Group.current.set(self)
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
         """
         Exiting the context. Clear the Group object.
         """
-        Group.the_group = None
+        Group.current.set(None)
+
+    @property
+    def done_bit(self) -> int:
+        """
+        The bit that records that this group is done in a resumable PLC
+        """
+        return 1 << self.group_num
 
     @classmethod
-    def add_motor(cls, axis: int, jdist: int, index: int) -> Motor:
+    def add_motor(cls, motor: Motor) -> Motor:
         """
-        Add a new motor to the current group
+        Add a motor to the current group
 
         Args:
-            axis (int): Axis number
-            jdist (int): distance to jog to move off of home mark
-            index (int): internal use
+            motor (Motor): The motor, see `Plc.get_motor`
         Returns:
-            Motor: The newly created Motor
+            Motor: The motor
         """
         group = Group.instance()
         assert (
-            axis not in group.motors
-        ), f"motor {axis} already defined in group {group.plc_num}"
-        motor = Motor.get_motor(axis, jdist, group.plc_num, index=index)
+            motor not in group.motors
+        ), f"motor {motor.axis} already defined in group {group.plc_num}"
         group.motors.append(motor)
         group.all_motors.append(motor)
+        group.clear_axis_tables()
         return motor
 
     @classmethod
@@ -94,8 +117,9 @@ class Group:
         """
         Get the current in-scope Group
         """
-        assert cls.the_group, "There is no group context currently defined"
-        return cls.the_group
+        group = cls.current.get()
+        assert group, "There is no group context currently defined"
+        return group
 
     @classmethod
     def add_comment(cls, htype: str, post: str = "None") -> None:
@@ -125,11 +149,12 @@ class Group:
         Args:
             template_name (str): prefix of the jinja template's filename
                 '.pmc.jinja' is added to this name and the template file
-                should be in pmac_motorhome/snippets
+                should be in pmac_motorhome/snippets or one of the folders in
+                `PlcGenerator.snippet_dirs`
         """
         group = Group.instance()
         group.templates.append(
-            Template(jinja_file=template_name, args=args, function=None)
+            Template.intern(jinja_file=template_name, args=args, function=None)
         )
 
     @classmethod
@@ -144,7 +169,27 @@ class Group:
             args (dict): arguments to pass to func
         """
         group = Group.instance()
-        group.templates.append(Template(jinja_file=None, function=func, args=args))
+        group.templates.append(
+            Template.intern(jinja_file=None, function=func, args=args)
+        )
+
+    @contextmanager
+    def active_motors(self, motors: List[Motor]) -> Iterator[None]:
+        """
+        A context in which only some of the group's motors are active, as if
+        they had been selected by set_axis_filter
+
+        Args:
+            motors (List[Motor]): the active motors
+        """
+        saved = self.motors
+        self.motors = motors
+        self._axis_table = None
+        try:
+            yield
+        finally:
+            self.motors = saved
+            self._axis_table = None
 
     # TODO maybe use *axes here for clarity in calls from Jinja
     def set_axis_filter(self, axes: List[int]) -> str:
@@ -171,6 +216,7 @@ class Group:
             assert len(self.motors) == len(axes), "set_axis_filter: invalid axis number"
             # callback functions must return a string since we call them with
             # {{- group.callback(template.function, template.args) -}} from jinja
+        self._axis_table = None
         return ""
 
     def command(self, cmd: str) -> str:
@@ -207,8 +253,28 @@ class Group:
 
         # to the string format: pass any extra arguments first, then the dictionary
         # of the axis object so its elements can be addressed by name
-        all = [format.format(*arg, **ax.dict) for ax in self.motors]
-        return separator.join(all)
+        return self.axis_table.join(format, separator, *arg)
+
+    def clear_axis_tables(self) -> None:
+        """
+        Discard the cached code fragments for all sets of active motors
+        """
+        self._axis_tables = {}
+        self._axis_table = None
+
+    @property
+    def axis_table(self) -> AxisTable:
+        """
+        The cached code fragments for the currently active motors. This is
+        rebuilt whenever set_axis_filter changes the active motors.
+        """
+        if self._axis_table is None:
+            axes = tuple(motor.axis for motor in self.motors)
+            table = self._axis_tables.get(axes)
+            if table is None:
+                table = self._axis_tables[axes] = AxisTable(self.motors)
+            self._axis_table = table
+        return self._axis_table
 
     def callback(self, function: Callable, args: Dict[str, Any]) -> str:
         """
@@ -316,6 +382,7 @@ class Group:
         """
         return self._all_axes("#{axis}J=%s" % (distance), " ")
 
+    @dialect_specific
     def negate_home_flags(self):
         """
         Generate a command string for all group axes: invert homing flags
@@ -325,6 +392,7 @@ class Group:
         else:
             return self._all_axes("i{homed_flag}=P{not_homed}", " ")
 
+    @dialect_specific
     def restore_home_flags(self):
         """
         Generate a command string for all group axes: restore original homing flags
@@ -358,6 +426,7 @@ class Group:
         """
         return self._all_axes("i{axis}24=P{lim_flags}", " ")
 
+    @dialect_specific
     def overwrite_inverse_flags(self):
         """
         Generate a command string for all group axes: reuse the not homed store to
@@ -0,0 +1,292 @@
+"""
+Reuse the code rendered for structurally identical groups.
+
+Across a large build many groups differ only in their axis numbers and the
+number of their PLC, for example pairs of axes homed with the same sequence.
+`GroupCache` identifies each group by its structure: its snippets, settings
+and jog distances, but not its axes. The first time a structure is seen its
+block of code is rendered as normal.
+
+When the structure is seen again with different axes the block is rendered
+once more with sentinel axis and PLC numbers. Every occurrence of a value
+derived from a sentinel, such as an axis number or a P variable, becomes a
+parameter of a `Pattern`, which produces the block for any other axes by
+substitution. The Pattern is only kept if it reproduces both of the blocks
+that were rendered normally, otherwise the structure is always rendered.
+
+This relies on snippets not treating particular axis or PLC numbers
+differently, which the check above verifies for the axes seen so far. The
+built-in snippets never do, but custom snippet templates might, so the cache
+is not used when `PlcGenerator.snippet_dirs` are configured.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from types import SimpleNamespace
+from typing import Any, Callable, Hashable, List, Sequence, Tuple, Union
+
+from .group import Group
+from .motor import Motor
+from .template import Template
+
+#: A function that renders the block of code for a group of a Plc
+Renderer = Callable[[Any, Group], str]
+
+# sentinels chosen so that the values derived from them are long distinctive
+# numbers, for example sentinel axis 8101 uses the homed flag i7202512
+SENTINEL_PLC = 7777
+SENTINEL_AXIS = 8101
+SENTINEL_AXIS_STEP = 10
+
+Values = Tuple[str, ...]
+
+
+def parameters(plc_num: int, motors: Sequence[Motor]) -> Values:
+    """
+    Get all of the values that parameterize the code for a group
+
+    Args:
+        plc_num (int): The PLC number
+        motors (Sequence[Motor]): All of the motors in the group
+
+    Returns:
+        Values: the PLC number then the axis number, nx, macro station and
+            P variables of each motor, as text
+    """
+    values = [str(plc_num)]
+    for motor in motors:
+        values += [str(motor.axis), motor.nx, motor.macro_station]
+        values += [str(motor.pvar(name)) for name in Motor.PVARS]
+    return tuple(values)
+
+
+class Pattern:
+    """
+    The code for a group with a placeholder for each of its `parameters`
+    """
+
+    def __init__(self, text: str, values: Values) -> None:
+        """
+        Args:
+            text (str): code rendered with sentinel values
+            values (Values): the sentinel values, which must all be different
+
+        Raises:
+            ValueError: two of the values are the same
+        """
+        if len(set(values)) != len(values):
+            raise ValueError("the sentinel values are ambiguous")
+        index = {value: i for i, value in enumerate(values)}
+        # match the longest value first where one value starts with another
+        ordered = sorted(values, key=len, reverse=True)
+        regex = re.compile("|".join(re.escape(value) for value in ordered))
+        self.pieces: List[Union[str, int]] = []
+        start = 0
+        for match in regex.finditer(text):
+            if match.start() > start:
+                self.pieces.append(text[start : match.start()])
+            self.pieces.append(index[match.group()])
+            start = match.end()
+        if start < len(text):
+            self.pieces.append(text[start:])
+
+    def substitute(self, values: Values) -> str:
+        """
+        Produce the code for a group from its `parameters`
+        """
+        return "".join(
+            values[piece] if isinstance(piece, int) else piece for piece in self.pieces
+        )
+
+
+class _Seen:
+    """
+    The first block of code rendered for a structure
+    """
+
+    def __init__(self, values: Values, text: str) -> None:
+        self.values = values
+        self.text = text
+
+
+# marks a structure whose code cannot be reused
+_UNCACHEABLE = object()
+
+
+def _value_key(value: Any) -> Hashable:
+    """
+    Get a key for a snippet argument that includes its type, because equal
+    values such as 1, 1.0 and True render differently
+    """
+    if isinstance(value, (list, tuple)):
+        return type(value), tuple(_value_key(item) for item in value)
+    return type(value), value
+
+
+def template_key(template: Template) -> Hashable:
+    """
+    Get a key that is only equal for Templates that render the same code, like
+    the key of `Template.intern`, but also for arguments that are lists
+    """
+    items = frozenset((k, _value_key(v)) for k, v in template.args.items())
+    return template.jinja_file, template.function, template.custom_text, items
+
+
+def structure(plc: Any, group: Group, renderer: Renderer) -> Hashable:
+    """
+    Get a key that identifies the code for a group, apart from its axis and
+    PLC numbers
+
+    Raises:
+        TypeError: The group has unhashable snippet arguments
+    """
+    key = (
+        renderer,
+        plc.controller,
+        plc.timeout,
+        plc.resumable,
+        group.controller,
+        group.group_num,
+        group.htype,
+        group.pre,
+        group.post,
+        group.post_home,
+        group.post_distance,
+        group.skip_homed,
+        group.pipelined,
+        tuple(template_key(template) for template in group.templates),
+        tuple(motor.jdist for motor in group.all_motors),
+    )
+    hash(key)
+    return key
+
+
+def sentinel_group(plc: Any, group: Group) -> Tuple[Any, Group]:
+    """
+    Make a copy of a Plc and Group that has sentinel PLC and axis numbers.
+    The Plc is a stand in that only has the attributes used by group snippets.
+    """
+    sentinel_plc = SimpleNamespace(
+        plc_num=SENTINEL_PLC,
+        controller=plc.controller,
+        timeout=plc.timeout,
+        resumable=plc.resumable,
+    )
+    copy = Group(
+        group.group_num,
+        SENTINEL_PLC,
+        group.controller,
+        group.post_home,
+        group.post_distance,
+        group.comment,
+        group.pre,
+        group.post,
+        pipelined=group.pipelined,
+        skip_homed=group.skip_homed,
+    )
+    copy.htype = group.htype
+    copy.templates = group.templates
+    copy.all_motors = [
+        Motor(
+            SENTINEL_AXIS + SENTINEL_AXIS_STEP * i, motor.jdist, SENTINEL_PLC, index=i
+        )
+        for i, motor in enumerate(group.all_motors)
+    ]
+    copy.motors = copy.all_motors
+    return sentinel_plc, copy
+
+
+class GroupCache:
+    """
+    A bounded least recently used cache of the code for each group structure
+    """
+
+    def __init__(self, size: int = 256) -> None:
+        """
+        Args:
+            size (int): the most group structures to remember
+        """
+        self.size = size
+        self.entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.lock = threading.Lock()
+        # the number of groups whose code was reused, for diagnostics
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self) -> None:
+        """
+        Forget all structures, for example because the snippets have changed
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def render(self, plc: Any, group: Group, renderer: Renderer) -> str:
+        """
+        Get the block of code for a group, reusing the code of a group with the
+        same structure if possible
+
+        Args:
+            plc (Plc): The Plc that the group belongs to
+            group (Group): The group
+            renderer (Renderer): renders the code for a group
+
+        Returns:
+            str: The code for the group
+        """
+        if group.motors != group.all_motors:
+            # rendering part way through an axis filter, should not happen
+            return renderer(plc, group)
+        try:
+            key = structure(plc, group, renderer)
+        except TypeError:
+            return renderer(plc, group)
+        values = parameters(plc.plc_num, group.all_motors)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        if isinstance(entry, Pattern):
+            self.hits += 1
+            return entry.substitute(values)
+        if isinstance(entry, _Seen) and entry.values == values:
+            self.hits += 1
+            return entry.text
+
+        self.misses += 1
+        text = renderer(plc, group)
+        if entry is _UNCACHEABLE:
+            return text
+        if entry is None:
+            entry = _Seen(values, text)
+        else:
+            entry = self.learn(plc, group, renderer, [entry, _Seen(values, text)])
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return text
+
+    def learn(
+        self, plc: Any, group: Group, renderer: Renderer, examples: List[_Seen]
+    ) -> Any:
+        """
+        Make the Pattern for a group structure and check that it reproduces
+        the examples of its code rendered normally
+
+        Returns:
+            The Pattern, or _UNCACHEABLE if the structure's code cannot be reused
+        """
+        sentinel_plc, copy = sentinel_group(plc, group)
+        try:
+            text = renderer(sentinel_plc, copy)
+            pattern = Pattern(text, parameters(SENTINEL_PLC, copy.all_motors))
+        except Exception:
+            # e.g. an axis filter that refers to the real axis numbers
+            return _UNCACHEABLE
+        for example in examples:
+            if pattern.substitute(example.values) != example.text:
+                return _UNCACHEABLE
+        return pattern
@@ -0,0 +1,334 @@
+"""
+A serializable intermediate representation (IR) of resolved Plc models.
+
+Executing a PLC definition file builds a tree of `Plc`, `Group`, `Motor` and
+`Template` objects. This module converts that tree to and from plain data so
+that a model can be cached, compared or rendered in another process without
+executing its definition file again.
+
+Callback functions such as `Group.set_axis_filter` and enumerations are stored
+as symbolic references of the form 'module:qualname', so only module level
+functions and methods can be serialized. Tuples are stored as lists.
+
+Loading an IR only resolves references to enumerations in pmac_motorhome and to
+the methods of `Group` and `Plc` and the functions in `pmac_motorhome.snippets`,
+so that an IR file cannot call anything else.
+
+Two encodings are provided: JSON text, and a compact binary form which is the
+same JSON compressed with zlib behind a short header.
+"""
+
+import importlib
+import inspect
+import json
+import zlib
+from enum import Enum
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from . import snippets
+from .constants import ControllerType
+from .group import Group
+from .motor import Motor
+from .plc import Plc
+from .template import Template
+
+# increment this if the layout of the IR changes
+IR_VERSION = 1
+
+# the first bytes of the binary form of the IR
+MAGIC = b"PMHIR"
+
+# references may only resolve to objects in this package
+PACKAGE = "pmac_motorhome"
+
+
+class IRError(Exception):
+    """
+    A Plc model cannot be converted to or from the IR
+    """
+
+
+def _reference(value: Any) -> str:
+    """
+    Make a symbolic reference to a module level function, method or class
+    """
+    qualname = getattr(value, "__qualname__", "")
+    if "<" in qualname or not qualname:
+        raise IRError(f"cannot make a reference to {value!r}")
+    return f"{value.__module__}:{qualname}"
+
+
+def _resolve(reference: str) -> Any:
+    """
+    Look up an object from a reference made by `_reference`
+    """
+    module_name, _, qualname = reference.partition(":")
+    if module_name != PACKAGE and not module_name.startswith(PACKAGE + "."):
+        raise IRError(f"cannot resolve {reference}: not in {PACKAGE}")
+    try:
+        value = importlib.import_module(module_name)
+        for name in qualname.split("."):
+            value = getattr(value, name)
+    except (ImportError, AttributeError) as e:
+        raise IRError(f"cannot resolve {reference}: {e}")
+    return value
+
+
+def _resolve_enum(reference: str) -> Any:
+    """
+    Look up an enumeration from a reference made by `_reference`
+    """
+    value = _resolve(reference)
+    if not (isinstance(value, type) and issubclass(value, Enum)):
+        raise IRError(f"cannot resolve {reference}: not an enumeration")
+    return value
+
+
+def _resolve_function(reference: str) -> Callable:
+    """
+    Look up a callback from a reference made by `_reference`, which must be a
+    method of Group or Plc, or a snippet function
+    """
+    module_name, _, qualname = reference.partition(":")
+    owner, _, name = qualname.rpartition(".")
+    namespaces = {
+        (Group.__module__, "Group"): vars(Group),
+        (Plc.__module__, "Plc"): vars(Plc),
+        (snippets.__name__, ""): vars(snippets),
+    }
+    namespace = namespaces.get((module_name, owner), {})
+    value = namespace.get(name)
+    if (
+        name.startswith("_")
+        or not inspect.isfunction(value)
+        or value.__module__ != module_name
+    ):
+        raise IRError(f"cannot resolve {reference}: not a callback")
+    return value
+
+
+def _encode(value: Any) -> Any:
+    """
+    Convert a value into something that json can serialize
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, Enum):
+        return {"enum": _reference(type(value)), "value": value.value}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    if callable(value):
+        return {"function": _reference(value)}
+    raise IRError(f"cannot serialize {value!r}")
+
+
+def _decode(value: Any) -> Any:
+    """
+    Reverse `_encode`
+    """
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    if isinstance(value, dict):
+        if "enum" in value:
+            enum = _resolve_enum(value["enum"])
+            try:
+                return enum(value["value"])
+            except ValueError as e:
+                raise IRError(f"cannot decode {value}: {e}")
+        return _resolve_function(value["function"])
+    return value
+
+
+def _template_to_dict(template: Template) -> Dict[str, Any]:
+    data: Dict[str, Any] = {
+        "args": {name: _encode(arg) for name, arg in template.args.items()}
+    }
+    if template.function is not None:
+        data["function"] = _reference(template.function)
+    else:
+        data["jinja_file"] = template.jinja_file
+    if template.custom_text:
+        data["custom_text"] = template.custom_text
+    return data
+
+
+def _template_from_dict(data: Dict[str, Any]) -> Template:
+    function: Optional[Callable] = None
+    if "function" in data:
+        function = _resolve_function(data["function"])
+    args = {name: _decode(arg) for name, arg in data["args"].items()}
+    return Template.intern(
+        jinja_file=data.get("jinja_file"),
+        args=args,
+        function=function,
+        custom_text=data.get("custom_text", ""),
+    )
+
+
+def to_dict(plc: Plc) -> Dict[str, Any]:
+    """
+    Convert a resolved Plc model to plain data
+
+    Args:
+        plc (Plc): The Plc model
+
+    Returns:
+        Dict[str, Any]: a dictionary of lists, strings and numbers only
+
+    Raises:
+        IRError: The model refers to something that cannot be serialized
+    """
+    return {
+        "version": IR_VERSION,
+        "plc_num": plc.plc_num,
+        "controller": plc.controller.value,
+        "filepath": str(plc.filepath),
+        "timeout": plc.timeout,
+        "post": _encode(plc.post),
+        "skip_homed": plc.skip_homed,
+        "resumable": plc.resumable,
+        "extra_pvars_base": plc.extra_pvars_base,
+        "motors": [[m.axis, m.jdist, m.index] for m in plc.motors.values()],
+        "groups": [
+            {
+                "group_num": group.group_num,
+                "post_home": _encode(group.post_home),
+                "post_distance": group.post_distance,
+                "comment": group.comment,
+                "pre": group.pre,
+                "post": group.post,
+                "pipelined": group.pipelined,
+                "skip_homed": group.skip_homed,
+                "htype": group.htype,
+                "motors": [m.axis for m in group.all_motors],
+                "templates": [_template_to_dict(t) for t in group.templates],
+            }
+            for group in plc.groups
+        ],
+        "concurrent": plc.concurrent,
+        "coordinates": plc.coordinates,
+    }
+
+
+def from_dict(data: Dict[str, Any], filepath: Optional[Path] = None) -> Plc:
+    """
+    Recreate a Plc model from the plain data made by `to_dict`
+
+    Args:
+        data (Dict[str, Any]): The IR of a Plc model
+        filepath (Optional[Path]): Override the output file recorded in the IR
+
+    Returns:
+        Plc: The Plc model, ready to render
+
+    Raises:
+        IRError: The IR is an unsupported version or refers to callbacks that
+            no longer exist
+    """
+    if data.get("version") != IR_VERSION:
+        raise IRError(f"unsupported IR version {data.get('version')}")
+
+    plc_num = data["plc_num"]
+    plc = Plc(
+        plc_num,
+        ControllerType(data["controller"]),
+        Path(filepath or data["filepath"]),
+        data["timeout"],
+        _decode(data["post"]),
+        data.get("skip_homed", False),
+        data.get("resumable", False),
+        data.get("extra_pvars_base", Plc.EXTRA_PVARS_BASE),
+    )
+    for axis, jdist, index in data["motors"]:
+        plc.motors[axis] = Motor(axis, jdist, plc_num, index=index)
+
+    for group_data in data["groups"]:
+        group = Group(
+            group_data["group_num"],
+            plc_num,
+            plc.controller,
+            _decode(group_data["post_home"]),
+            group_data["post_distance"],
+            group_data["comment"],
+            group_data["pre"],
+            group_data["post"],
+            group_data.get("pipelined", False),
+            group_data.get("skip_homed", False),
+        )
+        group.htype = group_data["htype"]
+        group.all_motors = [plc.motors[axis] for axis in group_data["motors"]]
+        group.motors = group.all_motors
+        group.templates = [_template_from_dict(t) for t in group_data["templates"]]
+        plc.groups.append(group)
+    plc.concurrent = [list(nums) for nums in data.get("concurrent", [])]
+    plc.coordinates = list(data.get("coordinates", []))
+    return plc
+
+
+def dumps(plc: Plc) -> str:
+    """
+    Serialize a Plc model to JSON text
+    """
+    return json.dumps(to_dict(plc), indent=1)
+
+
+def loads(text: str, filepath: Optional[Path] = None) -> Plc:
+    """
+    Deserialize a Plc model from JSON text made by `dumps`
+    """
+    return from_dict(json.loads(text), filepath)
+
+
+def dumpb(plc: Plc) -> bytes:
+    """
+    Serialize a Plc model to the compact binary form
+    """
+    text = json.dumps(to_dict(plc), separators=(",", ":"))
+    return MAGIC + zlib.compress(text.encode())
+
+
+def loadb(data: bytes, filepath: Optional[Path] = None) -> Plc:
+    """
+    Deserialize a Plc model from the binary form made by `dumpb`
+    """
+    if not data.startswith(MAGIC):
+        raise IRError("not a binary pmac_motorhome IR")
+    try:
+        text = zlib.decompress(data[len(MAGIC) :]).decode()
+    except zlib.error as e:
+        raise IRError(f"corrupt binary IR: {e}")
+    return from_dict(json.loads(text), filepath)
+
+
+def dump(plc: Plc, path: Path) -> None:
+    """
+    Write a Plc model to a file. Files with the suffix '.json' are written as
+    JSON text, anything else in the binary form.
+
+    Args:
+        plc (Plc): The Plc model
+        path (Path): The file to write
+    """
+    path = Path(path)
+    if path.suffix == ".json":
+        path.write_text(dumps(plc) + "\n")
+    else:
+        path.write_bytes(dumpb(plc))
+
+
+def load(path: Path, filepath: Optional[Path] = None) -> Plc:
+    """
+    Read a Plc model from a file written by `dump`
+
+    Args:
+        path (Path): The file to read
+        filepath (Optional[Path]): Override the output file recorded in the IR
+
+    Returns:
+        Plc: The Plc model, ready to render
+    """
+    data = Path(path).read_bytes()
+    if data.startswith(MAGIC):
+        return loadb(data, filepath)
+    return loads(data.decode(), filepath)
@@ -0,0 +1,160 @@
+"""
+Build manifests for incremental generation.
+
+A manifest is written alongside each generated PLC. It records a hash of the
+resolved Plc model, a hash of the snippet templates, the package version and
+a hash of the output file. When a definition file is run again and none of
+these have changed, the PLC does not need to be rendered again.
+"""
+
+import hashlib
+import json
+from enum import Enum
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from ._version_git import __version__
+from .plcgenerator import PlcGenerator, snippets_hash
+
+if TYPE_CHECKING:
+    from .plc import Plc
+
+# increment this if the content of the manifest changes
+MANIFEST_VERSION = 1
+
+
+def _symbol(value: Any) -> Any:
+    """
+    Convert values that json cannot serialize into a stable representation
+    """
+    if isinstance(value, Enum):
+        return value.value
+    if callable(value):
+        return f"{value.__module__}.{value.__qualname__}"
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    return repr(value)
+
+
+def model_hash(plc: "Plc") -> str:
+    """
+    Hash everything about a Plc model that affects its rendered output
+
+    Args:
+        plc (Plc): The resolved Plc model
+
+    Returns:
+        str: a hex digest
+    """
+    model = {
+        "plc_num": plc.plc_num,
+        "controller": plc.controller,
+        "timeout": plc.timeout,
+        "post": plc.post,
+        "skip_homed": plc.skip_homed,
+        "resumable": plc.resumable,
+        "extra_pvars_base": plc.extra_pvars_base,
+        "motors": [(m.axis, m.jdist, m.index) for m in plc.motors.values()],
+        "groups": [
+            {
+                "group_num": group.group_num,
+                "post_home": group.post_home,
+                "post_distance": group.post_distance,
+                "comment": group.comment,
+                "pre": group.pre,
+                "post": group.post,
+                "pipelined": group.pipelined,
+                "skip_homed": group.skip_homed,
+                "htype": group.htype,
+                "motors": [m.axis for m in group.all_motors],
+                "templates": [
+                    (t.jinja_file, t.function, dict(t.args), t.custom_text)
+                    for t in group.templates
+                ],
+            }
+            for group in plc.groups
+        ],
+        "concurrent": plc.concurrent,
+        "coordinates": plc.coordinates,
+    }
+    text = json.dumps(model, sort_keys=True, default=_symbol)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def templates_hash() -> str:
+    """
+    Hash the contents of all of the snippet templates, including those in
+    `PlcGenerator.snippet_dirs`
+
+    Returns:
+        str: a hex digest
+    """
+    return snippets_hash(PlcGenerator.snippet_folders())
+
+
+def file_hash(filepath: Path) -> Optional[str]:
+    """
+    Hash the contents of a file
+
+    Returns:
+        Optional[str]: a hex digest or None if the file does not exist
+    """
+    try:
+        return hashlib.sha256(filepath.read_bytes()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def manifest_path(filepath: Path) -> Path:
+    """
+    Get the path of the manifest for an output file
+    """
+    return filepath.with_name(f".{filepath.name}.manifest")
+
+
+def make_manifest(plc: "Plc") -> Dict[str, Any]:
+    """
+    Create the manifest entries describing the inputs to a Plc
+    """
+    return {
+        "version": MANIFEST_VERSION,
+        "package": __version__,
+        "model": model_hash(plc),
+        "templates": templates_hash(),
+    }
+
+
+def is_up_to_date(plc: "Plc") -> bool:
+    """
+    Determine if the output file of a Plc was generated from identical inputs
+    and has not been modified since
+
+    Args:
+        plc (Plc): The resolved Plc model
+
+    Returns:
+        bool: True if the Plc does not need to be rendered
+    """
+    try:
+        recorded = json.loads(manifest_path(plc.filepath).read_text())
+    except (OSError, ValueError):
+        return False
+
+    output = recorded.pop("output", None)
+    return (
+        recorded == make_manifest(plc)
+        and output is not None
+        and output == file_hash(plc.filepath)
+    )
+
+
+def write_manifest(plc: "Plc") -> None:
+    """
+    Record the inputs to a Plc alongside its freshly written output file
+
+    Args:
+        plc (Plc): The resolved Plc model
+    """
+    manifest = make_manifest(plc)
+    manifest["output"] = file_hash(plc.filepath)
+    manifest_path(plc.filepath).write_text(json.dumps(manifest, indent=2) + "\n")
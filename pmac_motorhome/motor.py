@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Any, Dict
 
 from pmac_motorhome.constants import PostHomeMove
 
@@ -10,7 +10,16 @@ class Motor:
     Should always be instantiated using `pmac_motorhome.commands.motor`
     """
 
-    instances: Dict[int, "Motor"] = {}
+    # there may be many thousands of these in a large build so keep them compact
+    __slots__ = (
+        "axis",
+        "jdist",
+        "index",
+        "plc_num",
+        "post_home",
+        "nx",
+        "macro_station",
+    )
 
     # offsets into the PLC's PVariables for storing the state of axes
     # these names go into long format strings so keep them short for legibility
@@ -29,7 +38,7 @@ class Motor:
         jdist: int,
         plc_num: int,
         post_home: PostHomeMove = PostHomeMove.none,
-        index: int = -1,
+        index: int = 0,
     ) -> None:
         """
         Args:
@@ -39,70 +48,64 @@ class Motor:
             plc_num (int): the plc number of the enclosing Plc
             post_home (PostHomeMove): the action to perform on this motor when
                 hohing is complete
-            index (int): for internal use in conversion of old scripts sets
-                the index of this motor to a different value than the order of
-                declaration.
+            index (int): the index of this motor's p variables within the
+                Plc, usually the order of declaration, see `Plc.get_motor`
         """
         self.axis = axis
         self.jdist = jdist
-        if index == -1:
-            self.index = len(self.instances)
-        else:
-            self.index = index
-
-        self.instances[axis] = self
+        self.plc_num = plc_num
+        self.index = index
         self.post_home = 0
+        # derived values used in PLC code, these never change
+        self.nx: str = self.calc_nx(axis)
+        self.macro_station: str = self.calc_macro_station(axis)
 
-        # dict is for terse string formatting code in _all_axes() functions
-        self.dict = {
-            "axis": axis,
+    @property
+    def dict(self) -> Dict[str, Any]:
+        """
+        The values for terse string formatting code in _all_axes() functions.
+        This is created on each access, see `pmac_motorhome.axistable.AxisTable`
+        which holds these values for a group of motors.
+        """
+        values: Dict[str, Any] = {
+            "axis": self.axis,
             "index": self.index,
-            "jdist": jdist,
+            "jdist": self.jdist,
             "homed_flag": f"7{self.nx}2",
             "inverse_flag": f"7{self.nx}3",
             "macro_station": self.macro_station,
         }
-        for name, start in self.PVARS.items():
-            self.dict[name] = plc_num * 100 + start + self.index
+        for name in self.PVARS:
+            values[name] = self.pvar(name)
+        return values
 
-    @classmethod
-    def get_motor(
-        cls,
-        axis: int,
-        jdist: int,
-        plc_num: int,
-        post_home: PostHomeMove = PostHomeMove.none,
-        index: int = -1,
-    ) -> "Motor":
-        """
-        A factory function to return a Motor object but ensure that there
-        is only ever one instance of each axis number. This is required since
-        PLC code allocates p variables on a per axis basis.
+    def pvar(self, name: str) -> int:
         """
-        motor = cls.instances.get(axis)
-        if motor is None:
-            motor = Motor(axis, jdist, plc_num, post_home, index)
+        Get the number of the P variable that stores some state of this motor
 
-        return motor
+        Args:
+            name (str): one of the names in `Motor.PVARS`
+        """
+        return self.plc_num * 100 + self.PVARS[name] + self.index
 
     # TODO IMPORTANT - this is used in finding the Home capture flags etc. and is
     # specific to Geobrick - For a full implementation see Motor class in
     #  ... pmacutil/pmacUtilApp/src/motorhome.py
     # HINT: watch out for python 2 vs python 3 handling of integer arithmetic
-    @property
-    def nx(self) -> str:
-        nx = int(int((self.axis - 1) / 4) * 10 + int((self.axis - 1) % 4 + 1))
+    @staticmethod
+    def calc_nx(axis: int) -> str:
+        nx = int(int((axis - 1) / 4) * 10 + int((axis - 1) % 4 + 1))
         return "{:02}".format(nx)
 
     @property
     def homed(self):
-        return self.dict["homed"]
+        return self.pvar("homed")
 
     @property
     def not_homed(self):
-        return self.dict["not_homed"]
+        return self.pvar("not_homed")
 
-    @property
-    def macro_station(self) -> str:
-        msr = int(4 * int(int(self.axis - 1) / 2) + int(self.axis - 1) % 2)
+    @staticmethod
+    def calc_macro_station(axis: int) -> str:
+        msr = int(4 * int(int(axis - 1) / 2) + int(axis - 1) % 2)
         return "{}".format(msr)
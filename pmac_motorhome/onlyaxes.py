@@ -1,4 +1,5 @@
-# from typing import Optional
+from contextvars import ContextVar
+from typing import Optional
 
 from .group import Group
 
@@ -10,8 +11,11 @@ class OnlyAxes:
     Should always be instantiated using `pmac_motorhome.commands.only_axes`
     """
 
-    # a class member to hold the current context instance
-    the_only_axes = None
+    # holds the instance in the current context, separately for each thread
+    # and asyncio task
+    current: ContextVar[Optional["OnlyAxes"]] = ContextVar(
+        "the_only_axes", default=None
+    )
 
     def __init__(self, *axes):
         """
@@ -23,16 +27,16 @@ class OnlyAxes:
 
     def __enter__(self):
         assert (
-            not OnlyAxes.the_only_axes
+            not OnlyAxes.current.get()
         ), "cannot use only_axes within another only_axes"
 
-        OnlyAxes.the_only_axes = self
+        OnlyAxes.current.set(self)
         group = Group.instance()
         group.add_action(Group.set_axis_filter, axes=self.axes)
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
-        OnlyAxes.the_only_axes = None
+        OnlyAxes.current.set(None)
         group = Group.instance()
         # empty axis filter means reset the axis filter
         group.add_action(Group.set_axis_filter, axes=[])
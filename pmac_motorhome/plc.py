@@ -1,16 +1,52 @@
 import logging
+import time
 from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Optional
+from typing import IO, TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional
 
+from .axistable import AxisTable
 from .constants import ControllerType, PostHomeMove
+from .dialect import dialect_specific, render_dialects
 from .group import Group
 from .motor import Motor
 from .plcgenerator import PlcGenerator
 
+if TYPE_CHECKING:
+    from .groupcache import Renderer
+
 log = logging.getLogger(__name__)
 
 
+@dataclass
+class PlcOutput:
+    """
+    A record of one PLC generated by a definition file
+
+    Args:
+        plc_num (int): The PLC number
+        filepath (Path): The output file
+        seconds (float): Time taken to declare and render the PLC
+        error (Optional[str]): Description of the failure if the PLC definition
+            raised an exception, in which case no output was written
+        skipped (bool): True if an incremental build found the output up to date
+        changed (bool): True if the output file was written
+    """
+
+    plc_num: int
+    filepath: Path
+    seconds: float
+    error: Optional[str] = None
+    skipped: bool = False
+    changed: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
 class Plc:
     """
     This class is used in a PLC definition to declare that a PLC is to
@@ -19,8 +55,36 @@ class Plc:
     Should always be instantiated using `pmac_motorhome.commands.plc`
     """
 
-    # this class variable holds the instance in the current context
-    the_plc: Optional["Plc"] = None
+    # holds the instance in the current context. This is separate for each thread
+    # and asyncio task so that many PLCs may be declared concurrently
+    current: ContextVar[Optional["Plc"]] = ContextVar("the_plc", default=None)
+    # when not None, Plcs are appended here instead of being written, see capture
+    captured: ContextVar[Optional[List["Plc"]]] = ContextVar("captured", default=None)
+    # the settings of the build in the current context, see build_script.
+    # When not None, a PlcOutput is appended here for every PLC generated
+    outputs: ContextVar[Optional[List[PlcOutput]]] = ContextVar(
+        "outputs", default=None
+    )
+    # when True, skip rendering PLCs whose manifest shows they are up to date
+    incremental: ContextVar[bool] = ContextVar("incremental", default=False)
+    # when True, do not rewrite output files whose content would not change
+    write_if_changed: ContextVar[bool] = ContextVar("write_if_changed", default=False)
+    # when not None, save the IR of every PLC generated into this directory
+    ir_dir: ContextVar[Optional[Path]] = ContextVar("ir_dir", default=None)
+    # when not None, every Plc successfully declared is appended here
+    declared: ContextVar[Optional[List["Plc"]]] = ContextVar("declared", default=None)
+    # P{plc}00..99 are all in use, so features that need more P variables use
+    # P(extra_pvars_base + plc * EXTRA_PVARS_PER_PLC) onwards, see extra_pvar
+    EXTRA_PVARS_BASE = 4000
+    EXTRA_PVARS_PER_PLC = 100
+    # the highest P variable that the extra P variables may use
+    MAX_PVAR = 8191
+    # the extra P variables that a resumable PLC uses to record the groups
+    # that are done and to select resume mode
+    DONE_PVAR = 2
+    RESUME_PVAR = 3
+    # the highest group number that fits in the bitmask of groups that are done
+    MAX_RESUMABLE_GROUP = 23
 
     def __init__(
         self,
@@ -29,27 +93,49 @@ class Plc:
         filepath: Path,
         timeout: int,
         post,
+        skip_homed: bool = False,
+        resumable: bool = False,
+        extra_pvars_base: int = EXTRA_PVARS_BASE,
     ) -> None:
         """
         Args:
             plc_num (int): The PLC number to use in generated code
             controller (ControllerType):  target controller type for the code
             filepath (pathlib.Path): ouput file to receive the generated code
+            skip_homed (bool): the default for skipping groups whose axes are
+                all homed, see `Group`
+            resumable (bool): record the groups that are done, so that homing
+                all groups can resume after a failure
+            extra_pvars_base (int): where the extra P variables of all PLCs
+                start, see `extra_pvar`
 
         Raises:
             ValueError: Invalid output file name
             ValueError: Invalid PLC number supplied
+            ValueError: Invalid extra P variables supplied
         """
-        self.filepath = filepath
+        # absolute, so that the Plc can still be rendered after a change of folder
+        self.filepath = Path(filepath).absolute()
         self.plc_num = plc_num
         self.controller: ControllerType = controller
         self.timeout: int = timeout
         self.post = post
+        self.skip_homed = skip_homed
+        self.resumable = resumable
+        self.extra_pvars_base = extra_pvars_base
 
         self.groups: List[Group] = []
+        # the motors in all groups, one instance per axis, see get_motor
         self.motors: "OrderedDict[int, Motor]" = OrderedDict()
+        self._axis_table: Optional[AxisTable] = None
+        # the group numbers of each set of groups that may home concurrently,
+        # and the set being declared, see `pmac_motorhome.concurrent`
+        self.concurrent: List[List[int]] = []
+        self.concurrent_set: Optional[List[int]] = None
+        # the homing PLCs started by a coordinator PLC, see coordinate
+        self.coordinates: List[int] = []
         self.generator = PlcGenerator()
-        if not self.filepath.parent.exists():
+        if not self.filepath.parent.exists() and Plc.captured.get() is None:
             log.error(f"Cant find parent of {self.filepath} from dir {Path.cwd()}")
             raise ValueError(
                 f"bad file path {self.filepath.parent}\
@@ -61,37 +147,218 @@ class Plc:
             or not isinstance(self.plc_num, int)
         ):
             raise ValueError("plc_number should be integer between 9 and 32")
+        first = self.extra_pvar(0)
+        last = self.extra_pvar(Plc.EXTRA_PVARS_PER_PLC - 1)
+        if first < 0 or last > Plc.MAX_PVAR:
+            raise ValueError(
+                f"extra P variables P{first}..P{last} are not between P0 and "
+                f"P{Plc.MAX_PVAR}"
+            )
+        if first <= self.plc_num * 100 + 99 and last >= self.plc_num * 100:
+            raise ValueError(
+                f"extra P variables P{first}..P{last} overlap P{self.plc_num}00..99"
+            )
 
     def __enter__(self):
         """
         Enter context: store the in-scope Plc object
         """
-        assert not Plc.the_plc, "cannot create a new Plc within a Plc context"
-        Plc.the_plc = self
+        assert not Plc.current.get(), "cannot create a new Plc within a Plc context"
+        Plc.current.set(self)
+        self.start_time = time.perf_counter()
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
-        Plc.the_plc = None
+        Plc.current.set(None)
         """
         Leaving the context. Use the in scope Plc object to generate the
         PLC output code.
         """
-        # need to do this for the case where 2 PLCs are defined in one file
-        # (including in the unit tests)
-        Motor.instances = {}
+        # write out PLC, unless its definition failed or it is already up to date
+        error = None
+        skipped = changed = False
+        captured = Plc.captured.get()
+        incremental = Plc.incremental.get()
+        declared = Plc.declared.get()
+        ir_dir = Plc.ir_dir.get()
+        outputs = Plc.outputs.get()
+        if incremental:
+            # only needed for incremental builds, so import when used
+            from . import manifest
+        try:
+            if exception_type is not None:
+                error = f"{exception_type.__name__}: {exception_value}"
+            elif captured is not None:
+                captured.append(self)
+            elif incremental and manifest.is_up_to_date(self):
+                skipped = True
+            else:
+                changed = self.write(only_if_changed=Plc.write_if_changed.get())
+                if incremental:
+                    manifest.write_manifest(self)
+            if declared is not None and error is None:
+                declared.append(self)
+            if ir_dir is not None and error is None:
+                # import here because the ir module depends on this one
+                from . import ir
+
+                ir.dump(self, ir_dir / f"{self.filepath.name}.ir")
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            # the cached code fragments are only useful during rendering
+            self.clear_axis_tables()
+            if outputs is not None:
+                seconds = time.perf_counter() - self.start_time
+                output = PlcOutput(
+                    self.plc_num, self.filepath, seconds, error, skipped, changed
+                )
+                outputs.append(output)
+
+    def render(self) -> str:
+        """
+        Render the PLC code to a string, without writing any files
+        """
+        return self.generator.render(self.template_name(), plc=self)
+
+    def render_to(self, stream: IO[str]) -> None:
+        """
+        Render the PLC code to a text stream, a chunk at a time
+
+        Args:
+            stream (IO[str]): the text stream to write to
+        """
+        self.generator.render_to(stream, self.template_name(), plc=self)
+
+    def template_name(self) -> str:
+        """
+        Get the name of the root template that renders this PLC
+        """
+        return "coordinator.pmc.jinja" if self.coordinates else "plc.pmc.jinja"
+
+    def coordinate(self, plc_nums: Iterable[int]) -> None:
+        """
+        Make this a coordinator PLC, which homes several homing PLCs at the
+        same time instead of homing groups of its own
+
+        Args:
+            plc_nums (Iterable[int]): the numbers of the homing PLCs
+
+        Raises:
+            ValueError: No PLCs, or an invalid or duplicate PLC number supplied
+        """
+        plc_nums = list(plc_nums)
+        if not plc_nums:
+            raise ValueError("a coordinator needs at least one PLC to start")
+        for num in plc_nums:
+            if not isinstance(num, int) or num < 8 or num > 32:
+                raise ValueError(f"bad PLC number {num} to coordinate")
+            if num == self.plc_num:
+                raise ValueError(f"PLC {num} cannot coordinate itself")
+        if len(set(plc_nums)) != len(plc_nums):
+            raise ValueError(f"duplicate PLC numbers in {plc_nums}")
+        self.coordinates = plc_nums
+
+    def render_dialects(
+        self, controllers: Iterable[ControllerType]
+    ) -> Dict[ControllerType, str]:
+        """
+        Render the PLC code for several controller types at once, without
+        writing any files. The code that is the same for every controller
+        type is only rendered once, see `pmac_motorhome.dialect`.
+
+        Args:
+            controllers (Iterable[ControllerType]): the controller types
+
+        Returns:
+            Dict[ControllerType, str]: the PLC code for each controller type
+        """
+        return render_dialects(self, controllers)
+
+    def group_sections(self) -> List[List[Group]]:
+        """
+        Divide the groups into sections that are homed one after another. A
+        section is either a single group or a set of concurrent groups.
+        """
+        sets = {num: i for i, nums in enumerate(self.concurrent) for num in nums}
+        sections: List[List[Group]] = []
+        for group in self.groups:
+            current = sets.get(group.group_num)
+            if current is not None and sections:
+                if sets.get(sections[-1][0].group_num) == current:
+                    sections[-1].append(group)
+                    continue
+            sections.append([group])
+        return sections
+
+    def render_groups(
+        self, groups: List[Group], renderer: Optional["Renderer"] = None
+    ) -> str:
+        """
+        Render the code that homes one section of the groups of this Plc.
+        Called from plc.pmc.jinja.
+
+        Args:
+            groups (List[Group]): a section from `group_sections`
+            renderer (Optional[Renderer]): renders the code for each group,
+                see `PlcGenerator.render_group`
+        """
+        if len(groups) == 1 and not groups[0].pipelined:
+            return self.generator.render_group(self, groups[0], renderer)
+        # import here because the concurrent module depends on this one
+        from .concurrent import render_concurrent
+
+        return render_concurrent(self, groups, renderer)
 
-        # write out PLC
-        plc_text = self.generator.render("plc.pmc.jinja", plc=self)
-        with self.filepath.open("w") as stream:
-            stream.write(plc_text)
+    def extra_pvar(self, offset: int) -> int:
+        """
+        Get one of the P variables reserved for this PLC outside P{plc}00..99
+
+        Args:
+            offset (int): the offset into the reserved P variables
+
+        Returns:
+            int: the P variable number
+        """
+        assert 0 <= offset < Plc.EXTRA_PVARS_PER_PLC, f"bad P variable {offset}"
+        return self.extra_pvars_base + self.plc_num * Plc.EXTRA_PVARS_PER_PLC + offset
+
+    def uses_extra_pvars(self) -> bool:
+        """
+        Determine if the PLC code uses any of the extra P variables, for
+        concurrent or pipelined groups or to resume homing
+        """
+        return self.resumable or any(
+            len(groups) > 1 or groups[0].pipelined for groups in self.group_sections()
+        )
+
+    def write(self, only_if_changed: bool = False) -> bool:
+        """
+        Render the PLC code to the output file
+
+        Args:
+            only_if_changed (bool): leave the output file untouched if its
+                content would not change
+
+        Returns:
+            bool: True if the output file was written
+        """
+        return self.generator.render_to_file(
+            self.filepath,
+            self.template_name(),
+            only_if_changed=only_if_changed,
+            plc=self,
+        )
 
     @classmethod
     def instance(cls) -> "Plc":
         """
         Get the current in-scope PLC.
         """
-        assert cls.the_plc, "There is no group context currently defined"
-        return cls.the_plc
+        plc = cls.current.get()
+        assert plc, "There is no group context currently defined"
+        return plc
 
     @classmethod
     def add_group(
@@ -102,6 +369,8 @@ class Plc:
         comment: str = None,
         pre: str = None,
         post: str = None,
+        pipelined: bool = False,
+        skip_homed: Optional[bool] = None,
     ) -> Group:
         """
         Add a new group of axes to the current Plc
@@ -110,11 +379,23 @@ class Plc:
             group_num (int): A Unique group number (1 is reserved for 'All Groups')
             post_home (PostHomeMove): A post home action to perform on success
             post_distance (int): A distance for those post home actions which require it
+            pipelined (bool): Home each axis of the group on its own
+            skip_homed (Optional[bool]): Skip the group if its axes are all
+                homed, None to use the setting of the Plc
 
         Returns:
             Group: The newly created Group
+
+        Raises:
+            ValueError: The group number does not fit the bitmask of a
+                resumable Plc
         """
         plc = Plc.instance()
+        if plc.resumable and not 0 < group_num <= Plc.MAX_RESUMABLE_GROUP:
+            raise ValueError(
+                f"group numbers of a resumable PLC must be between 1 and "
+                f"{Plc.MAX_RESUMABLE_GROUP}"
+            )
         group = Group(
             group_num,
             plc.plc_num,
@@ -124,25 +405,51 @@ class Plc:
             comment,
             pre,
             post,
+            pipelined,
+            plc.skip_homed if skip_homed is None else skip_homed,
         )
         if group.post_home is None:
             group.post_home = plc.post
         plc.groups.append(group)
+        if plc.concurrent_set is not None:
+            plc.concurrent_set.append(group_num)
         return group
 
     @classmethod
-    def add_motor(cls, axis: int, motor: Motor):
+    def get_motor(cls, axis: int, jdist: int, index: int = -1) -> Motor:
         """
-        Add a motor to the PLC. The Plc object collects all the motors in all
-        of its groups for use in the Plc callback functions.
+        Get the Motor for an axis of the current Plc, creating it the first time
+        the axis is declared. There is only ever one instance of each axis
+        number in a Plc since PLC code allocates p variables on a per axis basis.
+        The Plc object collects all the motors in all of its groups for use in
+        the Plc callback functions.
 
         Args:
             axis (int): axis number
-            motor (Motor): motor details
+            jdist (int): distance to jog to move off of home mark
+            index (int): the index of the motor's p variables, -1 means use
+                the order that motors were declared
+
+        Returns:
+            Motor: The Motor for this axis
         """
         plc = Plc.instance()
-        if axis not in plc.motors:
+        motor = plc.motors.get(axis)
+        if motor is None:
+            if index == -1:
+                index = len(plc.motors)
+            motor = Motor(axis, jdist, plc.plc_num, index=index)
             plc.motors[axis] = motor
+            plc._axis_table = None
+        return motor
+
+    def clear_axis_tables(self) -> None:
+        """
+        Discard the cached code fragments for this Plc and its groups
+        """
+        self._axis_table = None
+        for group in self.groups:
+            group.clear_axis_tables()
 
     def _all_axes(self, format: str, separator: str, *arg) -> str:
         """
@@ -160,9 +467,10 @@ class Plc:
         # of the axis object so its elements can be addressed by name
 
         # PLC P variables etc must be sorted to match original motorhome.py
-        motors = sorted(self.motors.values(), key=lambda x: x.index)
-        all = [format.format(*arg, **ax.dict) for ax in motors]
-        return separator.join(all)
+        if self._axis_table is None:
+            motors = sorted(self.motors.values(), key=lambda x: x.index)
+            self._axis_table = AxisTable(motors)
+        return self._axis_table.join(format, separator, *arg)
 
     ############################################################################
     # the following functions are callled from Jinja templates to generate
@@ -195,6 +503,29 @@ class Plc:
         """
         return self._all_axes("i{axis}14=P{lo_lim}", " ")
 
+    @dialect_specific
+    def controller_name(self) -> str:
+        """
+        Generate the name of the controller type for the PLC header
+        """
+        return self.controller.value
+
+    @dialect_specific
+    def check_homed_flags(self) -> str:
+        """
+        Generate the code that flags a macro error if any homed flag is zero,
+        which is only needed on a PMAC
+        """
+        if self.controller is not ControllerType.pmac:
+            return ""
+        return (
+            ";If any are zero then there is probably a macro error\n"
+            f"if ({self.are_homed_flags_zero()})\n"
+            "    HomingStatus=StatusInvalid\n"
+            "endif\n"
+        )
+
+    @dialect_specific
     def save_homed(self):
         """
         Generate a command string for saving all axes homed state
@@ -210,6 +541,7 @@ class Plc:
         """
         return self._all_axes("P{not_homed}=P{homed}^$C", " ")
 
+    @dialect_specific
     def restore_homed(self):
         """
         Generate a command string for restoring all axes homed state
@@ -257,3 +589,31 @@ class Plc:
         Generate a command string for checking if all axes homed=0
         """
         return self._all_axes("P{homed}=0", " or ")
+
+
+@contextmanager
+def capture() -> Iterator[List[Plc]]:
+    """
+    A context in which PLCs are declared without writing any files. Instead
+    each Plc is appended to the list returned on entry, ready to `Plc.render`.
+    The filepath of each Plc is only a name, so its folder need not exist.
+
+    Rendering still saves compiled templates in the bytecode cache, unless it
+    is disabled with ``PlcGenerator.configure(cache_dir=False)``.
+
+    For example::
+
+        with capture() as plcs:
+            with plc(plc_num=11, controller="GeoBrick", filepath="PLC11.pmc"):
+                ...
+        text = plcs[0].render()
+
+    Returns:
+        List[Plc]: the Plcs declared in the context
+    """
+    plcs: List[Plc] = []
+    token = Plc.captured.set(plcs)
+    try:
+        yield plcs
+    finally:
+        Plc.captured.reset(token)
@@ -1,23 +1,531 @@
+import filecmp
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from functools import partial
 from pathlib import Path
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
-from jinja2 import Environment, FileSystemLoader
+# jinja2 and the python emitters are only imported when they are first used
+# so that importing pmac_motorhome.commands in a definition file is quick
+if TYPE_CHECKING:
+    from jinja2 import BaseLoader, BytecodeCache, Environment
+
+    from .group import Group
+    from .groupcache import GroupCache, Renderer
+    from .plc import Plc
+
+log = logging.getLogger(__name__)
 
 this_path = Path(__file__).parent
 jinja_path = this_path / "snippets"
+# the snippet templates compiled to python modules when the package is built,
+# this folder only exists in installed copies of pmac_motorhome
+compiled_path = this_path / "compiled_snippets"
+# records the jinja version and the templates that compiled_path was made from
+STAMP_NAME = "stamp.json"
 
+# environment variable that overrides the bytecode cache folder, set it to an
+# empty string to disable the cache
+CACHE_ENV = "PMAC_MOTORHOME_CACHE"
+# environment variable that selects the default rendering backend
+BACKEND_ENV = "PMAC_MOTORHOME_BACKEND"
+BACKENDS = ("jinja", "python", "conformance")
+# environment variable listing extra folders of snippet templates, separated
+# by os.pathsep
+SNIPPETS_ENV = "PMAC_MOTORHOME_SNIPPETS"
 
-class PlcGenerator:
-    def __init__(self) -> None:
-        self.templateLoader = FileSystemLoader(searchpath=jinja_path)
-        self.environment = Environment(
-            loader=self.templateLoader,
-            trim_blocks=True,
-            lstrip_blocks=True,
-            keep_trailing_newline=True,
+# the options for every jinja Environment, compiled templates depend on them
+ENVIRONMENT_OPTIONS: Dict[str, Any] = dict(
+    trim_blocks=True, lstrip_blocks=True, keep_trailing_newline=True
+)
+
+
+def default_snippet_dirs() -> List[Path]:
+    """
+    Get the extra folders of snippet templates listed in $PMAC_MOTORHOME_SNIPPETS
+    """
+    value = os.environ.get(SNIPPETS_ENV, "")
+    return [Path(folder) for folder in value.split(os.pathsep) if folder]
+
+
+def snippets_hash(folders: Iterable[Path]) -> str:
+    """
+    Hash the contents of all of the snippet templates in some folders
+
+    Returns:
+        str: a hex digest
+    """
+    digest = hashlib.sha256()
+    for folder in folders:
+        for template in sorted(Path(folder).glob("*.jinja")):
+            digest.update(template.name.encode())
+            digest.update(template.read_bytes())
+    return digest.hexdigest()
+
+
+def snippets_stamp(folder: Path) -> FrozenSet[Tuple[str, int, int]]:
+    """
+    Get the name, size and modification time of each snippet template in a
+    folder, which is much quicker than `snippets_hash` for noticing a change
+
+    Returns:
+        FrozenSet[Tuple[str, int, int]]: the stamp of each template
+    """
+    with os.scandir(folder) as entries:
+        return frozenset(
+            (entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+            for entry in entries
+            if entry.name.endswith(".jinja")
         )
 
-    def render(self, template_name: str, **args) -> str:
+
+def compile_snippets(target: Path = compiled_path, source: Path = jinja_path) -> None:
+    """
+    Compile the snippet templates to python modules so that they can be loaded
+    without parsing them. setup.py calls this when the package is built.
+
+    This function must only use absolute imports because setup.py loads this
+    module without importing pmac_motorhome.
+
+    Args:
+        target (Path): the folder for the compiled modules
+        source (Path): the folder of snippet templates
+
+    Raises:
+        FileNotFoundError: there are no templates in source
+    """
+    from jinja2 import Environment, FileSystemLoader, __version__
+
+    if not any(source.glob("*.jinja")):
+        raise FileNotFoundError(f"no snippet templates in {source}")
+    environment = Environment(
+        loader=FileSystemLoader(searchpath=source), **ENVIRONMENT_OPTIONS
+    )
+    if target.exists():
+        shutil.rmtree(target)
+    environment.compile_templates(
+        target,
+        filter_func=lambda name: name.endswith(".jinja"),
+        zip=None,
+        ignore_errors=False,
+    )
+    stamp = {"jinja2": __version__, "templates": snippets_hash([source])}
+    (target / STAMP_NAME).write_text(json.dumps(stamp))
+
+
+def compiled_snippets_usable(
+    target: Path = compiled_path, source: Path = jinja_path
+) -> bool:
+    """
+    Determine if the compiled snippet templates match the source templates and
+    the installed version of jinja
+
+    Args:
+        target (Path): the folder of compiled modules
+        source (Path): the folder of snippet templates
+
+    Returns:
+        bool: True if the compiled templates can be used
+    """
+    try:
+        stamp = json.loads((target / STAMP_NAME).read_text())
+    except (OSError, ValueError):
+        return False
+    from jinja2 import __version__
+
+    if stamp.get("jinja2") != __version__:
+        log.info(f"ignoring snippets compiled for jinja {stamp.get('jinja2')}")
+        return False
+    if stamp.get("templates") != snippets_hash([source]):
+        log.warning(f"ignoring out of date compiled snippets in {target}")
+        return False
+    return True
+
+
+def default_cache_dir() -> Optional[Path]:
+    """
+    Get the folder used to cache compiled snippet templates between runs.
+
+    The cache is shared by every process on the host. Each cached template is
+    checked against a checksum of its source before use, and the folder name
+    includes the package version, so templates compiled by a different release
+    of pmac_motorhome are never reused.
+
+    Returns:
+        Optional[Path]: the cache folder or None if caching is disabled
+    """
+    override = os.environ.get(CACHE_ENV)
+    if override is not None:
+        return Path(override) if override else None
+
+    from ._version_git import __version__
+
+    root = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(root) / "pmac_motorhome" / __version__
+
+
+def make_bytecode_cache(cache_dir: Optional[Path]) -> Optional["BytecodeCache"]:
+    """
+    Create an on-disk bytecode cache for the jinja environment
+
+    Args:
+        cache_dir (Optional[Path]): folder for the cache, None for no cache
+
+    Returns:
+        Optional[BytecodeCache]: the cache or None if the folder is not usable
+    """
+    if cache_dir is None:
+        return None
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+    except OSError as e:
+        log.warning(f"template cache disabled, cannot create {cache_dir}: {e}")
+        return None
+    from jinja2 import FileSystemBytecodeCache
+
+    return FileSystemBytecodeCache(str(cache_dir), pattern="%s.cache")
+
+
+def make_loader(snippet_dirs: Iterable[Path]) -> "BaseLoader":
+    """
+    Create the loader for snippet templates. Templates in snippet_dirs come
+    first, then the compiled built-in templates if they are usable, otherwise
+    the source of the built-in templates.
+
+    Args:
+        snippet_dirs (Iterable[Path]): extra folders of snippet templates
+
+    Returns:
+        BaseLoader: the loader
+    """
+    from jinja2 import ChoiceLoader, FileSystemLoader, ModuleLoader
+
+    loaders: List["BaseLoader"] = []
+    snippet_dirs = list(snippet_dirs)
+    if snippet_dirs:
+        loaders.append(FileSystemLoader(searchpath=snippet_dirs))
+    if compiled_snippets_usable(compiled_path, jinja_path):
+        loaders.append(ModuleLoader(compiled_path))
+    # the source is still needed if the compiled templates are usable,
+    # for the templates that they do not include, e.g. a new snippet
+    loaders.append(FileSystemLoader(searchpath=jinja_path))
+    return ChoiceLoader(loaders)
+
+
+class PlcGenerator:
+    """
+    Renders jinja templates from the snippets folder.
+
+    All instances share one jinja Environment per process, which is created on
+    first use. The Environment holds compiled templates in a bounded cache so
+    that definition files declaring many PLCs only compile each template once.
+
+    Installed copies of pmac_motorhome include the built-in templates compiled
+    to python modules, see `compile_snippets`, so they are never parsed. The
+    source templates are used in a development tree, and always for the
+    templates in `snippet_dirs`.
+    """
+
+    #: the Environment shared by every PlcGenerator in this process
+    shared_environment: Optional["Environment"] = None
+    # the Environment is shared by all threads, so only create it once
+    environment_lock = threading.Lock()
+    #: the maximum number of compiled templates held in memory
+    cache_size: int = 400
+    #: folder for the compiled template cache, None for `default_cache_dir`,
+    #: False for no cache
+    cache_dir: Union[Path, bool, None] = None
+    #: extra folders of snippet templates, searched before the built-in
+    #: snippets, None for `default_snippet_dirs`
+    snippet_dirs: Optional[List[Path]] = None
+    # the names of built-in templates replaced by a template in snippet_dirs
+    overridden: FrozenSet[str] = frozenset()
+    #: how to render PLCs: "jinja", "python" for the faster native emitters in
+    #: `pmac_motorhome.emitter`, or "conformance" to render with both and raise
+    #: `pmac_motorhome.emitter.ConformanceError` if they differ
+    backend: str = os.environ.get(BACKEND_ENV, "jinja")
+    #: the code of groups with the same structure, see `pmac_motorhome.groupcache`
+    group_cache: Optional["GroupCache"] = None
+    # the `snippets_stamp` of the built-in snippets when group_cache was made
+    group_cache_stamp: FrozenSet[Tuple[str, int, int]] = frozenset()
+    #: the most group structures remembered, 0 to render every group in full
+    group_cache_size: int = 256
+
+    @property
+    def environment(self) -> "Environment":
+        return self.get_environment()
+
+    @classmethod
+    def get_environment(cls) -> "Environment":
+        """
+        Get the shared jinja Environment, creating it if required
+        """
+        environment = cls.shared_environment
+        if environment is not None:
+            return environment
+        with cls.environment_lock:
+            if cls.shared_environment is None:
+                from jinja2 import Environment
+
+                cache_dir: Optional[Path] = None
+                if cls.cache_dir is None or cls.cache_dir is True:
+                    cache_dir = default_cache_dir()
+                elif isinstance(cls.cache_dir, Path):
+                    cache_dir = cls.cache_dir
+                snippet_dirs = cls.get_snippet_dirs()
+                cls.overridden = frozenset(
+                    path.name
+                    for folder in snippet_dirs
+                    for path in folder.glob("*.jinja")
+                    if (jinja_path / path.name).exists()
+                )
+                cls.shared_environment = Environment(
+                    loader=make_loader(snippet_dirs),
+                    cache_size=cls.cache_size,
+                    bytecode_cache=make_bytecode_cache(cache_dir),
+                    **ENVIRONMENT_OPTIONS,
+                )
+            return cls.shared_environment
+
+    @classmethod
+    def get_snippet_dirs(cls) -> List[Path]:
+        """
+        Get the extra folders of snippet templates
+        """
+        if cls.snippet_dirs is None:
+            return default_snippet_dirs()
+        return list(cls.snippet_dirs)
+
+    @classmethod
+    def snippet_folders(cls) -> List[Path]:
+        """
+        Get all of the folders of snippet templates, in the order searched
+        """
+        return cls.get_snippet_dirs() + [jinja_path]
+
+    @classmethod
+    def get_group_cache(cls) -> Optional["GroupCache"]:
+        """
+        Get the shared cache of group code, creating it if required. The
+        cache is not used with custom snippet templates, which may generate
+        different code for different axis or PLC numbers, see
+        `pmac_motorhome.groupcache`.
+
+        The cache is discarded if a built-in snippet template has changed
+        since it was made, because jinja reloads changed templates.
+
+        Returns:
+            Optional[GroupCache]: the cache, or None if it is disabled
+        """
+        if cls.get_snippet_dirs() or cls.group_cache_size <= 0:
+            return None
+        stamp = snippets_stamp(jinja_path)
+        cache = cls.group_cache
+        if cache is None or stamp != cls.group_cache_stamp:
+            from .groupcache import GroupCache
+
+            with cls.environment_lock:
+                if cls.group_cache is None or stamp != cls.group_cache_stamp:
+                    cls.group_cache = GroupCache(cls.group_cache_size)
+                    cls.group_cache_stamp = stamp
+                cache = cls.group_cache
+        return cache
+
+    @classmethod
+    def configure(
+        cls,
+        cache_size: Optional[int] = None,
+        cache_dir: Union[Path, bool, None] = None,
+        group_cache_size: Optional[int] = None,
+        snippet_dirs: Optional[Iterable[Path]] = None,
+    ) -> None:
+        """
+        Change the settings of the shared Environment. The current Environment
+        is discarded and a new one is created by the next render.
+
+        Args:
+            cache_size (Optional[int]): maximum number of compiled templates to
+                hold in memory, None to leave unchanged
+            cache_dir (Union[Path, bool, None]): folder for the compiled
+                template cache, None for `default_cache_dir`, False to disable
+                the cache so that rendering never writes to the disk
+            group_cache_size (Optional[int]): maximum number of group
+                structures to remember, 0 to disable, None to leave unchanged
+            snippet_dirs (Optional[Iterable[Path]]): extra folders of snippet
+                templates, None for `default_snippet_dirs`
+        """
+        if cache_size is not None:
+            cls.cache_size = cache_size
+        if group_cache_size is not None:
+            cls.group_cache_size = group_cache_size
+        cls.cache_dir = cache_dir
+        cls.snippet_dirs = None if snippet_dirs is None else list(snippet_dirs)
+        cls.reload()
+
+    @classmethod
+    def reload(cls) -> None:
+        """
+        Discard the shared Environment and the cached group code so that the
+        next render sees any changes to the snippet templates
+        """
+        cls.shared_environment = None
+        cls.group_cache = None
+
+    def generate(self, template_name: str, **args) -> Iterator[str]:
+        """
+        Render a template in chunks using the selected backend
+
+        Args:
+            template_name (str): the template to render
+
+        Returns:
+            Iterator[str]: successive chunks of output
+        """
+        if self.backend not in BACKENDS:
+            raise ValueError(f"unknown backend {self.backend}, use one of {BACKENDS}")
+        environment = self.environment
+        # the python emitters do not know about replaced built-in snippets
+        if self.backend != "jinja" and not self.overridden:
+            from . import emitter
+
+            if emitter.can_emit(template_name):
+                if self.backend == "conformance":
+                    return iter([self.check_conformance(template_name, **args)])
+                return emitter.generate(**args)
+        template = environment.get_template(template_name)
+        return template.generate(**args)
+
+    def check_conformance(self, template_name: str, **args) -> str:
+        """
+        Render a template with both the jinja and python backends
+
+        Returns:
+            str: the rendered text
+
+        Raises:
+            ConformanceError: the two backends disagree
+        """
+        import difflib
+
+        from . import emitter
+
         template = self.environment.get_template(template_name)
-        output = template.render(**args)
+        expected = template.render(**args)
+        actual = "".join(emitter.generate(**args))
+        if actual != expected:
+            diff = difflib.unified_diff(
+                expected.splitlines(keepends=True),
+                actual.splitlines(keepends=True),
+                "jinja",
+                "python",
+            )
+            raise emitter.ConformanceError("".join(diff))
+        return expected
+
+    def render_group(
+        self, plc: "Plc", group: "Group", renderer: Optional["Renderer"] = None
+    ) -> str:
+        """
+        Render the block of code that homes one group of a Plc. The code of
+        a group with the same structure is reused where possible, see
+        `pmac_motorhome.groupcache`.
+
+        Args:
+            plc (Plc): the Plc that the group belongs to
+            group (Group): the group
+            renderer (Optional[Renderer]): renders the code for the group, by
+                default the group.pmc.jinja template
+
+        Returns:
+            str: the code for the group
+        """
+        renderer = renderer or render_group_template
+        cache = self.get_group_cache()
+        # conformance checks compare the output of the backends in full
+        if cache is None or self.backend == "conformance":
+            return renderer(plc, group)
+        # import here because setup.py loads this module outside of the package
+        from .dialect import defer, deferring
+
+        if deferring():
+            # cached code cannot contain placeholders, so use the cache for
+            # each dialect separately
+            return defer(partial(cache.render, plc, group, renderer))
+        return cache.render(plc, group, renderer)
+
+    def render(self, template_name: str, **args) -> str:
+        output = "".join(self.generate(template_name, **args))
 
         return output
+
+    def render_to(self, stream: IO[str], template_name: str, **args) -> None:
+        """
+        Render a template to a stream, writing each chunk of output as it is
+        produced so that the whole text is never held in memory.
+
+        Args:
+            stream (IO[str]): the text stream to write to
+            template_name (str): the template to render
+        """
+        stream.writelines(self.generate(template_name, **args))
+
+    def render_to_file(
+        self, filepath: Path, template_name: str, only_if_changed=False, **args
+    ) -> bool:
+        """
+        Stream the output of a template into a file.
+
+        The output is written to a temporary file in the same folder which then
+        atomically replaces filepath, so a failed render never leaves a partial
+        file behind.
+
+        Args:
+            filepath (Path): the file to write
+            template_name (str): the template to render
+            only_if_changed (bool): leave filepath untouched, including its
+                modification time, if it already has identical content
+
+        Returns:
+            bool: True if filepath was written
+        """
+        # unique to this thread so that concurrent renders never collide
+        suffix = f"{os.getpid()}.{threading.get_ident()}.tmp"
+        tmp_path = filepath.with_name(f".{filepath.name}.{suffix}")
+        try:
+            with tmp_path.open("w") as stream:
+                self.render_to(stream, template_name, **args)
+            if filepath.exists():
+                if only_if_changed and filecmp.cmp(tmp_path, filepath, shallow=False):
+                    tmp_path.unlink()
+                    return False
+                shutil.copymode(filepath, tmp_path)
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            if tmp_path.exists():
+                tmp_path.unlink()
+            raise
+        return True
+
+
+def render_group_template(plc: "Plc", group: "Group") -> str:
+    """
+    Render the block of code that homes one group with the jinja template
+    """
+    template = PlcGenerator.get_environment().get_template("group.pmc.jinja")
+    return template.render(plc=plc, group=group)
@@ -240,7 +240,7 @@ def home_nothing():
     Simply goes through to post home move without homing or changing home status.
     """
     # TODO review why this reference to Group is required
-    Group.the_group.htype = "NOTHING"
+    Group.instance().htype = "NOTHING"
     post_home()
     post_home_action()
 
@@ -7,9 +7,8 @@ These functions can all be called directly from
 `PlcDefinition`. They should be called in the context of a Group object.
 """
 
-import inspect
 from functools import wraps
-from typing import Any, Callable, Dict, TypeVar, cast
+from typing import Any, Callable, Dict, Tuple, TypeVar, cast
 
 from .group import Group
 
@@ -51,12 +50,32 @@ wait_for_done_args = {
 A set of arguments to pass to the wait_for_done function
 """
 
+# the code object flag for functions that take **kwargs, as inspect.CO_VARKEYWORDS
+CO_VARKEYWORDS = 0x08
+
 F = TypeVar("F", bound=Callable)
 """
 A type to represent a callable function
 """
 
 
+def _signature(function: Callable) -> Tuple[Dict[str, Any], bool]:
+    """
+    Read the parameters of a snippet function directly from its code object,
+    which is much quicker than inspect.signature
+
+    Returns:
+        Tuple[Dict[str, Any], bool]: the default value of each parameter and
+            whether the function takes **kwargs
+    """
+    code = function.__code__
+    names = code.co_varnames[: code.co_argcount]
+    values = function.__defaults__ or ()
+    assert len(names) == len(values), f"{function.__name__} parameters need defaults"
+    takes_kwargs = bool(code.co_flags & CO_VARKEYWORDS)
+    return dict(zip(names, values)), takes_kwargs
+
+
 def _snippet_function(*arglists: Dict[str, Any]) -> Callable[[F], F]:
     """
     A decorator function to allow simple declaration of snippet functions.
@@ -84,9 +103,9 @@ def _snippet_function(*arglists: Dict[str, Any]) -> Callable[[F], F]:
     """
 
     def wrap(wrapped: F) -> F:
-        sig = inspect.signature(wrapped)
+        defaults, takes_kwargs = _signature(wrapped)
         assert (
-            "kwargs" in sig.parameters.keys() or len(arglists) == 0
+            takes_kwargs or len(arglists) == 0
         ), f"Bad snippet function definition - {wrapped.__name__} must take **kwargs"
 
         merged_args = {}
@@ -94,7 +113,7 @@ def _snippet_function(*arglists: Dict[str, Any]) -> Callable[[F], F]:
         for included_args in arglists:
             merged_args.update(included_args)
         # add in the snippet function's arguments, possibly overriding above defaults
-        merged_args.update({k: v.default for k, v in sig.parameters.items()})
+        merged_args.update(defaults)
 
         @wraps(wrapped)
         def wrapper(**kwargs) -> None:
@@ -110,7 +129,10 @@ def _snippet_function(*arglists: Dict[str, Any]) -> Callable[[F], F]:
             Group.add_snippet(wrapped.__name__, **all_merged)
 
         # insert the original function's signature at the top of the docstring
-        doc = wrapped.__name__ + str(sig)
+        params = [f"{name}={value!r}" for name, value in defaults.items()]
+        if takes_kwargs:
+            params.append("**kwargs")
+        doc = f"{wrapped.__name__}({', '.join(params)})"
         # then insert the original function's docstring
         doc += wrapped.__doc__ or ""
         # insert information about jinja the template this function is inserting
@@ -1,8 +1,11 @@
-from dataclasses import dataclass
-from typing import Any, Callable, Dict, Optional
+import threading
+import weakref
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Callable, ClassVar, Hashable, Mapping, Optional
 
 
-@dataclass
+@dataclass(frozen=True)
 class Template:
     """
     A dataclass for holding details of a jinja template to render into the PLC code.
@@ -12,16 +15,63 @@ class Template:
 
     May also represent a callback function to be called from the root plc.pmc.jinja.
 
+    Templates are immutable so that identical snippets can share a single instance,
+    see `Template.intern`.
+
     Args:
         jinja_file (str): the prefix of the jinja template file name
-        args (Dict[str, Any]): arguments to pass to the template if jinja file
+        args (Mapping[str, Any]): arguments to pass to the template if jinja file
             is not None, or to pass to the function if function is not None
         function: (Callable): if not None then this is a callback function to call
             instead of inserting a jinja template snippet
         custom_text: str = ""
     """
 
+    # the interned Templates that are still in use, keyed on their contents,
+    # so that long running processes such as the daemon do not keep them all
+    interned: ClassVar["weakref.WeakValueDictionary[Hashable, Template]"] = (
+        weakref.WeakValueDictionary()
+    )
+    interned_lock: ClassVar[threading.Lock] = threading.Lock()
+
     jinja_file: Optional[str]
-    args: Dict[str, Any]
+    args: Mapping[str, Any] = field(hash=False)
     function: Optional[Callable]
     custom_text: str = ""
+
+    def __post_init__(self):
+        # take a read only copy so that the caller cannot change the arguments
+        object.__setattr__(self, "args", MappingProxyType(dict(self.args)))
+
+    @classmethod
+    def intern(
+        cls,
+        jinja_file: Optional[str],
+        args: Mapping[str, Any],
+        function: Optional[Callable],
+        custom_text: str = "",
+    ) -> "Template":
+        """
+        Get the shared instance of a Template with these contents, creating
+        it if necessary. A Template whose arguments cannot be hashed is never
+        shared.
+
+        Args:
+            see `Template`
+
+        Returns:
+            Template: a Template that may also be in use elsewhere
+        """
+        try:
+            # include the type of each argument so that e.g. True and 1 differ
+            items = frozenset((k, type(v), v) for k, v in args.items())
+            key = (jinja_file, function, custom_text, items)
+            hash(key)
+        except TypeError:
+            return cls(jinja_file, args, function, custom_text)
+        with cls.interned_lock:
+            template = cls.interned.get(key)
+            if template is None:
+                template = cls(jinja_file, args, function, custom_text)
+                cls.interned[key] = template
+        return template
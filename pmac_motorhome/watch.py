@@ -0,0 +1,360 @@
+"""
+Regenerate PLCs as soon as their definition files or snippet templates change.
+
+A `Watcher` runs every definition file once, keeping the resulting Plc models
+and the shared jinja Environment in memory. It records which definition file
+declared each PLC and which snippet templates each PLC uses. When a file
+changes only the PLCs that depend on it are regenerated:
+
+- a changed definition file is executed again, and its PLCs are regenerated
+  incrementally so that those whose models did not change are skipped
+- a changed snippet template re-renders only the PLCs that use it, from the
+  models already in memory
+
+Changes are detected with inotify on Linux, or by polling file modification
+times elsewhere.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, Union
+
+from . import manifest
+from .build import build_script
+from .plc import Plc, PlcOutput
+from .plcgenerator import PlcGenerator
+
+log = logging.getLogger(__name__)
+
+# the template that renders each group, along with the root template of a Plc
+GROUP_TEMPLATE = "group.pmc.jinja"
+
+
+class PollingMonitor:
+    """
+    Detect changes to files by polling their modification times
+    """
+
+    def __init__(self, interval: float = 0.5) -> None:
+        """
+        Args:
+            interval (float): seconds between each check of the files
+        """
+        self.interval = interval
+        self.folders: Set[Path] = set()
+        self.mtimes: Dict[Path, int] = {}
+
+    def _scan(self) -> Dict[Path, int]:
+        mtimes = {}
+        for folder in self.folders:
+            for entry in os.scandir(folder):
+                if entry.is_file():
+                    mtimes[Path(entry.path)] = entry.stat().st_mtime_ns
+        return mtimes
+
+    def add(self, folder: Path) -> None:
+        """
+        Watch all of the files in a folder
+        """
+        self.folders.add(Path(folder).absolute())
+        self.mtimes = self._scan()
+
+    def changes(self, timeout: Optional[float] = None) -> Set[Path]:
+        """
+        Wait for files to be created, modified or deleted
+
+        Args:
+            timeout (Optional[float]): the longest time to wait in seconds, or
+                None to wait indefinitely
+
+        Returns:
+            Set[Path]: The files that changed, empty if the timeout expired
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            mtimes = self._scan()
+            changed = {
+                path
+                for path in mtimes.keys() | self.mtimes.keys()
+                if mtimes.get(path) != self.mtimes.get(path)
+            }
+            self.mtimes = mtimes
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(self.interval)
+
+
+class InotifyMonitor:
+    """
+    Detect changes to files using the Linux inotify API.
+
+    Folders are watched rather than files because editors often save a file
+    by writing a new file and renaming it over the original.
+    """
+
+    # from /usr/include/linux/inotify.h
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = os.O_CLOEXEC
+    MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_MODIFY
+    EVENT = struct.Struct("iIII")
+
+    # time to wait for the rest of the events from one save of a file
+    settle = 0.02
+
+    def __init__(self) -> None:
+        """
+        Raises:
+            OSError: inotify is not available on this platform
+        """
+        name = ctypes.util.find_library("c")
+        libc = ctypes.CDLL(name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not supported")
+        self.libc = libc
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.folders: Dict[int, Path] = {}
+
+    def add(self, folder: Path) -> None:
+        """
+        Watch all of the files in a folder
+        """
+        folder = Path(folder).absolute()
+        wd = self.libc.inotify_add_watch(self.fd, bytes(folder), self.MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"cannot watch {folder}")
+        self.folders[wd] = folder
+
+    def _read(self) -> Set[Path]:
+        changed: Set[Path] = set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, _, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if name and wd in self.folders:
+                changed.add(self.folders[wd] / os.fsdecode(name))
+        return changed
+
+    def changes(self, timeout: Optional[float] = None) -> Set[Path]:
+        """
+        Wait for files to be created, modified or deleted
+
+        Args:
+            timeout (Optional[float]): the longest time to wait in seconds, or
+                None to wait indefinitely
+
+        Returns:
+            Set[Path]: The files that changed, empty if the timeout expired
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        changed = self._read()
+        # gather up the other events from the same save
+        while select.select([self.fd], [], [], self.settle)[0]:
+            changed |= self._read()
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def make_monitor(poll: bool = False) -> Union[InotifyMonitor, PollingMonitor]:
+    """
+    Create the best available file monitor
+
+    Args:
+        poll (bool): always use polling, even if inotify is available
+    """
+    if not poll:
+        try:
+            return InotifyMonitor()
+        except (OSError, AttributeError, TypeError) as e:
+            log.info(f"inotify is not available, polling for changes: {e}")
+    return PollingMonitor()
+
+
+def templates_used(plc: Plc) -> Set[str]:
+    """
+    Find the names of all of the templates that rendering a Plc will load
+
+    Args:
+        plc (Plc): The Plc model
+
+    Returns:
+        Set[str]: template file names, relative to the snippets folder
+    """
+    from jinja2 import FileSystemLoader, meta
+
+    environment = PlcGenerator.get_environment()
+    # read the source, the Environment may load compiled templates instead
+    loader = FileSystemLoader(searchpath=PlcGenerator.snippet_folders())
+    names = {plc.template_name(), GROUP_TEMPLATE}
+    for group in plc.groups:
+        for template in group.templates:
+            if template.jinja_file is not None:
+                names.add(template.jinja_file + ".pmc.jinja")
+
+    # add the templates that these templates include
+    todo = list(names)
+    while todo:
+        source, _, _ = loader.get_source(environment, todo.pop())
+        referenced = meta.find_referenced_templates(environment.parse(source))
+        for name in referenced:
+            # dynamic includes are None, these are the group templates above
+            if name is not None and name not in names:
+                names.add(name)
+                todo.append(name)
+    return names
+
+
+class Watcher:
+    """
+    Keeps the PLC models for a set of definition files in memory and
+    regenerates PLCs whose inputs change
+    """
+
+    def __init__(
+        self,
+        scripts: Iterable[Path],
+        snippet_folders: Optional[Iterable[Path]] = None,
+        poll: bool = False,
+    ) -> None:
+        """
+        Args:
+            scripts (Iterable[Path]): The definition files to watch
+            snippet_folders (Optional[Iterable[Path]]): Folders of snippet
+                templates to watch, None for `PlcGenerator.snippet_folders`
+            poll (bool): poll for changes even if inotify is available
+        """
+        self.scripts = [Path(script).absolute() for script in scripts]
+        if snippet_folders is None:
+            snippet_folders = PlcGenerator.snippet_folders()
+        self.snippet_folders = [Path(folder).absolute() for folder in snippet_folders]
+        self.poll = poll
+        # the Plc models declared by each definition file
+        self.plcs: Dict[Path, List[Plc]] = {}
+        # the names of the templates used by each Plc, keyed on output file
+        self.templates: Dict[Path, Set[str]] = {}
+
+    def run_script(self, script: Path) -> List[PlcOutput]:
+        """
+        Execute a definition file, regenerating any of its PLCs that changed,
+        and record the PLCs that it declares
+        """
+        declared: List[Plc] = []
+        token = Plc.declared.set(declared)
+        try:
+            result = build_script(script, incremental=True, write_if_changed=True)
+        finally:
+            Plc.declared.reset(token)
+        if result.error:
+            log.error(f"failed to build {script}:\n{result.error}")
+
+        self.plcs[script] = declared
+        for plc in declared:
+            self.templates[plc.filepath] = templates_used(plc)
+        return result.plcs
+
+    def rerender(self, plc: Plc) -> PlcOutput:
+        """
+        Render a PLC again from the model in memory
+        """
+        start = time.perf_counter()
+        error, changed = None, False
+        try:
+            changed = plc.write(only_if_changed=True)
+            if manifest.manifest_path(plc.filepath).exists():
+                manifest.write_manifest(plc)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            log.error(f"failed to render {plc.filepath}: {error}")
+        seconds = time.perf_counter() - start
+        return PlcOutput(plc.plc_num, plc.filepath, seconds, error, changed=changed)
+
+    def build(self) -> List[PlcOutput]:
+        """
+        Execute all of the definition files
+        """
+        outputs = []
+        for script in self.scripts:
+            outputs += self.run_script(script)
+        return outputs
+
+    def update(self, changed: Set[Path]) -> List[PlcOutput]:
+        """
+        Regenerate the PLCs that depend on some changed files
+
+        Args:
+            changed (Set[Path]): files that have changed
+
+        Returns:
+            List[PlcOutput]: the PLCs that were regenerated
+        """
+        changed = {Path(path).absolute() for path in changed}
+        outputs = []
+        scripts = [script for script in self.scripts if script in changed]
+        for script in scripts:
+            outputs += self.run_script(script)
+
+        names = {path.name for path in changed if path.parent in self.snippet_folders}
+        if names:
+            # e.g. the compiled snippets no longer match their source
+            PlcGenerator.reload()
+            for script, plcs in self.plcs.items():
+                if script in scripts:
+                    continue
+                for plc in plcs:
+                    if names & self.templates[plc.filepath]:
+                        outputs.append(self.rerender(plc))
+        return outputs
+
+    def watch(
+        self,
+        report: Optional[Callable[[List[PlcOutput]], None]] = None,
+        timeout: Optional[float] = None,
+    ) -> None:
+        """
+        Regenerate PLCs whenever their inputs change. Runs until interrupted
+        or until no change is seen for timeout seconds.
+
+        Args:
+            report (Callable[[List[PlcOutput]], None]): called with the PLCs
+                regenerated after each change
+            timeout (Optional[float]): stop if nothing changes for this long
+        """
+        monitor = make_monitor(self.poll)
+        folders = {script.parent for script in self.scripts}
+        for folder in folders | set(self.snippet_folders):
+            monitor.add(folder)
+        try:
+            while True:
+                changed = monitor.changes(timeout)
+                if not changed:
+                    return
+                outputs = self.update(changed)
+                if outputs and report is not None:
+                    report(outputs)
+        finally:
+            if isinstance(monitor, InotifyMonitor):
+                monitor.close()
@@ -1,13 +1,32 @@
 # type: ignore
 import glob
 import importlib.util
+from pathlib import Path
 
 from setuptools import setup
 
-# Import <package>._version_git.py without importing <package>
-path = glob.glob(__file__.replace("setup.py", "*/_version_git.py"))[0]
-spec = importlib.util.spec_from_file_location("_version_git", path)
-vg = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(vg)
 
-setup(cmdclass=vg.get_cmdclass(), version=vg.__version__)
+def load(path):
+    # Import a module of <package> without importing <package>
+    spec = importlib.util.spec_from_file_location(Path(path).stem, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+vg = load(glob.glob(__file__.replace("setup.py", "*/_version_git.py"))[0])
+cmdclass = vg.get_cmdclass()
+
+
+class BuildPy(cmdclass["build_py"]):
+    def run(self):
+        super().run()
+        # installed copies load the snippet templates without parsing them
+        package = Path(self.build_lib) / "pmac_motorhome"
+        plcgenerator = load(package / "plcgenerator.py")
+        plcgenerator.compile_snippets(
+            package / "compiled_snippets", package / "snippets"
+        )
+
+
+setup(cmdclass=dict(cmdclass, build_py=BuildPy), version=vg.__version__)
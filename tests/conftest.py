@@ -0,0 +1,14 @@
+import pytest
+
+from pmac_motorhome.plcgenerator import CACHE_ENV, PlcGenerator
+
+
+@pytest.fixture(scope="session", autouse=True)
+def bytecode_cache(tmp_path_factory):
+    # keep the compiled templates of the tests out of the user's ~/.cache
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        cache = tmp_path_factory.mktemp("cache")
+        monkeypatch.setenv(CACHE_ENV, str(cache))
+        PlcGenerator.reload()
+        yield cache
+    PlcGenerator.reload()
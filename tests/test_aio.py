@@ -0,0 +1,134 @@
+import asyncio
+import threading
+
+import pytest
+
+from pmac_motorhome.aio import AsyncGenerator
+from pmac_motorhome.commands import group, motor, plc
+from pmac_motorhome.plc import capture
+from pmac_motorhome.sequences import home_hsw
+
+
+def definition(plc_num, folder="missing"):
+    def declare():
+        with plc(plc_num=plc_num, controller="GeoBrick", filepath=f"{folder}/PLC"):
+            with group(group_num=2):
+                motor(axis=plc_num)
+                home_hsw()
+
+    return declare
+
+
+def broken():
+    raise RuntimeError("broken definition")
+
+
+def collect(generator, jobs):
+    async def main():
+        return [output async for output in generator.generate(jobs)]
+
+    return asyncio.run(main())
+
+
+def definition_text(plc_num):
+    with capture() as plcs:
+        definition(plc_num)()
+    return plcs[0].render()
+
+
+def test_generate():
+    # a Plc model declared earlier
+    with capture() as plcs:
+        definition(12)()
+    expected = {plc_num: definition_text(plc_num) for plc_num in (11, 12, 13)}
+
+    generator = AsyncGenerator(concurrency=2)
+    outputs = collect(generator, [definition(11), plcs[0], broken, definition(13)])
+    generator.close()
+
+    failed = [output for output in outputs if not output.ok]
+    assert [(output.plc_num, output.error) for output in failed] == [
+        (0, "RuntimeError: broken definition")
+    ]
+    texts = {output.plc_num: output.text for output in outputs if output.ok}
+    assert texts == expected
+
+
+def test_write(tmp_path):
+    generator = AsyncGenerator(write=True, write_if_changed=True)
+    jobs = [definition(11, tmp_path), definition(12, tmp_path / "missing")]
+    outputs = collect(generator, jobs)
+    generator.close()
+
+    assert sorted((output.plc_num, output.ok) for output in outputs) == [
+        (11, True),
+        (12, False),
+    ]
+    assert all(output.text is None for output in outputs)
+    assert (tmp_path / "PLC").read_text() == definition_text(11)
+
+
+def test_cancel():
+    started = threading.Event()
+    release = threading.Event()
+    declared = []
+
+    def blocking():
+        started.set()
+        release.wait(10)
+
+    def record():
+        declared.append(True)
+
+    async def main():
+        async with AsyncGenerator(concurrency=1) as generator:
+            outputs = []
+
+            async def consume():
+                async for output in generator.generate([blocking, record, record]):
+                    outputs.append(output)
+
+            task = asyncio.ensure_future(consume())
+            # the event loop is not blocked while the job runs
+            while not started.is_set():
+                await asyncio.sleep(0.001)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            release.set()
+            return outputs
+
+    assert asyncio.run(main()) == []
+    # the jobs waiting for the only worker were never run
+    assert declared == []
+
+
+def test_close_abandons_queued_jobs():
+    started = threading.Event()
+    release = threading.Event()
+    declared = []
+
+    def blocking():
+        started.set()
+        release.wait(10)
+
+    def record():
+        declared.append(True)
+
+    async def main():
+        generator = AsyncGenerator(concurrency=1)
+        futures = [
+            asyncio.ensure_future(generator.declare(job))
+            for job in (blocking, record, record)
+        ]
+        while not started.is_set():
+            await asyncio.sleep(0.001)
+        generator.close()
+        release.set()
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert results[0] == []
+    assert all(isinstance(r, asyncio.CancelledError) for r in results[1:])
+    # the jobs waiting for the only worker were never run
+    assert declared == []
@@ -0,0 +1,38 @@
+from pmac_motorhome.axistable import AxisTable
+from pmac_motorhome.commands import group, motor, plc
+from pmac_motorhome.group import Group
+from pmac_motorhome.motor import Motor
+
+
+def test_axis_table():
+    motors = [Motor(axis, 0, 11, index=axis - 1) for axis in (1, 2, 3)]
+    table = AxisTable(motors)
+    assert table.axes == (1, 2, 3)
+    assert table.join("{homed}", ",") == "1136,1137,1138"
+    assert table.join("m{axis}40", "&") == "m140&m240&m340"
+    assert table.join("#{axis}J{0}", " ", "-") == "#1J- #2J- #3J-"
+    # the second call returns the cached fragments
+    assert table.fragments("m{axis}40") is table.fragments("m{axis}40")
+    # unhashable arguments are formatted without caching
+    assert table.join("{0[0]}{axis}", " ", [5]) == "51 52 53"
+    assert len(AxisTable([])) == 0
+
+
+def test_axis_filter_rebuilds_table(tmp_path):
+    with plc(plc_num=12, controller="GeoBrick", filepath=tmp_path / "x.pmc") as p:
+        with group(group_num=2):
+            motor(axis=1)
+            motor(axis=2)
+            the_group = Group.instance()
+            assert the_group.in_pos() == "m140&m240"
+            motor(axis=3)
+            assert the_group.in_pos() == "m140&m240&m340"
+
+    all_axes = the_group.axis_table
+    the_group.set_axis_filter([2])
+    assert the_group.in_pos() == "m240"
+    the_group.set_axis_filter([])
+    assert the_group.in_pos() == "m140&m240&m340"
+    # the table for all axes is reused once the filter is removed
+    assert the_group.axis_table is all_axes
+    assert p.are_homed_flags_zero() == "P1236=0 or P1237=0 or P1238=0"
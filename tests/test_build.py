@@ -0,0 +1,211 @@
+import sys
+from pathlib import Path
+
+from click.testing import CliRunner
+
+from pmac_motorhome.build import build
+from pmac_motorhome.cli import pmac_motorhome
+
+definition = """
+from pmac_motorhome.commands import group, motor, plc
+from pmac_motorhome.sequences import home_hsw
+
+with plc(plc_num={plc_num}, controller="GeoBrick", filepath="{filepath}"):
+    with group(group_num=2):
+        motor(axis=1)
+        home_hsw()
+"""
+
+
+def make_scripts(tmp_path: Path, count: int):
+    scripts = []
+    for plc_num in range(11, 11 + count):
+        filepath = tmp_path / f"PLC{plc_num}_HM.pmc"
+        script = tmp_path / f"plc{plc_num}.py"
+        script.write_text(definition.format(plc_num=plc_num, filepath=filepath))
+        scripts.append(script)
+    return scripts
+
+
+def test_build_parallel(tmp_path):
+    scripts = make_scripts(tmp_path, 3)
+    broken = tmp_path / "broken.py"
+    broken.write_text(definition.format(plc_num=99, filepath=tmp_path / "x.pmc"))
+
+    results = build(scripts + [broken], jobs=2)
+
+    assert [result.script for result in results] == scripts + [broken]
+    for plc_num, result in enumerate(results[:3], 11):
+        assert result.ok
+        assert [plc.plc_num for plc in result.plcs] == [plc_num]
+        assert result.plcs[0].filepath.exists()
+    assert not results[3].ok
+    assert "plc_number should be integer" in str(results[3].error)
+
+
+def test_build_serial_matches_parallel(tmp_path):
+    scripts = make_scripts(tmp_path, 2)
+    assert all(result.ok for result in build(scripts, jobs=1))
+    serial = {path: path.read_text() for path in tmp_path.glob("*.pmc")}
+    assert all(result.ok for result in build(scripts, jobs=2))
+    parallel = {path: path.read_text() for path in tmp_path.glob("*.pmc")}
+    assert serial == parallel
+
+
+def test_build_cli(tmp_path):
+    scripts = make_scripts(tmp_path, 2)
+    runner = CliRunner()
+    result = runner.invoke(pmac_motorhome, ["build", "-j", "2", *map(str, scripts)])
+    assert result.exit_code == 0, result.output
+    assert "PLC12" in result.output
+
+
+def test_build_incremental(tmp_path):
+    scripts = make_scripts(tmp_path, 2)
+    first = build(scripts, incremental=True)
+    assert not any(plc.skipped for result in first for plc in result.plcs)
+
+    # nothing has changed so both PLCs are skipped
+    second = build(scripts, incremental=True)
+    assert all(plc.skipped for result in second for plc in result.plcs)
+
+    # a changed definition and a modified output file are both regenerated
+    text = scripts[0].read_text().replace("axis=1", "axis=2")
+    scripts[0].write_text(text)
+    output = second[1].plcs[0].filepath
+    output.write_text("hand edited")
+    third = build(scripts, incremental=True)
+    assert not any(plc.skipped for result in third for plc in result.plcs)
+    assert output.read_text() != "hand edited"
+
+
+def test_build_write_if_changed(tmp_path):
+    scripts = make_scripts(tmp_path, 2)
+    first = build(scripts, write_if_changed=True)
+    assert all(plc.changed for result in first for plc in result.plcs)
+
+    scripts[0].write_text(scripts[0].read_text().replace("axis=1", "axis=2"))
+    second = build(scripts, write_if_changed=True)
+    assert [result.plcs[0].changed for result in second] == [True, False]
+
+
+def test_render_from_ir(tmp_path):
+    scripts = make_scripts(tmp_path, 2)
+    ir_dir = tmp_path / "ir"
+    ir_dir.mkdir()
+    runner = CliRunner()
+    args = ["build", "--ir-dir", str(ir_dir), *map(str, scripts)]
+    result = runner.invoke(pmac_motorhome, args)
+    assert result.exit_code == 0, result.output
+    outputs = [plc.filepath for plc in build(scripts)[0].plcs]
+    expected = outputs[0].read_text()
+
+    # render again from the saved IR without running the definitions
+    outputs[0].unlink()
+    models = sorted(str(path) for path in ir_dir.glob("*.ir"))
+    assert len(models) == 2
+    result = runner.invoke(pmac_motorhome, ["render", "-j", "2", *models])
+    assert result.exit_code == 0, result.output
+    assert "PLC11" in result.output
+    assert outputs[0].read_text() == expected
+
+
+def test_build_motion_area(tmp_path):
+    # a motion area with a definition file in each brick folder that writes
+    # its PLCs relative to that folder and imports a module beside it
+    for plc_num, brick in enumerate(["BL01-STEP-01", "BL01-STEP-02"], 11):
+        folder = tmp_path / brick
+        (folder / "PLCs").mkdir(parents=True)
+        (folder / "axes.py").write_text("AXIS = 3\n")
+        text = definition.format(plc_num=plc_num, filepath=f"PLCs/PLC{plc_num}.pmc")
+        text = "from axes import AXIS\n" + text.replace("axis=1", "axis=AXIS")
+        (folder / "generate_homing_plcs2.py").write_text(text)
+    (tmp_path / "notes.py").write_text("print('not a definition file')\n")
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".git" / "copy.py").write_text(definition)
+
+    runner = CliRunner()
+    result = runner.invoke(pmac_motorhome, ["build", "-i", "-j", "2", str(tmp_path)])
+    assert result.exit_code == 0, result.output
+    assert "2 PLC(s) in" in result.output
+    assert "2 changed" in result.output
+    output = tmp_path / "BL01-STEP-02" / "PLCs" / "PLC12.pmc"
+    assert "#3hm" in output.read_text()
+    assert str(output) in result.output
+
+    result = runner.invoke(pmac_motorhome, ["build", "-i", str(tmp_path)])
+    assert result.exit_code == 0, result.output
+    assert "2 up to date" in result.output
+
+    result = runner.invoke(pmac_motorhome, ["build", str(tmp_path / ".git")])
+    assert result.exit_code == 1
+
+
+def test_build_sibling_modules(tmp_path):
+    # each definition file imports its own helper.py, not the one imported by
+    # the definition file before it
+    scripts = []
+    for plc_num, axis in [(11, 1), (12, 5)]:
+        folder = tmp_path / f"PLC{plc_num}"
+        folder.mkdir()
+        (folder / "helper.py").write_text(f"AXIS = {axis}\n")
+        text = definition.format(plc_num=plc_num, filepath=f"PLC{plc_num}.pmc")
+        text = "from helper import AXIS\n" + text.replace("axis=1", "axis=AXIS")
+        script = folder / "generate.py"
+        script.write_text(text)
+        scripts.append(script)
+
+    results = build(scripts, jobs=1)
+    assert all(result.error is None for result in results)
+    assert "#1hm" in (tmp_path / "PLC11" / "PLC11.pmc").read_text()
+    assert "#5hm" in (tmp_path / "PLC12" / "PLC12.pmc").read_text()
+    assert "helper" not in sys.modules
+
+
+def test_build_keeps_package_modules(tmp_path, monkeypatch):
+    # a source tree run from its own folder, where sys.path starts with ''
+    # and the definition files sit beside the package
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "path", ["", *sys.path])
+    script = tmp_path / "generate.py"
+    script.write_text(
+        "import sys, types\n"
+        "for name, filename in [\n"
+        "    ('pmac_motorhome._probe', 'pmac_motorhome/_probe.py'),\n"
+        "    ('_probe_dependency', 'lib/_probe_dependency.py'),\n"
+        "    ('_probe_helper', '_probe_helper.py'),\n"
+        "]:\n"
+        "    sys.modules[name] = types.ModuleType(name)\n"
+        "    sys.modules[name].__file__ = filename\n"
+    )
+    monkeypatch.setattr(sys, "path", ["lib", *sys.path])
+    try:
+        results = build([script], jobs=1)
+        assert results[0].error is None
+        # only the module imported from the folder of the definition file
+        assert "pmac_motorhome._probe" in sys.modules
+        assert "_probe_dependency" in sys.modules
+        assert "_probe_helper" not in sys.modules
+    finally:
+        for name in ("pmac_motorhome._probe", "_probe_dependency", "_probe_helper"):
+            sys.modules.pop(name, None)
+
+
+def test_build_other_threads(tmp_path):
+    # a PLC declared in another thread during a build is not part of the build
+    script = tmp_path / "generate.py"
+    other = (
+        "import threading\n"
+        "from pmac_motorhome.plc import capture\n"
+        "def other():\n"
+        "    with capture():\n"
+        "        with plc(plc_num=12, controller='GeoBrick', filepath='PLC12'):\n"
+        "            pass\n"
+        "thread = threading.Thread(target=other)\n"
+        "thread.start()\n"
+        "thread.join()\n"
+    )
+    script.write_text(definition.format(plc_num=11, filepath="PLC11.pmc") + other)
+    results = build([script], incremental=True)
+    assert [output.plc_num for output in results[0].plcs] == [11]
+    assert not (tmp_path / "PLC12").exists()
@@ -19,3 +19,16 @@ def test_one_group():
             with group(2):
                 with group(3):
                     pass
+
+
+def test_resumable_group_numbers():
+    with plc(11, ControllerType.brick, Path("/tmp/t"), resumable=True):
+        with pytest.raises(ValueError):
+            group(24)
+
+
+@pytest.mark.parametrize("base", [-1200, 0, 7100])
+def test_extra_pvars_base(base):
+    # P(base + 1100)..P(base + 1199) must be within P0..P8191 and not P1100..P1199
+    with pytest.raises(ValueError, match="extra P variables"):
+        plc(11, ControllerType.brick, Path("/tmp/t"), extra_pvars_base=base)
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pmac_motorhome.commands import group, motor, only_axes, plc
+from pmac_motorhome.group import Group
+from pmac_motorhome.onlyaxes import OnlyAxes
+from pmac_motorhome.plc import Plc
+from pmac_motorhome.sequences import home_hsw, home_rlim
+
+PLC_NUMS = range(11, 19)
+
+
+def declare(tmp_path, plc_num):
+    """
+    Declare a PLC whose axes depend on its number, yielding while inside each
+    context so that the caller can interleave concurrent declarations
+    """
+    axes = [plc_num - 10, plc_num, plc_num + 10]
+    with plc(plc_num=plc_num, controller="GeoBrick", filepath=tmp_path / f"{plc_num}"):
+        with group(group_num=2):
+            for axis in axes:
+                motor(axis=axis, jdist=plc_num)
+                yield
+            home_rlim()
+        with group(group_num=3):
+            motor(axis=axes[1])
+            yield
+            with only_axes(axes[1]):
+                yield
+                home_hsw()
+
+
+@pytest.fixture
+def expected(tmp_path):
+    serial = tmp_path / "serial"
+    serial.mkdir()
+    for plc_num in PLC_NUMS:
+        for _ in declare(serial, plc_num):
+            pass
+    return {plc_num: (serial / f"{plc_num}").read_text() for plc_num in PLC_NUMS}
+
+
+def check_outputs(tmp_path, expected):
+    for plc_num in PLC_NUMS:
+        assert (tmp_path / f"{plc_num}").read_text() == expected[plc_num]
+    # nothing leaks into the context of the caller
+    assert Plc.current.get() is None
+    assert Group.current.get() is None
+    assert OnlyAxes.current.get() is None
+
+
+def test_threads(tmp_path, expected):
+    barrier = threading.Barrier(len(PLC_NUMS), timeout=10)
+
+    def run(plc_num):
+        for _ in declare(tmp_path, plc_num):
+            # all threads are inside their contexts at the same time
+            barrier.wait()
+
+    with ThreadPoolExecutor(max_workers=len(PLC_NUMS)) as pool:
+        for future in [pool.submit(run, plc_num) for plc_num in PLC_NUMS]:
+            future.result()
+    check_outputs(tmp_path, expected)
+
+
+def test_tasks(tmp_path, expected):
+    async def run(plc_num):
+        for _ in declare(tmp_path, plc_num):
+            await asyncio.sleep(0)
+
+    async def main():
+        await asyncio.gather(*(run(plc_num) for plc_num in PLC_NUMS))
+
+    asyncio.run(main())
+    check_outputs(tmp_path, expected)
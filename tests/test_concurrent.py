@@ -0,0 +1,205 @@
+import random
+import re
+
+import pytest
+
+from pmac_motorhome import ir
+from pmac_motorhome.commands import concurrent, group, motor, only_axes, plc
+from pmac_motorhome.concurrent import If, Statement, group_machine, parse
+from pmac_motorhome.constants import ControllerType
+from pmac_motorhome.plc import capture
+from pmac_motorhome.plcgenerator import PlcGenerator
+from pmac_motorhome.sequences import home_hsw, home_hsw_hlim, home_rlim
+from pmac_motorhome.snippets import drive_to_limit
+
+
+def declare(controller=ControllerType.brick):
+    with capture() as plcs:
+        with plc(plc_num=11, controller=controller, filepath="PLC11_HM.pmc"):
+            with group(group_num=2):
+                motor(axis=1)
+                home_hsw()
+            with concurrent():
+                with group(group_num=3):
+                    motor(axis=2)
+                    home_rlim()
+                with group(group_num=4):
+                    motor(axis=3)
+                    motor(axis=4)
+                    home_hsw_hlim()
+            with group(group_num=5):
+                motor(axis=5)
+                home_rlim()
+    return plcs[0]
+
+
+class Oracle:
+    """
+    Decides the outcome of each condition. Evaluating the same condition for
+    the nth time always gives the same answer.
+    """
+
+    def __init__(self, seed):
+        self.seed = seed
+        self.counts = {}
+
+    def __call__(self, condition):
+        key = (re.sub(r"^(if|while)", "", condition[0]),) + tuple(condition[1:])
+        count = self.counts.get(key, 0)
+        self.counts[key] = count + 1
+        # loops always finish
+        return count < 3 and random.Random(f"{self.seed}{key}{count}").random() < 0.6
+
+
+def run_structured(nodes, oracle, trace):
+    for node in nodes:
+        if isinstance(node, Statement):
+            trace.append(node.text)
+        elif isinstance(node, If):
+            run_structured(
+                node.then if oracle(node.condition) else node.orelse or [],
+                oracle,
+                trace,
+            )
+        else:
+            while oracle(node.condition):
+                run_structured(node.body, oracle, trace)
+
+
+def run_machine(machine, oracle, trace):
+    steps = {}
+    code = machine.code(0)
+    for node in parse("\n".join(code)):
+        steps[int(re.search(r"= (\d+)", node.condition[0]).group(1))] = node.then
+    step = 1
+    while step != 0:
+        for node in steps[step]:
+            step = run_step(node, oracle, trace, step)
+
+
+def run_step(node, oracle, trace, step):
+    if isinstance(node, Statement):
+        match = re.match(r"Group\d+Step=(\d+)$", node.text)
+        if match:
+            return int(match.group(1))
+        trace.append(node.text)
+    else:
+        assert isinstance(node, If), "steps never wait"
+        for child in node.then if oracle(node.condition) else node.orelse or []:
+            step = run_step(child, oracle, trace, step)
+    return step
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_state_machine(seed):
+    the_plc = declare()
+    for the_group in the_plc.groups:
+        code = PlcGenerator().render_group(the_plc, the_group)
+        machine = group_machine(the_group, code)
+        renamed = re.sub(r"\bHomingStatus\b", f"Group{the_group.group_num}Status", code)
+        renamed = re.sub(r"\btimer\b", f"Group{the_group.group_num}Timer", renamed)
+        expected, actual = [], []
+        run_structured(parse(renamed), Oracle(seed), expected)
+        run_machine(machine, Oracle(seed), actual)
+        assert actual == expected
+        assert "\n        while" in code
+
+
+@pytest.mark.parametrize("backend", ["jinja", "python", "conformance"])
+def test_render_concurrent(monkeypatch, backend):
+    monkeypatch.setattr(PlcGenerator, "backend", backend)
+    the_plc = declare()
+    assert [[g.group_num for g in s] for s in the_plc.group_sections()] == [
+        [2],
+        [3, 4],
+        [5],
+    ]
+    text = the_plc.render()
+    assert "while (Group3Step != 0)\nor (Group4Step != 0)\n" in text
+    assert "#define Group4Timer       P5115\n" in text
+    # inside the loop nothing waits and each group has its own status and timer
+    start = text.index(";---- Group 3 ----")
+    groups = text[start : text.index(";Report a paused group", start)]
+    assert not re.search(r"^ *while", groups, re.MULTILINE)
+    assert not re.search(r"\b(timer|HomingStatus)\b", groups)
+
+    assert the_plc.render_dialects([ControllerType.brick])[ControllerType.brick] == text
+    assert ir.from_dict(ir.to_dict(the_plc)).render() == text
+
+
+def test_concurrent_errors():
+    with pytest.raises(AssertionError, match="within a group"):
+        with capture():
+            with plc(plc_num=11, controller="GeoBrick", filepath="X"):
+                with group(group_num=2):
+                    with concurrent():
+                        pass
+
+
+def declare_pipelined():
+    with capture() as plcs:
+        with plc(plc_num=11, controller=ControllerType.brick, filepath="X"):
+            with group(group_num=2, pipelined=True):
+                motor(axis=1)
+                motor(axis=2)
+                motor(axis=3)
+                with only_axes(2, 3):
+                    drive_to_limit(state="Aligning", homing_direction=True)
+                home_hsw()
+            with group(group_num=3):
+                motor(axis=4)
+                home_rlim()
+    return plcs[0]
+
+
+@pytest.mark.parametrize("backend", ["jinja", "python", "conformance"])
+def test_render_pipelined(monkeypatch, backend):
+    monkeypatch.setattr(PlcGenerator, "backend", backend)
+    the_plc = declare_pipelined()
+    text = the_plc.render()
+    assert ";---- Pipelined Group 2 ----\n#define HomingClock       P5100\n" in text
+    assert (
+        "while (Group2Axis1Step != 0)\nor (Group2Axis2Step != 0)\n"
+        "or (Group2Axis3Step != 0)\n"
+    ) in text
+    assert "#define Group2Axis3Timer  P5118\n" in text
+
+    # each axis has its own state machine that only homes that axis
+    start = text.index(";---- Group 2 Axis 1 ----")
+    end = text.index(";Report a paused group", start)
+    axes = re.split(r" *;---- Group 2 Axis [0-9] ----\n", text[start:end])[1:]
+    for axis, code in enumerate(axes, start=1):
+        assert set(re.findall(r"#([0-9])J", code)) == {str(axis)}
+        assert not re.search(r"^ *while", code, re.MULTILINE)
+    # only axes 2 and 3 drive to the limit first
+    assert ["HomingState=StateAligning" in code for code in axes] == [
+        False,
+        True,
+        True,
+    ]
+    # group 3 is not pipelined
+    assert "Group3Step" not in text
+
+    assert the_plc.render_dialects([ControllerType.brick])[ControllerType.brick] == text
+    assert ir.from_dict(ir.to_dict(the_plc)).render() == text
+
+
+@pytest.mark.parametrize("backend", ["jinja", "python"])
+def test_extra_pvars_base(monkeypatch, backend):
+    monkeypatch.setattr(PlcGenerator, "backend", backend)
+    with capture() as plcs:
+        with plc(11, "GeoBrick", "X", extra_pvars_base=6000):
+            with concurrent():
+                for num in (2, 3):
+                    with group(group_num=num):
+                        motor(axis=num)
+                        home_rlim()
+        with plc(12, "GeoBrick", "X", extra_pvars_base=6000):
+            with group(group_num=2):
+                motor(axis=1)
+                home_rlim()
+    text = plcs[0].render()
+    assert "; Also uses P7100..P7199, see extra_pvars_base\n" in text
+    assert "#define HomingClock       P7100\n" in text
+    # the extra P variables are only listed when they are used
+    assert "Also uses" not in plcs[1].render()
@@ -0,0 +1,75 @@
+import pytest
+
+from pmac_motorhome import ir
+from pmac_motorhome.commands import coordinator
+from pmac_motorhome.constants import ControllerType
+from pmac_motorhome.plc import capture
+from pmac_motorhome.plcgenerator import PlcGenerator
+from pmac_motorhome.watch import templates_used
+
+
+def declare(plcs=(11, 12, 13), controller=ControllerType.brick):
+    with capture() as captured:
+        coordinator(
+            plc_num=10,
+            controller=controller,
+            filepath="PLC10_HM.pmc",
+            plcs=plcs,
+        )
+    return captured[0]
+
+
+@pytest.mark.parametrize("backend", ["jinja", "python", "conformance"])
+def test_coordinator(monkeypatch, backend):
+    monkeypatch.setattr(PlcGenerator, "backend", backend)
+    the_plc = declare()
+    assert the_plc.template_name() == "coordinator.pmc.jinja"
+    text = the_plc.render()
+
+    assert "OPEN PLC10 CLEAR" in text
+    assert "Homes all groups of PLCs 11 12 13 at the same time" in text
+    for num in (11, 12, 13):
+        # each PLC homes all of its groups
+        assert f"P{num}01=StatusHoming\n" in text
+        assert f"P{num}02=1\nENABLE PLC{num}\n" in text
+        assert f"if (P{num}01 = StatusHoming)\n            P{num}01=StatusAborted" in (
+            text
+        )
+    assert (
+        "while (P1101 = StatusHoming)\nor (P1201 = StatusHoming)\n"
+        "or (P1301 = StatusHoming)\n"
+    ) in text
+    assert text.endswith("DISABLE PLC10\nCLOSE\n")
+    assert text.count("endw") == 1
+
+
+def test_coordinator_write(tmp_path):
+    filepath = tmp_path / "PLC10_HM.pmc"
+    the_plc = coordinator(
+        plc_num=10, controller=ControllerType.pmac, filepath=filepath, plcs=[11]
+    )
+    assert filepath.read_text() == the_plc.render()
+
+
+def test_coordinator_dialects():
+    texts = declare().render_dialects(list(ControllerType))
+    assert texts[ControllerType.pmac] != texts[ControllerType.brick]
+    for controller, text in texts.items():
+        assert text == declare(controller=controller).render()
+
+
+def test_coordinator_ir():
+    the_plc = declare()
+    loaded = ir.from_dict(ir.to_dict(the_plc))
+    assert loaded.coordinates == [11, 12, 13]
+    assert loaded.render() == the_plc.render()
+
+
+def test_coordinator_templates_used():
+    assert templates_used(declare()) == {"coordinator.pmc.jinja", "group.pmc.jinja"}
+
+
+@pytest.mark.parametrize("plcs", [[], [11, 7], [11, 33], [11, 10], [11, 11]])
+def test_coordinator_errors(plcs):
+    with pytest.raises(ValueError):
+        declare(plcs)
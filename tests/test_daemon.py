@@ -0,0 +1,102 @@
+import stat
+import threading
+
+import pytest
+
+from pmac_motorhome import ir
+from pmac_motorhome.client import Client, DaemonError, main
+from pmac_motorhome.commands import group, motor, plc
+from pmac_motorhome.daemon import Daemon
+from pmac_motorhome.sequences import home_hsw
+
+from .test_build import make_scripts
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    daemon = Daemon(tmp_path / "daemon.sock")
+    thread = threading.Thread(target=daemon.serve)
+    thread.start()
+    yield daemon
+    if thread.is_alive():
+        daemon.shutdown()
+    thread.join()
+
+
+def test_build_and_render(daemon, tmp_path):
+    scripts = make_scripts(tmp_path, 2)
+    broken = tmp_path / "broken.py"
+    broken.write_text("raise RuntimeError('broken')")
+
+    with Client(daemon.socket_path, timeout=10) as client:
+        assert client.ping()["ok"]
+
+        reply = client.build(scripts)
+        assert reply["ok"]
+        assert [output["plc_num"] for output in reply["plcs"]] == [11, 12]
+        path = tmp_path / "PLC11_HM.pmc"
+        expected = path.read_text()
+        path.unlink()
+        reply = client.build(scripts[:1], write=False)
+        assert reply["plcs"][0]["text"] == expected
+        assert not path.exists()
+
+        # a folder finds both definition files, broken.py does not import commands
+        reply = client.build([tmp_path], incremental=True)
+        assert [output["plc_num"] for output in reply["plcs"]] == [11, 12]
+        reply = client.build([broken])
+        assert not reply["ok"] and "broken" in reply["errors"][0]
+
+        # render from the IR, both as data and as a file
+        with plc(plc_num=11, controller="GeoBrick", filepath=path) as the_plc:
+            with group(group_num=2):
+                motor(axis=1)
+                home_hsw()
+        model = ir.to_dict(the_plc)
+        reply = client.render([model], write=False)
+        assert reply["plcs"][0]["text"] == expected
+        ir.dump(ir.from_dict(model), tmp_path / "PLC11.ir")
+        path.unlink()
+        reply = client.render([tmp_path / "PLC11.ir"])
+        assert reply["ok"] and reply["plcs"][0]["changed"] and path.exists()
+        reply = client.render([tmp_path / "missing.ir"])
+        assert not reply["ok"] and "missing.ir" in reply["plcs"][0]["error"]
+
+        with pytest.raises(DaemonError, match="unknown command"):
+            client.request("explode")
+
+        client.stop()
+
+
+def test_client_command(daemon, tmp_path, capsys):
+    scripts = make_scripts(tmp_path, 1)
+    socket = ["--socket", str(daemon.socket_path)]
+    assert main(socket + ["build", str(scripts[0])]) == 0
+    assert "PLC11" in capsys.readouterr().out
+    assert main(socket + ["build", "--print", str(scripts[0])]) == 0
+    assert capsys.readouterr().out == (tmp_path / "PLC11_HM.pmc").read_text()
+
+    # only one daemon may listen on a socket
+    with pytest.raises(OSError, match="already listening"):
+        Daemon(daemon.socket_path)
+
+    assert main(socket + ["stop"]) == 0
+    assert main(["--socket", str(tmp_path / "none.sock"), "ping"]) == 2
+
+
+def test_private_socket(daemon, tmp_path):
+    # requests run definition files as the daemon's owner, so no one else may
+    # connect, or listen in its place
+    assert stat.S_IMODE(daemon.socket_path.stat().st_mode) == 0o600
+    with Client(daemon.socket_path, timeout=10) as client:
+        client.ping()
+
+    daemon.socket_path.chmod(0o666)
+    with pytest.raises(DaemonError, match="not private"):
+        Client(daemon.socket_path)
+
+    shared = tmp_path / "shared"
+    shared.mkdir(mode=0o777)
+    shared.chmod(0o777)
+    with pytest.raises(OSError, match="not private"):
+        Daemon(shared / "daemon.sock")
@@ -0,0 +1,70 @@
+import pytest
+
+from pmac_motorhome.commands import group, motor, plc
+from pmac_motorhome.constants import ControllerType, PostHomeMove
+from pmac_motorhome.plc import capture
+from pmac_motorhome.plcgenerator import PlcGenerator
+from pmac_motorhome.sequences import (
+    home_home,
+    home_hsw,
+    home_hsw_dir,
+    home_hsw_hlim,
+    home_limit,
+    home_rlim,
+    home_slits_hsw,
+)
+
+SEQUENCES = [home_rlim, home_hsw, home_hsw_dir, home_limit, home_hsw_hlim, home_home]
+
+
+def declare(controller):
+    with capture() as plcs:
+        with plc(plc_num=12, controller=controller, filepath="PLC12_HM.pmc"):
+            for num, sequence in enumerate(SEQUENCES, start=2):
+                with group(group_num=num):
+                    motor(axis=num)
+                    motor(axis=num + 10)
+                    sequence()
+    return plcs[0]
+
+
+@pytest.mark.parametrize("backend", ["jinja", "python", "conformance"])
+def test_render_dialects(monkeypatch, backend):
+    monkeypatch.setattr(PlcGenerator, "backend", backend)
+    expected = {
+        controller: declare(controller).render() for controller in ControllerType
+    }
+    assert expected[ControllerType.pmac] != expected[ControllerType.brick]
+
+    the_plc = declare(ControllerType.brick)
+    assert the_plc.render_dialects(list(ControllerType)) == expected
+    # the model is unchanged
+    assert the_plc.controller is ControllerType.brick
+    assert all(g.controller is ControllerType.brick for g in the_plc.groups)
+    assert the_plc.render() == expected[ControllerType.brick]
+
+
+@pytest.mark.parametrize("backend", ["jinja", "python"])
+def test_render_dialects_only_axes(monkeypatch, backend):
+    # deferred callbacks act on the axes of the only_axes context they are in
+    monkeypatch.setattr(PlcGenerator, "backend", backend)
+    PlcGenerator.configure(group_cache_size=0)
+    try:
+
+        def declare_slits(controller):
+            with capture() as plcs:
+                with plc(plc_num=13, controller=controller, filepath="X"):
+                    with group(group_num=2, post_home=PostHomeMove.initial_position):
+                        for axis in range(1, 5):
+                            motor(axis=axis, jdist=-400)
+                        home_slits_hsw(posx=1, negx=2, posy=3, negy=4)
+            return plcs[0]
+
+        expected = {
+            controller: declare_slits(controller).render()
+            for controller in ControllerType
+        }
+        the_plc = declare_slits(ControllerType.brick)
+        assert the_plc.render_dialects(list(ControllerType)) == expected
+    finally:
+        PlcGenerator.configure(group_cache_size=256)
@@ -0,0 +1,93 @@
+from inspect import getmembers, isfunction
+
+import pytest
+
+from pmac_motorhome.commands import (
+    ControllerType,
+    PostHomeMove,
+    group,
+    motor,
+    only_axes,
+    plc,
+)
+from pmac_motorhome.emitter import EMITTERS, ConformanceError
+from pmac_motorhome.plcgenerator import PlcGenerator
+from pmac_motorhome.snippets import (
+    check_homed,
+    continue_home_maintain_axes_offset,
+    disable_limits,
+    drive_off_home,
+    drive_relative,
+    drive_to_hard_limit,
+    drive_to_home,
+    drive_to_home_if_on_limit,
+    drive_to_hstop,
+    drive_to_initial_pos,
+    drive_to_limit,
+    drive_to_soft_limit,
+    home,
+    jog_if_on_limit,
+    post_home_action,
+    restore_limits,
+    store_position_diff,
+)
+
+from . import test_pmac_motorhome
+
+example_tests = [
+    function
+    for name, function in getmembers(test_pmac_motorhome, isfunction)
+    if name.startswith("test_")
+]
+
+
+@pytest.fixture
+def conformance(monkeypatch):
+    monkeypatch.setattr(PlcGenerator, "backend", "conformance")
+
+
+@pytest.mark.parametrize("example", example_tests, ids=lambda f: f.__name__)
+def test_examples_conform(conformance, example):
+    # every example PLC must be identical when rendered by the python backend
+    example()
+
+
+@pytest.mark.parametrize("controller", list(ControllerType))
+def test_snippet_variants_conform(conformance, tmp_path, controller):
+    with plc(plc_num=20, controller=controller, filepath=tmp_path / "x.pmc"):
+        with group(group_num=1, pre="; pre", post="; post"):
+            motor(axis=9, jdist=100)
+            motor(axis=10, jdist=-100)
+            motor(axis=11)
+            drive_to_limit(state="PreHomeMove", wait_for_one_motor=True)
+            drive_to_home(restore_homed_flags=True, no_following_err=True)
+            drive_to_home(state="PreHomeMove", homing_direction=True)
+            drive_to_hstop(state="PreHomeMove", with_limits=True)
+            drive_off_home(homing_direction=True)
+            store_position_diff()
+            disable_limits()
+            with only_axes(9, 11):
+                home(wait_for_one_motor=True, with_limits=False)
+                jog_if_on_limit(homing_direction=True)
+            continue_home_maintain_axes_offset(wait_for_one_motor=True)
+            restore_limits()
+            check_homed()
+            drive_to_initial_pos()
+            drive_to_soft_limit(homing_direction=True)
+            drive_to_hard_limit(homing_direction=False)
+            drive_relative(distance=500, set_home=True)
+            drive_to_home_if_on_limit()
+            post_home_action()
+        with group(group_num=2, post_home=PostHomeMove.move_and_hmz):
+            motor(axis=12)
+            post_home_action()
+
+
+def test_conformance_error(conformance, tmp_path, monkeypatch):
+    monkeypatch.setitem(EMITTERS, "check_homed", lambda plc, group, t: "broken\n")
+    with pytest.raises(ConformanceError, match="broken"):
+        with plc(plc_num=20, controller="GeoBrick", filepath=tmp_path / "x.pmc"):
+            with group(group_num=2):
+                motor(axis=1)
+                check_homed()
+    assert not (tmp_path / "x.pmc").exists()
@@ -0,0 +1,126 @@
+import os
+import shutil
+
+import pytest
+
+from pmac_motorhome import plcgenerator
+from pmac_motorhome.commands import group, motor, only_axes, plc
+from pmac_motorhome.constants import ControllerType
+from pmac_motorhome.groupcache import GroupCache
+from pmac_motorhome.plc import capture
+from pmac_motorhome.plcgenerator import PlcGenerator
+from pmac_motorhome.sequences import home_hsw, home_rlim
+from pmac_motorhome.snippets import drive_relative, drive_to_limit
+
+
+def declare_fleet():
+    with capture() as plcs:
+        for plc_num in range(11, 19):
+            with plc(plc_num=plc_num, controller=ControllerType.brick, filepath="X"):
+                with group(group_num=2):
+                    motor(axis=plc_num - 10)
+                    motor(axis=plc_num + 10, jdist=-100)
+                    home_rlim()
+                with group(group_num=3):
+                    motor(axis=plc_num + 20)
+                    with only_axes(plc_num + 20):
+                        drive_to_limit(homing_direction=True)
+                    home_hsw()
+    return plcs
+
+
+def render_fleet(group_cache_size):
+    PlcGenerator.configure(group_cache_size=group_cache_size)
+    try:
+        return [the_plc.render() for the_plc in declare_fleet()], (
+            PlcGenerator.group_cache
+        )
+    finally:
+        PlcGenerator.configure(group_cache_size=256)
+
+
+@pytest.mark.parametrize("backend", ["jinja", "python"])
+def test_group_cache(monkeypatch, backend):
+    monkeypatch.setattr(PlcGenerator, "backend", backend)
+    expected, cache = render_fleet(0)
+    assert cache is None
+
+    texts, cache = render_fleet(256)
+    assert texts == expected
+    # the RLIM groups are reused from the third PLC on, the groups with an
+    # axis filter that names their axis cannot be
+    assert cache.hits == 6
+    assert cache.misses == 10
+
+
+def test_group_cache_bound():
+    cache = GroupCache(size=1)
+    plcs = declare_fleet()
+
+    def render(the_plc, the_group):
+        return f"{the_plc.plc_num} {the_group.group_num}"
+
+    for the_plc in plcs[:3]:
+        for the_group in the_plc.groups:
+            assert cache.render(the_plc, the_group, render) == render(
+                the_plc, the_group
+            )
+    # the two structures keep replacing each other
+    assert len(cache.entries) == 1
+    assert cache.hits == 0
+
+
+def test_group_cache_custom_snippets(tmp_path):
+    # custom snippets may branch on axis numbers, so they are never cached
+    PlcGenerator.configure(snippet_dirs=[tmp_path])
+    try:
+        assert PlcGenerator.get_group_cache() is None
+        texts = [the_plc.render() for the_plc in declare_fleet()]
+    finally:
+        PlcGenerator.configure(snippet_dirs=None)
+    assert PlcGenerator.get_group_cache() is not None
+    assert texts == render_fleet(0)[0]
+
+
+def test_group_cache_argument_types():
+    # equal arguments of different types render differently, e.g. 1000.0
+    def declare():
+        with capture() as plcs:
+            for plc_num, distance in zip(range(11, 16), [1, 1, 1, 1.0, True]):
+                with plc(plc_num=plc_num, controller="GeoBrick", filepath="X"):
+                    with group(group_num=2):
+                        motor(axis=plc_num - 10)
+                        drive_relative(distance=distance)
+        return [the_plc.render() for the_plc in plcs]
+
+    PlcGenerator.configure(group_cache_size=0)
+    try:
+        expected = declare()
+    finally:
+        PlcGenerator.configure(group_cache_size=256)
+    texts = declare()
+    assert '"#4J=1.0"' in texts[3] and '"#5J=True"' in texts[4]
+    assert texts == expected
+
+
+def test_group_cache_snippet_changed(tmp_path, monkeypatch):
+    # a long running process sees an edit to a built-in snippet template
+    snippets = tmp_path / "snippets"
+    shutil.copytree(plcgenerator.jinja_path, snippets)
+    monkeypatch.setattr(plcgenerator, "jinja_path", snippets)
+    monkeypatch.setattr(plcgenerator, "compiled_path", tmp_path / "none")
+    PlcGenerator.reload()
+    try:
+        texts = [the_plc.render() for the_plc in declare_fleet()]
+        assert not any("; edited" in text for text in texts)
+        debug_pause = snippets / "debug_pause.pmc.jinja"
+        debug_pause.write_text(debug_pause.read_text() + "; edited\n")
+        os.utime(debug_pause, ns=(0, 0))
+        texts = [the_plc.render() for the_plc in declare_fleet()]
+        monkeypatch.setattr(PlcGenerator, "group_cache_size", 0)
+        expected = [the_plc.render() for the_plc in declare_fleet()]
+    finally:
+        monkeypatch.undo()
+        PlcGenerator.reload()
+    assert "; edited" in expected[0]
+    assert texts == expected
@@ -0,0 +1,40 @@
+import subprocess
+import sys
+from pathlib import Path
+
+# the budget in seconds for a cold import of the modules used by a PLC
+# definition file, the best of several runs must fit within it
+IMPORT_BUDGET = 0.25
+
+# modules that are only needed at render time or by optional features
+LAZY_MODULES = {
+    "jinja2",
+    "difflib",
+    "pmac_motorhome._version_git",
+    "pmac_motorhome.emitter",
+    "pmac_motorhome.manifest",
+}
+
+cold_import = """
+import sys, time
+start = time.perf_counter()
+import pmac_motorhome.commands, pmac_motorhome.sequences
+print(time.perf_counter() - start)
+print(" ".join(sys.modules))
+"""
+
+
+def run_cold_import():
+    # run from the project root so that the package is importable when not installed
+    root = Path(__file__).parent.parent
+    command = [sys.executable, "-c", cold_import]
+    output = subprocess.check_output(command, cwd=root, text=True)
+    seconds, modules = output.splitlines()
+    return float(seconds), set(modules.split())
+
+
+def test_import_time():
+    runs = [run_cold_import() for _ in range(3)]
+    best = min(seconds for seconds, _ in runs)
+    assert best < IMPORT_BUDGET, f"cold import took {best:.3f}s"
+    assert not LAZY_MODULES & runs[0][1]
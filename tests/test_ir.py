@@ -0,0 +1,109 @@
+from filecmp import cmp
+from pathlib import Path
+
+import pytest
+
+from pmac_motorhome import ir
+from pmac_motorhome.commands import PostHomeMove, group, motor, only_axes, plc
+from pmac_motorhome.plc import Plc
+from pmac_motorhome.snippets import command, drive_to_limit, home
+from pmac_motorhome.template import Template
+
+from .test_emitter import example_tests
+
+examples = Path(__file__).parent / "examples"
+
+
+@pytest.mark.parametrize("example", example_tests, ids=lambda f: f.__name__)
+def test_examples_round_trip(tmp_path, example):
+    # save the IR of every example PLC then render the PLC again from its IR
+    token = Plc.ir_dir.set(tmp_path)
+    try:
+        example()
+    finally:
+        Plc.ir_dir.reset(token)
+
+    for path in tmp_path.glob("*.ir"):
+        name = path.name[: -len(".ir")]
+        output = tmp_path / name
+        ir.load(path, filepath=output).write()
+        assert cmp(output, examples / name, shallow=False)
+
+
+def test_json_and_binary(tmp_path):
+    with plc(
+        plc_num=12, controller="PMAC", filepath=tmp_path / "x.pmc", post="i"
+    ) as the_plc:
+        with group(group_num=2, post_home=PostHomeMove.high_limit, comment="; hi"):
+            motor(axis=1, jdist=10)
+            motor(axis=2, index=5)
+            drive_to_limit(homing_direction=True)
+            with only_axes(2):
+                home()
+            command("; any code")
+
+    text = ir.dumps(the_plc)
+    loaded = ir.loads(text)
+    assert ir.dumps(loaded) == text
+    assert loaded.groups[0].post_home is PostHomeMove.high_limit
+    assert loaded.motors[2].index == 5
+
+    binary = ir.dumpb(the_plc)
+    assert len(binary) < len(text)
+    assert ir.dumps(ir.loadb(binary)) == text
+
+    for name in ("x.ir.json", "x.ir"):
+        ir.dump(the_plc, tmp_path / name)
+        assert ir.dumps(ir.load(tmp_path / name)) == text
+
+
+def test_ir_errors(tmp_path):
+    with plc(plc_num=12, controller="GeoBrick", filepath=tmp_path / "x.pmc") as p:
+        with group(group_num=2) as the_group:
+            motor(axis=1)
+    data = ir.to_dict(p)
+
+    with pytest.raises(ir.IRError, match="version"):
+        ir.from_dict(dict(data, version=0))
+    with pytest.raises(ir.IRError, match="binary"):
+        ir.loadb(b"not an IR")
+
+    # callbacks must be importable by name
+    the_group.templates.append(Template(None, {}, lambda group: ""))
+    with pytest.raises(ir.IRError, match="reference"):
+        ir.to_dict(p)
+
+
+@pytest.mark.parametrize(
+    "reference",
+    [
+        {"enum": "os:system", "value": "echo unsafe"},
+        {"enum": "pmac_motorhome.plc:Plc", "value": 1},
+        {"enum": "pmac_motorhome.constants:PostHomeMove", "value": "unknown"},
+        {"function": "os:system"},
+        {"function": "pmac_motorhome.group:Group.__init__"},
+        {"function": "pmac_motorhome.snippets:cast"},
+        {"function": "pmac_motorhome.cli:print_plc"},
+    ],
+)
+def test_ir_unsafe_references(tmp_path, monkeypatch, reference):
+    # loading an IR must not call anything outside of the Plc model
+    called = []
+    monkeypatch.setattr("os.system", called.append)
+    with plc(plc_num=12, controller="GeoBrick", filepath=tmp_path / "x.pmc") as p:
+        with group(group_num=2):
+            motor(axis=1)
+            command("; any code")
+    data = ir.to_dict(p)
+
+    with pytest.raises(ir.IRError, match="cannot"):
+        ir.from_dict(dict(data, post=reference))
+    data["groups"][0]["templates"][0]["args"]["cmd"] = reference
+    with pytest.raises(ir.IRError, match="cannot"):
+        ir.from_dict(data)
+    if "function" in reference:
+        data["groups"][0]["templates"][0]["function"] = reference["function"]
+        data["groups"][0]["templates"][0]["args"] = {}
+        with pytest.raises(ir.IRError, match="cannot"):
+            ir.from_dict(data)
+    assert called == []
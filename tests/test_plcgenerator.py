@@ -0,0 +1,236 @@
+import importlib.util
+import io
+import json
+from pathlib import Path
+
+import pytest
+from jinja2 import FileSystemLoader
+
+from pmac_motorhome import plcgenerator
+from pmac_motorhome.commands import group, motor, plc
+from pmac_motorhome.constants import ControllerType
+from pmac_motorhome.group import Group
+from pmac_motorhome.plc import capture
+from pmac_motorhome.plcgenerator import (
+    CACHE_ENV,
+    STAMP_NAME,
+    PlcGenerator,
+    compile_snippets,
+    compiled_snippets_usable,
+    default_cache_dir,
+)
+from pmac_motorhome.sequences import home_hsw
+
+
+def make_plc(file_path: Path):
+    with plc(plc_num=11, controller=ControllerType.brick, filepath=file_path) as p:
+        with group(group_num=2):
+            motor(axis=1)
+            home_hsw()
+    return p
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = tmp_path / "cache"
+    monkeypatch.setenv(CACHE_ENV, str(cache))
+    PlcGenerator.configure()
+    yield cache
+    monkeypatch.undo()
+    PlcGenerator.configure()
+
+
+def test_bytecode_cache(tmp_path, cache):
+    assert default_cache_dir() == cache
+
+    make_plc(tmp_path / "first.pmc")
+    cached = sorted(cache.glob("*.cache"))
+    # the root template plus all of the snippets it includes
+    assert len(cached) > 1
+
+    # a fresh environment loads the compiled templates instead of compiling again
+    PlcGenerator.configure()
+    assert PlcGenerator().environment.bytecode_cache is not None
+    make_plc(tmp_path / "second.pmc")
+    assert sorted(cache.glob("*.cache")) == cached
+    first, second = tmp_path / "first.pmc", tmp_path / "second.pmc"
+    assert first.read_text() == second.read_text()
+
+
+def test_bytecode_cache_disabled(monkeypatch):
+    monkeypatch.setenv(CACHE_ENV, "")
+    PlcGenerator.configure()
+    try:
+        assert default_cache_dir() is None
+        assert PlcGenerator().environment.bytecode_cache is None
+    finally:
+        monkeypatch.undo()
+        PlcGenerator.configure()
+
+
+def test_bytecode_cache_configured_off(tmp_path, cache):
+    # rendering captured PLCs does not touch the disk at all
+    PlcGenerator.configure(cache_dir=False)
+    try:
+        assert PlcGenerator().environment.bytecode_cache is None
+        with capture() as plcs:
+            make_plc(tmp_path / "missing" / "PLC11.pmc")
+        assert "OPEN PLC11" in plcs[0].render()
+    finally:
+        PlcGenerator.configure()
+    assert not cache.exists()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_shared_environment(tmp_path):
+    PlcGenerator.configure(cache_size=50)
+    try:
+        plc1 = make_plc(tmp_path / "first.pmc")
+        plc2 = make_plc(tmp_path / "second.pmc")
+        environment = plc1.generator.environment
+        assert environment is plc2.generator.environment
+        assert environment.cache is not None
+        assert environment.cache.capacity == 50
+    finally:
+        PlcGenerator.configure(cache_size=400)
+
+
+def test_render_to_file(tmp_path):
+    file_path = tmp_path / "streamed.pmc"
+    p = make_plc(file_path)
+    text = PlcGenerator().render("plc.pmc.jinja", plc=p)
+    assert file_path.read_text() == text
+    # the temporary file has been renamed to the output file
+    assert list(tmp_path.iterdir()) == [file_path]
+
+
+def test_write_if_changed(tmp_path):
+    file_path = tmp_path / "unchanged.pmc"
+    p = make_plc(file_path)
+    generator = PlcGenerator()
+    mtime = file_path.stat().st_mtime_ns
+
+    written = generator.render_to_file(
+        file_path, "plc.pmc.jinja", only_if_changed=True, plc=p
+    )
+    assert not written
+    assert file_path.stat().st_mtime_ns == mtime
+
+    file_path.write_text("out of date")
+    written = generator.render_to_file(
+        file_path, "plc.pmc.jinja", only_if_changed=True, plc=p
+    )
+    assert written
+    assert file_path.read_text() == generator.render("plc.pmc.jinja", plc=p)
+    assert list(tmp_path.iterdir()) == [file_path]
+
+
+def test_render_in_memory(tmp_path):
+    expected = make_plc(tmp_path / "written.pmc").render()
+    assert (tmp_path / "written.pmc").read_text() == expected
+
+    # the folder of the output file need not exist and nothing is written
+    missing = tmp_path / "missing"
+    with capture() as plcs:
+        p = make_plc(missing / "PLC11.pmc")
+    assert plcs == [p]
+    assert p.render() == expected
+    stream = io.StringIO()
+    p.render_to(stream)
+    assert stream.getvalue() == expected
+    assert not missing.exists()
+
+    # outside of the capture context PLCs are written again
+    with pytest.raises(ValueError, match="bad file path"):
+        make_plc(missing / "PLC11.pmc")
+
+
+@pytest.fixture
+def compiled(tmp_path, monkeypatch):
+    compiled = tmp_path / "compiled"
+    compile_snippets(compiled)
+    monkeypatch.setattr(plcgenerator, "compiled_path", compiled)
+    PlcGenerator.configure()
+    yield compiled
+    monkeypatch.undo()
+    PlcGenerator.configure()
+
+
+def test_compiled_snippets(tmp_path, compiled, monkeypatch):
+    with capture():
+        expected = make_plc(tmp_path / "PLC11.pmc").render()
+    assert compiled_snippets_usable(compiled)
+
+    # the snippet templates are never read, let alone parsed
+    def no_source(*args):
+        raise AssertionError("read the source of a template")
+
+    monkeypatch.setattr(FileSystemLoader, "get_source", no_source)
+    PlcGenerator.configure()
+    with capture():
+        assert make_plc(tmp_path / "PLC11.pmc").render() == expected
+
+    # compiled templates that do not match the source are ignored
+    monkeypatch.undo()
+    monkeypatch.setattr(plcgenerator, "compiled_path", compiled)
+    stamp = compiled / STAMP_NAME
+    stamp.write_text(stamp.read_text().replace('"templates": "', '"templates": "0'))
+    assert not compiled_snippets_usable(compiled)
+    PlcGenerator.configure()
+    with capture():
+        assert make_plc(tmp_path / "PLC11.pmc").render() == expected
+
+
+def test_snippet_dirs(tmp_path, compiled):
+    snippets = tmp_path / "snippets"
+    snippets.mkdir()
+    # replaces a built-in snippet that is also in the compiled templates
+    (snippets / "debug_pause.pmc.jinja").write_text("    ; no pause\n")
+    (snippets / "custom.pmc.jinja").write_text("    ; custom {{ template.args.n }}\n")
+
+    for backend in ("jinja", "python"):
+        PlcGenerator.configure(snippet_dirs=[snippets])
+        PlcGenerator.backend = backend
+        try:
+            with capture():
+                with plc(
+                    plc_num=11, controller=ControllerType.brick, filepath="X"
+                ) as p:
+                    with group(group_num=2):
+                        motor(axis=1)
+                        Group.add_snippet("custom", n=42)
+                        home_hsw()
+            text = p.render()
+        finally:
+            PlcGenerator.backend = "jinja"
+        assert "    ; custom 42\n" in text
+        assert "; no pause" in text
+        assert "HomingStatus = StatusPaused" not in text
+    assert PlcGenerator.snippet_folders()[0] == snippets
+
+
+def test_templates_used_compiled(compiled):
+    from pmac_motorhome.watch import templates_used
+
+    with capture():
+        p = make_plc("PLC11.pmc")
+    assert {"plc.pmc.jinja", "home.pmc.jinja"} <= templates_used(p)
+
+
+def test_load_like_setup(tmp_path):
+    # setup.py loads plcgenerator.py by itself, outside of the package
+    spec = importlib.util.spec_from_file_location("plcgenerator", plcgenerator.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    compiled = tmp_path / "compiled"
+    module.compile_snippets(compiled, plcgenerator.jinja_path)
+    assert compiled_snippets_usable(compiled)
+
+
+def test_build_jinja_pinned():
+    # compiled snippets are only used with the jinja that compiled them, so
+    # the build must use the jinja that is installed with pmac_motorhome
+    root = Path(__file__).parent.parent
+    lock = json.loads((root / "Pipfile.lock").read_text())
+    version = lock["default"]["jinja2"]["version"]
+    assert f'"jinja2{version}"' in (root / "pyproject.toml").read_text()
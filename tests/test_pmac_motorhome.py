@@ -5,6 +5,7 @@ from pmac_motorhome.commands import (
     ControllerType,
     PostHomeMove,
     comment,
+    concurrent,
     group,
     motor,
     plc,
@@ -404,3 +405,47 @@ def test_pre_post():
             motor(axis=1)
             home_hsw()
     verify(file_name)
+
+
+def test_skip_homed():
+    file_name = "skip_homed.plc"
+    tmp_file = Path("/tmp") / file_name
+    with plc(
+        plc_num=11, controller=ControllerType.brick, filepath=tmp_file, skip_homed=True
+    ):
+        with group(group_num=2):
+            motor(axis=1)
+            motor(axis=2)
+            home_hsw()
+        with group(group_num=3, skip_homed=False):
+            motor(axis=3)
+            home_rlim()
+        with group(group_num=4, pipelined=True):
+            motor(axis=4)
+            motor(axis=5)
+            home_hsw()
+    verify(file_name)
+
+
+def test_resumable():
+    file_name = "resumable.plc"
+    tmp_file = Path("/tmp") / file_name
+    with plc(
+        plc_num=11, controller=ControllerType.brick, filepath=tmp_file, resumable=True
+    ):
+        with group(group_num=2):
+            motor(axis=1)
+            motor(axis=2)
+            home_hsw()
+        with concurrent():
+            with group(group_num=3):
+                motor(axis=3)
+                home_rlim()
+            with group(group_num=4):
+                motor(axis=4)
+                home_rlim()
+        with group(group_num=5, pipelined=True):
+            motor(axis=5)
+            motor(axis=6)
+            home_hsw()
+    verify(file_name)
@@ -0,0 +1,66 @@
+import gc
+import weakref
+from dataclasses import FrozenInstanceError
+
+import pytest
+
+from pmac_motorhome.commands import group, motor, plc
+from pmac_motorhome.group import Group
+from pmac_motorhome.motor import Motor
+from pmac_motorhome.snippets import drive_relative, drive_to_limit
+from pmac_motorhome.template import Template
+
+
+def test_templates_are_interned(tmp_path):
+    templates = []
+    for plc_num in (12, 13):
+        with plc(plc_num=plc_num, controller="GeoBrick", filepath=tmp_path / "x.pmc"):
+            with group(group_num=2) as the_group:
+                motor(axis=1)
+                drive_to_limit()
+                drive_relative(distance=1)
+                drive_relative(distance=True)
+                Group.add_action(Group.set_axis_filter, axes=[1])
+            templates.append(the_group.templates)
+
+    first, second = templates
+    # identical snippets share a Template
+    assert first[0] is second[0]
+    # but True and 1 are different arguments
+    assert first[1] is not first[2]
+    assert first[1].args["distance"] == 1
+    # a list argument cannot be hashed so its Template is never shared
+    assert first[3].args["axes"] == [1]
+    assert first[3] is not second[3]
+
+    with pytest.raises(FrozenInstanceError):
+        first[0].custom_text = "changed"  # type: ignore
+    with pytest.raises(TypeError):
+        first[0].args["state"] = "changed"  # type: ignore
+
+
+def test_unused_templates_are_freed():
+    template = Template.intern("home", {"state": "Unused"}, None)
+    assert Template.intern("home", {"state": "Unused"}, None) is template
+    reference = weakref.ref(template)
+
+    # interning does not keep a Template alive once nothing else uses it
+    del template
+    gc.collect()
+    assert reference() is None
+
+
+def test_template_copies_args():
+    args = {"state": "Homing"}
+    template = Template(jinja_file="home", args=args, function=None)
+    args["state"] = "changed"
+    assert template.args["state"] == "Homing"
+
+
+def test_motor_is_compact():
+    motor = Motor(axis=9, jdist=100, plc_num=12)
+    assert not hasattr(motor, "__dict__")
+    assert (motor.nx, motor.macro_station) == ("21", "16")
+    assert motor.dict["homed_flag"] == "7212"
+    assert motor.homed == motor.dict["homed"] == 1236
+    assert motor.not_homed == 1252
@@ -0,0 +1,71 @@
+import pytest
+
+from pmac_motorhome.plcgenerator import jinja_path
+from pmac_motorhome.watch import InotifyMonitor, PollingMonitor, Watcher, make_monitor
+
+definition = """
+from pmac_motorhome.commands import group, motor, plc
+from pmac_motorhome.snippets import {snippet}
+
+with plc(plc_num={plc_num}, controller="GeoBrick", filepath="PLC{plc_num}.pmc"):
+    with group(group_num=2):
+        motor(axis={axis})
+        {snippet}()
+"""
+
+
+@pytest.fixture
+def watcher(tmp_path):
+    for plc_num, snippet in [(11, "check_homed"), (12, "drive_to_limit")]:
+        script = tmp_path / f"plc{plc_num}.py"
+        script.write_text(definition.format(plc_num=plc_num, snippet=snippet, axis=1))
+    watcher = Watcher(sorted(tmp_path.glob("*.py")))
+    outputs = watcher.build()
+    assert [output.plc_num for output in outputs] == [11, 12]
+    return watcher
+
+
+def test_snippet_dependencies(watcher, tmp_path):
+    assert "check_homed.pmc.jinja" in watcher.templates[tmp_path / "PLC11.pmc"]
+    # included by drive_to_limit
+    assert "wait_for_done.pmc.jinja" in watcher.templates[tmp_path / "PLC12.pmc"]
+
+    outputs = watcher.update({jinja_path / "check_homed.pmc.jinja"})
+    assert [output.plc_num for output in outputs] == [11]
+    assert not outputs[0].changed
+
+    outputs = watcher.update({jinja_path / "plc.pmc.jinja"})
+    assert [output.plc_num for output in outputs] == [11, 12]
+
+    assert watcher.update({jinja_path / "home.pmc.jinja"}) == []
+    assert watcher.update({tmp_path / "unrelated.txt"}) == []
+
+
+def test_definition_changes(watcher, tmp_path):
+    script = tmp_path / "plc12.py"
+    outputs = watcher.update({script})
+    assert [(output.plc_num, output.skipped) for output in outputs] == [(12, True)]
+
+    script.write_text(definition.format(plc_num=12, snippet="check_homed", axis=3))
+    outputs = watcher.update({script})
+    assert [(output.plc_num, output.changed) for output in outputs] == [(12, True)]
+    assert "m345" in (tmp_path / "PLC12.pmc").read_text()
+    # the dependencies follow the new definition
+    outputs = watcher.update({jinja_path / "check_homed.pmc.jinja"})
+    assert [output.plc_num for output in outputs] == [11, 12]
+
+
+@pytest.mark.parametrize("poll", [True, False])
+def test_monitor(tmp_path, poll):
+    monitor = make_monitor(poll)
+    if not poll and not isinstance(monitor, InotifyMonitor):
+        pytest.skip("inotify is not available")
+    if isinstance(monitor, PollingMonitor):
+        monitor.interval = 0.01
+    monitor.add(tmp_path)
+    assert monitor.changes(timeout=0.05) == set()
+
+    (tmp_path / "plc11.py").write_text("changed")
+    assert monitor.changes(timeout=5) == {tmp_path / "plc11.py"}
+    if isinstance(monitor, InotifyMonitor):
+        monitor.close()